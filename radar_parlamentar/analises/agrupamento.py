@@ -0,0 +1,96 @@
+# coding=utf8
+
+# Copyright (C) 2013, Leonardo Leite
+#
+# This file is part of Radar Parlamentar.
+# 
+# Radar Parlamentar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Radar Parlamentar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Radar Parlamentar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Módulo agrupamento
+
+Agrupamento hierárquico (dendrogramas) a partir de uma matriz de distâncias.
+"""
+
+from __future__ import unicode_literals
+import heapq
+import numpy
+
+def distancias_por_periodo(matrizes):
+    """Calcula de uma só vez as matrizes de distâncias de vários períodos.
+
+    Argumentos:
+        matrizes -- lista de matrizes n x m_k (n objetos, m_k votações do período k);
+                    todas devem ter o mesmo número n de linhas e ao menos uma coluna.
+
+    Retorna lista com uma matriz n x n por período, com as distâncias euclidianas
+    entre as linhas divididas por sqrt(m_k), para que períodos com quantidades 
+    diferentes de votações sejam comparáveis.
+
+    Usa |a - b|^2 = |a|^2 + |b|^2 - 2 a.b: as normas de todos os períodos saem de um
+    só add.reduceat e os produtos internos de uma matriz n x n por período,
+    sem montar o tensor n x n x votações das diferenças.
+    """
+    if not matrizes:
+        return []
+    matrizes = [numpy.asarray(m, dtype=float) for m in matrizes]
+    todas = numpy.hstack(matrizes)
+    tamanhos = numpy.array([m.shape[1] for m in matrizes])
+    inicios = numpy.concatenate(([0], numpy.cumsum(tamanhos)[:-1]))
+    normas = numpy.add.reduceat(todas * todas, inicios, axis=1) # n x períodos
+    distancias = []
+    for k, m in enumerate(matrizes):
+        quadrados = normas[:, k, numpy.newaxis] + normas[numpy.newaxis, :, k] - 2 * numpy.dot(m, m.T)
+        quadrados = numpy.maximum(quadrados, 0) # erros de arredondamento
+        numpy.fill_diagonal(quadrados, 0)
+        distancias.append(numpy.sqrt(quadrados / tamanhos[k]))
+    return distancias
+
+def ligacao_media(distancias):
+    """Agrupamento hierárquico aglomerativo com ligação média (UPGMA).
+
+    Argumentos:
+        distancias -- matriz n x n simétrica com as distâncias entre os objetos
+
+    Retorna lista com as n-1 junções, cada uma no formato [a, b, distancia, tamanho]: 
+    os grupos a e b são unidos no grupo n+i (i é o índice da junção na lista);
+    índices menores que n são os objetos originais. É o mesmo formato da
+    matriz de ligação do scipy.cluster.hierarchy.
+
+    As distâncias candidatas ficam em um heap, então o custo é O(n^2 log n).
+    """
+    n = len(distancias)
+    d = numpy.zeros((2*n - 1, 2*n - 1)) if n > 0 else numpy.zeros((0, 0))
+    d[:n, :n] = distancias
+    tamanhos = [1] * n + [0] * (n - 1)
+    ativos = set(range(n))
+    heap = [(d[i, j], i, j) for i in range(n) for j in range(i+1, n)]
+    heapq.heapify(heap)
+    juncoes = []
+    while len(ativos) > 1:
+        distancia, a, b = heapq.heappop(heap)
+        if a not in ativos or b not in ativos:
+            continue # algum dos grupos já foi unido a outro
+        novo = n + len(juncoes)
+        ativos.discard(a)
+        ativos.discard(b)
+        tamanhos[novo] = tamanhos[a] + tamanhos[b]
+        juncoes.append([int(a), int(b), float(distancia), tamanhos[novo]])
+        outros = numpy.array(sorted(ativos), dtype=int)
+        if len(outros) > 0:
+            d[novo, outros] = (tamanhos[a] * d[a, outros] + tamanhos[b] * d[b, outros]) / tamanhos[novo]
+            d[outros, novo] = d[novo, outros]
+            for outro in outros:
+                heapq.heappush(heap, (d[novo, outro], outro, novo))
+        ativos.add(novo)
+    return juncoes
@@ -21,76 +21,605 @@
 
 from __future__ import unicode_literals
 from math import hypot, atan2, pi
+from datetime import date
 from modelagem import models
+from analises.models import LealdadePartidaria, Coalizao, SimilaridadeParlamentar
+from django.core.cache import cache
+from django.db import connection
 import grafico
 import logging
 import numpy
 import pca
+import agrupamento
 import json
+import threading
+import time
 
 logger = logging.getLogger("radar")
 
+# código de cada opção de voto, na ordem de models.OPCOES
+CODIGOS_OPCOES = dict((opcao, codigo) for codigo, (opcao, nome) in enumerate(models.OPCOES))
+SEM_VOTO = -1 # código usado quando não há voto (ou posição) registrado
+
+# índices da última dimensão de MatrizDeVotacoesBuilder.contagens_opcoes e, para
+# sim, não e abstenção, também de MatrizDeVotacoesBuilder.matriz_contagens
+# (coincidem com os códigos das respectivas opções)
+IDX_SIM = CODIGOS_OPCOES[models.SIM]
+IDX_NAO = CODIGOS_OPCOES[models.NAO]
+IDX_ABSTENCAO = CODIGOS_OPCOES[models.ABSTENCAO]
+IDX_OBSTRUCAO = CODIGOS_OPCOES[models.OBSTRUCAO]
+
+# Codificações dos votos usadas no cálculo do 'voto médio' de cada partido em cada votação.
+# Cada codificação define o valor de cada opção e quais opções contam no total de votos
+# do partido (opções que não contam, como AUSENTE na codificação padrão, são ignoradas).
+CODIFICACAO_PADRAO = 'padrao'
+CODIFICACOES = {
+    CODIFICACAO_PADRAO: 
+        ({models.SIM: 1, models.NAO: -1}, (models.SIM, models.NAO, models.ABSTENCAO, models.OBSTRUCAO)),
+    'obstrucao_como_nao': 
+        ({models.SIM: 1, models.NAO: -1, models.OBSTRUCAO: -1}, (models.SIM, models.NAO, models.ABSTENCAO, models.OBSTRUCAO)),
+    'ausencia_como_abstencao': 
+        ({models.SIM: 1, models.NAO: -1}, (models.SIM, models.NAO, models.ABSTENCAO, models.OBSTRUCAO, models.AUSENTE)),
+    'somente_sim_e_nao': 
+        ({models.SIM: 1, models.NAO: -1}, (models.SIM, models.NAO)),
+}
+
+def _vetores_codificacao(codificacao):
+    """Retorna os vetores (valores, pesos) da codificação, indexados pelos códigos das opções"""
+    valores_opcoes, opcoes_contadas = CODIFICACOES[codificacao]
+    valores = numpy.zeros(len(CODIGOS_OPCOES))
+    pesos = numpy.zeros(len(CODIGOS_OPCOES))
+    for opcao in opcoes_contadas:
+        valores[CODIGOS_OPCOES[opcao]] = valores_opcoes.get(opcao, 0)
+        pesos[CODIGOS_OPCOES[opcao]] = 1
+    return valores, pesos
+
+# tempo (em segundos) que as análises de cada período ficam no cache;
+# é o mesmo tempo usado pelo cache_page das views.
+CACHE_TIMEOUT = 60 * 60
+# as máscaras de votações só mudam com novas importações (quando são reconstruídas)
+CACHE_TIMEOUT_MASCARAS = 30 * 24 * 60 * 60
+# as coordenadas da última análise exata de cada período ficam guardadas por mais tempo,
+# para avaliar a qualidade das prévias (ver previa_do_periodo)
+CACHE_TIMEOUT_COORDENADAS = 30 * 24 * 60 * 60
+
+# fração das votações de cada período usada nas prévias
+FRACAO_PREVIA = 0.2
+
+# uma mudança de posição de partido é assinalada se explica ao menos esta fração 
+# da dispersão das suas posições, com ao menos MINIMO_PERIODOS_MUDANCA períodos 
+# em que o partido votou de cada lado da mudança (ver detecta_mudancas)
+LIMIAR_MUDANCA = 0.5
+MINIMO_PERIODOS_MUDANCA = 3
+
 class MatrizDeVotacoesBuilder:
     
-    def __init__(self, votacoes, partidos):
+    def __init__(self, votacoes, partidos, codificacao=CODIFICACAO_PADRAO):
         self.votacoes = votacoes
         self.partidos = partidos
+        self.codificacao = codificacao # nome de uma das CODIFICACOES, usada em self.matriz_votacoes
         self.matriz_votacoes =  numpy.zeros((len(self.partidos), len(self.votacoes)))
         self.matriz_presencas = numpy.zeros((len(self.partidos), len(self.votacoes)))
-        self._dic_partido_votos = {}
+        # quantidade de votos de cada partido em cada votação, para cada opção (índices em CODIGOS_OPCOES)
+        self.contagens_opcoes = numpy.zeros((len(self.partidos), len(self.votacoes), len(CODIGOS_OPCOES)), dtype=int)
+        # quantidade de votos sim, não e abstenção (obstrução conta como abstenção) de cada partido em cada votação
+        self.matriz_contagens = numpy.zeros((len(self.partidos), len(self.votacoes), 3), dtype=int)
+        # resultado normalizado (models.APROVADO, models.REJEITADO ou models.SEM_RESULTADO) de cada votação
+        self.resultados = numpy.zeros(len(self.votacoes), dtype=int)
+        self._indices_partidos = dict((partido.id, ip) for ip, partido in enumerate(self.partidos))
+        # (id da legislatura, índice partido, índice votação, código da opção) de cada voto:
+        self._votos_legislaturas = numpy.zeros((0, 4), dtype=int)
+        # calculados por self.gera_matriz_codigos():
+        self.legislaturas = []          # ids das legislaturas, na ordem das linhas da matriz de códigos
+        self.partidos_legislaturas = [] # índice (em self.partidos) do partido de cada legislatura
         
     def gera_matriz(self):
         """Cria os 'vetores de votação' para cada partido. 
     
         O 'vetor' usa um número entre -1 (não) e 1 (sim) para representar a "posição média"
         do partido em cada votação, tendo N dimensões correspondentes às N votações.
+        A posição média é calculada segundo a codificação self.codificacao.
         Aproveita para calcular presença dos parlamentares.
     
         Retorna a 'matriz de votações', em que cada linha é um vetor de votações de um partido 
                 A ordenação das linhas segue a ordem de self.partidos
         """
-        iv = -1 # índice votação
-        for votacao in self.votacoes:
-            iv += 1
-            self._agrega_votos(votacao)
-            self._preenche_matrizes(votacao, iv)
+        ids_votacoes = [votacao.id for votacao in self.votacoes]
+        indices_votacoes = dict((id_votacao, iv) for iv, id_votacao in enumerate(ids_votacoes))
+        votos = [(id_leg, self._indices_partidos.get(id_partido, -1), indices_votacoes[id_votacao],
+                  CODIGOS_OPCOES.get(opcao, SEM_VOTO))
+                 for id_votacao, id_leg, id_partido, opcao in self._consulta_votos(ids_votacoes)]
+        votos = numpy.array(votos, dtype=int).reshape(-1, 4)
+        self.resultados = numpy.array([votacao.resultado_normalizado for votacao in self.votacoes], dtype=int)
+        # sem votos as matrizes ficam zeradas (o numpy 1.7 não aplica máscaras em arrays vazios)
+        if votos.size == 0:
+            return self.matriz_votacoes
+        votos = votos[votos[:,1] >= 0] # ignora votos de partidos fora da análise
+        self._votos_legislaturas = votos
+        if votos.size == 0:
+            return self.matriz_votacoes
+        validos = votos[votos[:,3] != SEM_VOTO]
+        if validos.size == 0:
+            return self.matriz_votacoes
+        num_opcoes = len(CODIGOS_OPCOES)
+        celulas = (validos[:,1] * len(ids_votacoes) + validos[:,2]) * num_opcoes + validos[:,3]
+        tamanho = self.contagens_opcoes.size
+        self.contagens_opcoes = numpy.bincount(celulas, minlength=tamanho).reshape(self.contagens_opcoes.shape)
+        self.matriz_contagens = self.contagens_opcoes[:,:,0:3].copy()
+        self.matriz_contagens[:,:,IDX_ABSTENCAO] += self.contagens_opcoes[:,:,IDX_OBSTRUCAO]
+        self.matriz_presencas = self.matriz_contagens.sum(axis=2).astype(float)
+        self.matriz_votacoes = self.gera_matrizes_codificadas([self.codificacao])[self.codificacao]
         return self.matriz_votacoes  
+
+    def gera_matrizes_codificadas(self, codificacoes):
+        """Calcula de uma só vez as matrizes de votações em várias codificações.
+
+        Deve ser chamado depois de gera_matriz(); não acessa o banco de dados.
+
+        Argumentos:
+            codificacoes -- lista de nomes de codificações (chaves de CODIFICACOES)
+
+        Retorna dicionário em que a chave é o nome da codificação e o valor é a matriz de votações.
+        """
+        vetores = [_vetores_codificacao(codificacao) for codificacao in codificacoes]
+        valores = numpy.array([v for v, p in vetores]).T # opções x codificações
+        pesos = numpy.array([p for v, p in vetores]).T
+        somas = numpy.tensordot(self.contagens_opcoes, valores, axes=([2], [0]))
+        totais = numpy.tensordot(self.contagens_opcoes, pesos, axes=([2], [0]))
+        medias = somas / numpy.maximum(totais, 1.0) # voto médio
+        return dict((codificacao, medias[:,:,k]) for k, codificacao in enumerate(codificacoes))
+
+    def fatia(self, colunas):
+        """Retorna um novo MatrizDeVotacoesBuilder, já calculado, somente com as votações
+        das colunas (um slice ou uma lista de índices de votações).
+        Deve ser chamado depois de gera_matriz(); não acessa o banco de dados."""
+        indices = numpy.arange(len(self.votacoes))[colunas]
+        fatia = MatrizDeVotacoesBuilder([self.votacoes[iv] for iv in indices], self.partidos, self.codificacao)
+        fatia.contagens_opcoes = self.contagens_opcoes[:, indices, :]
+        fatia.matriz_contagens = self.matriz_contagens[:, indices, :]
+        fatia.matriz_presencas = self.matriz_presencas[:, indices]
+        fatia.matriz_votacoes = self.matriz_votacoes[:, indices]
+        fatia.resultados = self.resultados[indices]
+        novos_indices = -numpy.ones(len(self.votacoes), dtype=int)
+        novos_indices[indices] = numpy.arange(len(indices))
+        votos = self._votos_legislaturas
+        if votos.size > 0:
+            votos = votos[novos_indices[votos[:,2]] >= 0]
+            votos[:,2] = novos_indices[votos[:,2]]
+        fatia._votos_legislaturas = votos
+        return fatia
+
+    def _consulta_votos(self, ids_votacoes, tamanho_lote=500):
+        """Retorna (id votação, id legislatura, id partido, opção) de todos os votos das votações.
+        As votações são consultadas em lotes por causa do limite de parâmetros do SQLite."""
+        for i in range(0, len(ids_votacoes), tamanho_lote):
+            lote = ids_votacoes[i:i+tamanho_lote]
+            for voto in models.Voto.objects.filter(votacao__in=lote).values_list(
+                    'votacao', 'legislatura', 'partido', 'opcao'):
+                yield voto
+
+    def gera_matriz_coesoes(self):
+        """Calcula a coesão (índice de Rice) de cada partido em cada votação: 
+        |sim - não| / (sim + não + abstenção).
+
+        Deve ser chamado depois de gera_matriz(); partidos sem votos numa votação
+        ficam com coesão zero nessa votação.
+
+        Retorna a 'matriz de coesões', com a mesma forma da matriz de votações.
+        """
+        sim = self.matriz_contagens[:,:,IDX_SIM]
+        nao = self.matriz_contagens[:,:,IDX_NAO]
+        total = self.matriz_contagens.sum(axis=2)
+        return numpy.abs(sim - nao) / numpy.maximum(total, 1.0)
+
+    def gera_matriz_pivos(self):
+        """Indica se cada partido foi decisivo em cada votação: se os votos sim do
+        partido passassem a não e vice-versa, mudaria o lado (sim ou não) com mais votos.
+
+        Com d = sim - não no total da votação e d_p = sim - não do partido, o partido
+        é decisivo quando o sinal de d - 2 d_p é diferente do sinal de d.
+        Deve ser chamado depois de gera_matriz().
+
+        Retorna matriz booleana com a mesma forma da matriz de votações.
+        """
+        saldos = self.matriz_contagens[:,:,IDX_SIM] - self.matriz_contagens[:,:,IDX_NAO]
+        diferencas = saldos.sum(axis=0)
+        return numpy.sign(diferencas - 2 * saldos) != numpy.sign(diferencas)
+
+    def gera_matriz_maiorias(self):
+        """Calcula a posição majoritária (IDX_SIM, IDX_NAO ou IDX_ABSTENCAO) de cada
+        partido em cada votação; vale SEM_VOTO se o partido não votou ou se houve empate.
+
+        Deve ser chamado depois de gera_matriz().
+        """
+        ordenadas = numpy.sort(self.matriz_contagens, axis=2)
+        maiorias = self.matriz_contagens.argmax(axis=2)
+        maiorias[ordenadas[:,:,-1] == ordenadas[:,:,-2]] = SEM_VOTO
+        return maiorias
+
+    def gera_matriz_codigos(self):
+        """Cria a matriz (legislaturas x votações) com o código (CODIGOS_OPCOES) do voto
+        de cada legislatura em cada votação, ou SEM_VOTO se não houve voto registrado.
+
+        Deve ser chamado depois de gera_matriz(). A ordenação das linhas segue
+        self.legislaturas, e self.partidos_legislaturas traz o partido de cada linha.
+        """
+        votos = self._votos_legislaturas
+        self.legislaturas, il = numpy.unique(votos[:,0], return_inverse=True)
+        self.partidos_legislaturas = numpy.zeros(len(self.legislaturas), dtype=int)
+        self.partidos_legislaturas[il] = votos[:,1]
+        matriz_codigos = numpy.empty((len(self.legislaturas), len(self.votacoes)), dtype=numpy.int8)
+        matriz_codigos.fill(SEM_VOTO)
+        matriz_codigos[il, votos[:,2]] = votos[:,3]
+        return matriz_codigos
+
+
+class MatrizesDaCasaLegislativa:
+    """Matrizes de todas as votações de uma casa legislativa, em ordem cronológica.
+
+    Permite obter as colunas das votações de qualquer período sem novos acessos 
+    ao banco de dados. Como as matrizes ficam no cache, das votações são guardados
+    só os ids e as datas (as listas de votações do builder e das suas fatias são 
+    listas de ids); os objetos Votacao das colunas são lidos com carrega_votacoes.
+
+    Atributos:
+        ids_votacoes -- vetor com os ids das votações, na ordem das colunas
+        datas -- vetor com os ordinais (date.toordinal) das datas das votações
+    """
+
+    def __init__(self, casa_legislativa, partidos=None):
+        self.casa_legislativa = casa_legislativa
+        self.partidos = list(partidos if partidos else casa_legislativa.partidos())
+        votacoes = list(models.Votacao.objects.filter(casa_legislativa=casa_legislativa, data__isnull=False)
+                        .order_by('data', 'id').only('id', 'data', 'resultado_normalizado'))
+        self.ids_votacoes = numpy.array([votacao.id for votacao in votacoes], dtype=int)
+        self.datas = numpy.array([votacao.data.toordinal() for votacao in votacoes], dtype=int)
+        self.builder = MatrizDeVotacoesBuilder(votacoes, self.partidos)
+        self.matriz_votacoes = self.builder.gera_matriz()
+        self.builder.votacoes = list(self.ids_votacoes)
+
+    def colunas(self, periodo):
+        """Retorna o slice das colunas (votações) que pertencem ao período"""
+        ini = numpy.searchsorted(self.datas, periodo.ini.toordinal(), 'left')
+        fim = numpy.searchsorted(self.datas, periodo.fim.toordinal(), 'right')
+        return slice(ini, fim)
+
+    def carrega_votacoes(self, colunas=slice(None)):
+        """Retorna a lista dos objetos Votacao das colunas (um slice ou uma lista de
+        índices de votações; por padrão, todas), lidos do banco numa só consulta."""
+        indices = numpy.arange(len(self.ids_votacoes))[colunas]
+        if len(indices) == 0:
+            return []
+        ini = date.fromordinal(self.datas[indices].min())
+        fim = date.fromordinal(self.datas[indices].max())
+        votacoes = models.Votacao.objects.filter(casa_legislativa=self.casa_legislativa, data__gte=ini, data__lte=fim)
+        por_id = dict((votacao.id, votacao) for votacao in votacoes)
+        return [por_id[id_votacao] for id_votacao in self.ids_votacoes[indices]]
+
+def chave_cache_matrizes(casa_legislativa):
+    """Chave do cache em que ficam guardadas as MatrizesDaCasaLegislativa da casa"""
+    return 'matrizes_casa:%s' % casa_legislativa.nome_curto
+
+class MascarasDeVotacoes:
+    """Máscaras (vetores booleanos) sobre as colunas de MatrizesDaCasaLegislativa que 
+    indicam as votações de cada categoria: sigla da proposição (PL, PEC, MPV...), ano, 
+    resultado normalizado (models.APROVADO, models.REJEITADO ou models.SEM_RESULTADO),
+    e se a votação é nominal (se tem votos registrados).
+
+    Uma análise filtrada (ex: "somente PECs") é então um E lógico das máscaras seguido
+    da seleção das colunas das matrizes da casa (ver analise_filtrada).
+    As máscaras são guardadas compactadas com numpy.packbits.
+    """
+
+    SIGLA = 'sigla'
+    ANO = 'ano'
+    RESULTADO = 'resultado'
+    NOMINAL = 'nominal'
+
+    def __init__(self, casa_legislativa):
+        self.casa_legislativa = casa_legislativa
+        # mesma ordem de MatrizesDaCasaLegislativa.ids_votacoes:
+        votacoes = models.Votacao.objects.filter(casa_legislativa=casa_legislativa, 
+                                                 data__isnull=False).order_by('data', 'id')
+        votacoes = list(votacoes.values_list('id', 'proposicao__sigla', 'data', 'resultado_normalizado'))
+        nominais = set(models.Voto.objects.filter(casa_legislativa=casa_legislativa)
+                                          .values_list('votacao', flat=True).distinct())
+        self.num_votacoes = len(votacoes)
+        self._mascaras = {} # (categoria, valor) => bits da máscara (numpy.packbits)
+        categorias = {
+            MascarasDeVotacoes.SIGLA: [sigla for id_vot, sigla, data, resultado in votacoes],
+            MascarasDeVotacoes.ANO: [data.year for id_vot, sigla, data, resultado in votacoes],
+            MascarasDeVotacoes.RESULTADO: [resultado for id_vot, sigla, data, resultado in votacoes],
+            MascarasDeVotacoes.NOMINAL: [id_vot in nominais for id_vot, sigla, data, resultado in votacoes],
+        }
+        for categoria, valores in categorias.items():
+            for valor in set(valores):
+                mascara = numpy.array([v == valor for v in valores], dtype=numpy.uint8)
+                self._mascaras[(categoria, valor)] = numpy.packbits(mascara)
+
+    def valores(self, categoria):
+        """Retorna os valores existentes de uma categoria (ex: as siglas)"""
+        return sorted(valor for cat, valor in self._mascaras.keys() if cat == categoria)
+
+    def mascara(self, **filtros):
+        """Retorna o vetor booleano das votações que satisfazem todos os filtros.
+
+        Cada filtro é categoria=lista de valores aceitos, exceto nominal, que recebe
+        um booleano. Ex: mascara(sigla=['PEC', 'MPV'], ano=[2011, 2012], resultado=[models.APROVADO], nominal=True)
+        """
+        mascara = numpy.ones(self.num_votacoes, dtype=bool)
+        for categoria, valores in filtros.items():
+            if categoria not in [self.SIGLA, self.ANO, self.RESULTADO, self.NOMINAL]:
+                raise ValueError('Categoria de votação desconhecida: %s' % categoria)
+            if categoria == self.NOMINAL:
+                valores = [bool(valores)]
+            da_categoria = numpy.zeros(self.num_votacoes, dtype=bool)
+            for valor in valores:
+                bits = self._mascaras.get((categoria, valor))
+                if bits is not None:
+                    da_categoria |= numpy.unpackbits(bits)[:self.num_votacoes].astype(bool)
+            mascara &= da_categoria
+        return mascara
+
+def chave_cache_mascaras(casa_legislativa):
+    """Chave do cache em que ficam guardadas as MascarasDeVotacoes da casa"""
+    return 'mascaras_casa:%s' % casa_legislativa.nome_curto
+
+def constroi_mascaras(casa_legislativa):
+    """Constrói as MascarasDeVotacoes da casa e as guarda no cache"""
+    mascaras = MascarasDeVotacoes(casa_legislativa)
+    cache.set(chave_cache_mascaras(casa_legislativa), mascaras, CACHE_TIMEOUT_MASCARAS)
+    return mascaras
+
+def mascaras_da_casa(casa_legislativa):
+    """Retorna as MascarasDeVotacoes da casa, recuperando-as do cache quando possível"""
+    mascaras = cache.get(chave_cache_mascaras(casa_legislativa))
+    if mascaras == None:
+        mascaras = constroi_mascaras(casa_legislativa)
+    return mascaras
+
+class PresencasMensais:
+    """Presença de cada parlamentar em cada mês com votações de uma casa legislativa
+    (para o mapa de calor de presenças).
+
+    Calculada a partir da matriz de códigos dos votos das MatrizesDaCasaLegislativa
+    (legislaturas x votações), sem instanciar objetos Voto; as legislaturas de um 
+    mesmo parlamentar são somadas.
+
+    Atributos:
+        meses -- lista de strings 'aaaa-mm', em ordem cronológica
+        votacoes -- vetor com a quantidade de votações de cada mês
+        parlamentares -- lista de tuplas (id, nome) dos parlamentares, na ordem das linhas
+        presencas -- matriz int16 parlamentares x meses com a quantidade de votos
+                     (exceto AUSENTE) do parlamentar nas votações do mês
+        votos -- idem, contando todos os votos registrados (inclusive AUSENTE)
+    """
+
+    def __init__(self, casa_legislativa):
+        matrizes = matrizes_da_casa(casa_legislativa)
+        codigos = matrizes.builder.gera_matriz_codigos()
+        datas = [date.fromordinal(ordinal) for ordinal in matrizes.datas]
+        chaves_meses = numpy.array([data.year * 12 + data.month - 1 for data in datas], dtype=int)
+        chaves, meses_votacoes = numpy.unique(chaves_meses, return_inverse=True)
+        self.meses = ['%04d-%02d' % (chave // 12, chave % 12 + 1) for chave in chaves]
+        self.votacoes = numpy.bincount(meses_votacoes, minlength=len(chaves)) if len(chaves) else numpy.zeros(0, dtype=int)
+        parlamentares_legislaturas = self._parlamentares_das_legislaturas(matrizes.builder.legislaturas)
+        ids_parlamentares, linhas = numpy.unique([id_parl for id_parl, nome in parlamentares_legislaturas], 
+                                                 return_inverse=True)
+        nomes = dict(parlamentares_legislaturas)
+        self.parlamentares = [(int(id_parl), nomes[id_parl]) for id_parl in ids_parlamentares]
+        forma = (len(self.parlamentares), len(self.meses))
+        registrados = codigos != SEM_VOTO
+        presentes = registrados & (codigos != CODIGOS_OPCOES[models.AUSENTE])
+        self.votos = self._conta(registrados, linhas, meses_votacoes, forma)
+        self.presencas = self._conta(presentes, linhas, meses_votacoes, forma)
+
+    @staticmethod
+    def _parlamentares_das_legislaturas(legislaturas, tamanho_lote=500):
+        """Retorna lista de (id, nome) do parlamentar de cada legislatura, na mesma ordem"""
+        dados = {}
+        legislaturas = [int(id_leg) for id_leg in legislaturas]
+        for i in range(0, len(legislaturas), tamanho_lote):
+            for id_leg, id_parl, nome in models.Legislatura.objects.filter(id__in=legislaturas[i:i+tamanho_lote]
+                    ).values_list('id', 'parlamentar', 'parlamentar__nome'):
+                dados[id_leg] = (id_parl, nome)
+        return [dados[id_leg] for id_leg in legislaturas]
+
+    @staticmethod
+    def _conta(marcados, linhas, meses_votacoes, forma):
+        """Conta as células marcadas da matriz legislaturas x votações por (parlamentar, mês)"""
+        if not marcados.size:
+            return numpy.zeros(forma, dtype=numpy.int16)
+        il, iv = numpy.nonzero(marcados)
+        celulas = linhas[il] * forma[1] + meses_votacoes[iv]
+        contagens = numpy.bincount(celulas, minlength=forma[0] * forma[1])
+        return numpy.minimum(contagens, numpy.iinfo(numpy.int16).max).astype(numpy.int16).reshape(forma)
+
+    def json(self):
+        return json.dumps({
+            "meses": self.meses,
+            "votacoes": self.votacoes.tolist(),
+            "parlamentares": [{"id": id_parl, "nome": nome} for id_parl, nome in self.parlamentares],
+            "presencas": self.presencas.tolist(),
+            "votos": self.votos.tolist(),
+        })
+
+def chave_cache_presencas(casa_legislativa):
+    """Chave do cache em que ficam guardadas as PresencasMensais da casa"""
+    return 'presencas_casa:%s' % casa_legislativa.nome_curto
+
+def presencas_da_casa(casa_legislativa):
+    """Retorna as PresencasMensais da casa, recuperando-as do cache quando possível"""
+    presencas = cache.get(chave_cache_presencas(casa_legislativa))
+    if presencas == None:
+        presencas = PresencasMensais(casa_legislativa)
+        cache.set(chave_cache_presencas(casa_legislativa), presencas, CACHE_TIMEOUT_MASCARAS)
+    return presencas
+
+def matrizes_da_casa(casa_legislativa):
+    """Retorna as MatrizesDaCasaLegislativa (com todos os partidos) da casa,
+    recuperando-as do cache quando possível."""
+    matrizes = cache.get(chave_cache_matrizes(casa_legislativa))
+    if matrizes == None:
+        matrizes = MatrizesDaCasaLegislativa(casa_legislativa)
+        cache.set(chave_cache_matrizes(casa_legislativa), matrizes, CACHE_TIMEOUT)
+    return matrizes
+
+
+class LealdadeBuilder:
+    """Calcula, para cada legislatura e período, a fração dos votos dados de acordo
+    com a posição majoritária do partido (vide models.LealdadePartidaria)."""
+
+    def __init__(self, casa_legislativa, periodicidade=models.BIENIO):
+        self.casa_legislativa = casa_legislativa
+        self.periodicidade = periodicidade
+        self.lealdades = []
+
+    def gera_lealdades(self):
+        """Retorna lista (não salva no banco) de objetos do tipo LealdadePartidaria;
+        todas as votações da casa são lidas do banco de dados uma única vez."""
+        matrizes = MatrizesDaCasaLegislativa(self.casa_legislativa)
+        codigos = matrizes.builder.gera_matriz_codigos()
+        maiorias = matrizes.builder.gera_matriz_maiorias()
+        # obstrução conta como abstenção, assim como em models.VotosAgregados
+        codigos[codigos == CODIGOS_OPCOES[models.OBSTRUCAO]] = IDX_ABSTENCAO
+        legislaturas = models.Legislatura.objects.in_bulk(list(matrizes.builder.legislaturas))
+        self.lealdades = []
+        for periodo in self.casa_legislativa.periodos(self.periodicidade):
+            colunas = matrizes.colunas(periodo)
+            votos, votos_com_partido = self._conta_votos(codigos[:, colunas], maiorias[:, colunas], 
+                                                         matrizes.builder.partidos_legislaturas)
+            for id_leg, v, vp in zip(matrizes.builder.legislaturas, votos, votos_com_partido):
+                if v > 0:
+                    leg = legislaturas[id_leg]
+                    self.lealdades.append(LealdadePartidaria(casa_legislativa=self.casa_legislativa, 
+                            parlamentar_id=leg.parlamentar_id, legislatura=leg, 
+                            periodicidade=self.periodicidade, inicio=periodo.ini, fim=periodo.fim, 
+                            votos=int(v), votos_com_partido=int(vp), lealdade=1.0 * vp / v))
+        return self.lealdades
+
+    def _conta_votos(self, codigos, maiorias, partidos_legislaturas):
+        """Para cada legislatura (linha de codigos), retorna a quantidade de votos 
+        considerados e quantos deles seguiram a maioria do partido"""
+        maiorias_legislaturas = maiorias[partidos_legislaturas] # maioria do partido de cada legislatura
+        considerados = (codigos >= 0) & (codigos <= IDX_ABSTENCAO) & (maiorias_legislaturas != SEM_VOTO)
+        com_partido = considerados & (codigos == maiorias_legislaturas)
+        return considerados.sum(axis=1), com_partido.sum(axis=1)
+
+    def salva_lealdades(self, tamanho_lote=100):
+        """Substitui no banco de dados as lealdades desta casa legislativa e periodicidade"""
+        if not self.lealdades:
+            self.gera_lealdades()
+        LealdadePartidaria.objects.filter(casa_legislativa=self.casa_legislativa, 
+                                          periodicidade=self.periodicidade).delete()
+        for i in range(0, len(self.lealdades), tamanho_lote):
+            LealdadePartidaria.objects.bulk_create(self.lealdades[i:i+tamanho_lote])
     
-    def _agrega_votos(self, votacao):
-        self._dic_partido_votos = {}
-        for partido in self.partidos:
-            self._dic_partido_votos[partido.nome] = models.VotoPartido(partido.nome)
-        # com o "select_related" fazemos uma query eager
-        votos = votacao.voto_set.select_related('legislatura__partido', 'opcao').all() 
-        for voto in votos:
-            nome_partido = voto.legislatura.partido.nome
-            voto_partido = self._dic_partido_votos[nome_partido]
-            voto_partido.add(voto.opcao) 
-            
-    def _preenche_matrizes(self, votacao, iv):
-        ip = -1 # índice partido 
-        for partido in self.partidos:
-            ip += 1
-            if self._dic_partido_votos.has_key(partido.nome):
-                voto_partido = self._dic_partido_votos[partido.nome] 
-                self.matriz_votacoes[ip][iv] = voto_partido.voto_medio() 
-                self.matriz_presencas[ip][iv] = voto_partido.total()
-            else:
-                self.matriz_votacoes[ip][iv] = 0
-                self.matriz_presencas[ip][iv] = 0
-    
+class SimilaridadeBuilder:
+    """Calcula, para cada legislatura e período, as k legislaturas que votaram de forma 
+    mais parecida, considerando apenas as votações em que ambas votaram 
+    (vide models.SimilaridadeParlamentar).
+
+    As concordâncias de todos os pares são calculadas com produtos de matrizes sobre
+    a matriz de códigos (legislaturas x votações), uma matriz indicadora por opção.
+    """
+
+    def __init__(self, casa_legislativa, periodicidade=models.ANO, k=10, numero_minimo_de_votacoes=1):
+        self.casa_legislativa = casa_legislativa
+        self.periodicidade = periodicidade
+        self.k = k
+        self.numero_minimo_de_votacoes = numero_minimo_de_votacoes # votações em comum para um par ser considerado
+        self.similaridades = []
+
+    def gera_similaridades(self):
+        """Retorna lista (não salva no banco) de objetos do tipo SimilaridadeParlamentar;
+        todas as votações da casa são lidas do banco de dados uma única vez."""
+        matrizes = MatrizesDaCasaLegislativa(self.casa_legislativa)
+        codigos = matrizes.builder.gera_matriz_codigos()
+        # obstrução conta como abstenção, assim como em models.VotosAgregados
+        codigos[codigos == IDX_OBSTRUCAO] = IDX_ABSTENCAO
+        legislaturas = numpy.array(matrizes.builder.legislaturas)
+        self.similaridades = []
+        for periodo in self.casa_legislativa.periodos(self.periodicidade):
+            codigos_periodo = codigos[:, matrizes.colunas(periodo)]
+            presentes = ((codigos_periodo >= 0) & (codigos_periodo <= IDX_ABSTENCAO)).any(axis=1)
+            ids = legislaturas[presentes]
+            similaridades, comuns, ordem = self._mais_parecidas(codigos_periodo[presentes])
+            for il in range(len(ids)):
+                for posicao, isim in enumerate(ordem[il]):
+                    if similaridades[il, isim] < 0:
+                        break # não há mais legislaturas com votações em comum suficientes
+                    self.similaridades.append(SimilaridadeParlamentar(casa_legislativa=self.casa_legislativa,
+                            periodicidade=self.periodicidade, inicio=periodo.ini, fim=periodo.fim,
+                            legislatura_id=int(ids[il]), similar_id=int(ids[isim]), posicao=posicao + 1,
+                            votacoes=int(comuns[il, isim]), similaridade=float(similaridades[il, isim])))
+        return self.similaridades
+
+    def _mais_parecidas(self, codigos):
+        """Retorna a matriz (legislaturas x legislaturas) de similaridades (-1 para os pares
+        desconsiderados), a matriz de votações em comum e, para cada legislatura, os índices
+        das k legislaturas mais parecidas, da mais para a menos parecida."""
+        concordancias = numpy.zeros((len(codigos), len(codigos)), dtype=numpy.float32)
+        for codigo in [IDX_SIM, IDX_NAO, IDX_ABSTENCAO]:
+            indicadora = (codigos == codigo).astype(numpy.float32)
+            concordancias += numpy.dot(indicadora, indicadora.T)
+        presentes = ((codigos >= 0) & (codigos <= IDX_ABSTENCAO)).astype(numpy.float32)
+        comuns = numpy.dot(presentes, presentes.T)
+        similaridades = concordancias / numpy.maximum(comuns, 1)
+        similaridades[comuns < max(self.numero_minimo_de_votacoes, 1)] = -1
+        similaridades[numpy.arange(len(codigos)), numpy.arange(len(codigos))] = -1 # a própria legislatura
+        ordem = numpy.argsort(-similaridades, axis=1, kind='mergesort')[:, :self.k]
+        return similaridades, comuns, ordem
+
+    def salva_similaridades(self, tamanho_lote=100):
+        """Substitui no banco de dados as similaridades desta casa legislativa e periodicidade"""
+        if not self.similaridades:
+            self.gera_similaridades()
+        SimilaridadeParlamentar.objects.filter(casa_legislativa=self.casa_legislativa, 
+                                               periodicidade=self.periodicidade).delete()
+        for i in range(0, len(self.similaridades), tamanho_lote):
+            SimilaridadeParlamentar.objects.bulk_create(self.similaridades[i:i+tamanho_lote])
+
 class TamanhoPartidoBuilder:
+    """Calcula o tamanho de cada partido entre as datas ini e fim (por padrão, em 
+    todas as votações da casa) como a quantidade média de votos do partido por votação,
+    e a presença de cada partido (fração dos seus votos que não são AUSENTE).
+    Os valores vêm do cubo de votos da casa (models.CuboDeVotos), sem consultar os votos;
+    quem analisa vários períodos passa o mesmo cubo a todos os builders (argumento cubo)."""
     
-    def __init__(self, partidos, casa_legislativa):
+    def __init__(self, partidos, casa_legislativa, ini=None, fim=None, cubo=None):
         self.partidos = partidos
         self.casa_legislativa = casa_legislativa
+        self.ini = ini
+        self.fim = fim
+        self.cubo = cubo
         self.tamanhos = {}
+        self.presencas = {}
         self.soma_dos_tamanhos_dos_partidos = 0
         
     def gera_dic_tamanho_partidos(self):
+        cubo = self.cubo if self.cubo != None else models.CuboDeVotos.da_casa(self.casa_legislativa)
+        tamanhos = cubo.tamanhos_partidos(self.ini, self.fim)
+        presencas = cubo.presencas_partidos(self.ini, self.fim)
         for partido in self.partidos:
-            tamanho = models.Legislatura.objects.filter(casa_legislativa=self.casa_legislativa, partido=partido).count()
-            self.tamanhos[partido.nome] = tamanho
+            self.tamanhos[partido.nome] = tamanhos.get(partido.nome, 0)
+            if partido.nome in presencas:
+                self.presencas[partido.nome] = presencas[partido.nome]
+        self._calcula_soma_dos_tamanhos()
+        return self.tamanhos
+
+    def gera_dic_tamanho_partidos_de(self, matrizesBuilder):
+        """Calcula os tamanhos e as presenças dos partidos a partir das contagens de votos
+        de um MatrizDeVotacoesBuilder já calculado (ex: a fatia de uma análise filtrada),
+        considerando só as votações dele, em vez de todas as votações entre ini e fim."""
+        contagens = matrizesBuilder.contagens_opcoes
+        num_votacoes = max(contagens.shape[1], 1)
+        totais = contagens.sum(axis=2).sum(axis=1)
+        ausentes = contagens[:, :, CODIGOS_OPCOES[models.AUSENTE]].sum(axis=1)
+        for partido, total, ausente in zip(self.partidos, totais, ausentes):
+            self.tamanhos[partido.nome] = float(total) / num_votacoes
+            if total > 0:
+                self.presencas[partido.nome] = float(total - ausente) / total
         self._calcula_soma_dos_tamanhos()
         return self.tamanhos
     
@@ -100,9 +629,117 @@ class TamanhoPartidoBuilder:
         """
         self.soma_dos_tamanhos_dos_partidos = sum(self.tamanhos.values())
 
+class CoalizaoBuilder:
+    """Detecta, para cada período, o bloco majoritário de partidos de uma casa 
+    legislativa (vide models.Coalizao).
+
+    Em cada período calcula-se a matriz de concordância entre partidos (fração das
+    votações em que ambos se posicionaram e votaram no mesmo sentido); os partidos
+    são divididos em dois blocos pelo sinal do autovetor principal da matriz de
+    concordância duplamente centralizada, e a coalizão é o bloco com mais parlamentares.
+    """
+
+    def __init__(self, casa_legislativa, periodicidade=models.MES):
+        self.casa_legislativa = casa_legislativa
+        self.periodicidade = periodicidade
+        self.coalizoes = [] # lista de tuplas (periodo, lista de partidos)
+
+    def gera_coalizoes(self):
+        """Retorna lista de tuplas (periodo, lista de objetos Partido);
+        todas as votações da casa são lidas do banco de dados uma única vez."""
+        matrizes = MatrizesDaCasaLegislativa(self.casa_legislativa)
+        codigos = matrizes.builder.gera_matriz_codigos()
+        partidos_legislaturas = matrizes.builder.partidos_legislaturas
+        sentidos = numpy.sign(matrizes.matriz_votacoes)
+        self.coalizoes = []
+        for periodo in self.casa_legislativa.periodos(self.periodicidade, numero_minimo_de_votacoes=1):
+            colunas = matrizes.colunas(periodo)
+            # tamanho de cada partido: quantidade de legislaturas que votaram no período
+            votaram = (codigos[:, colunas] != SEM_VOTO).any(axis=1)
+            tamanhos = numpy.bincount(partidos_legislaturas[votaram], minlength=len(matrizes.partidos))
+            bloco = self._bloco_majoritario(sentidos[:, colunas], tamanhos)
+            partidos = [p for p, b in zip(matrizes.partidos, bloco) if b]
+            self.coalizoes.append((periodo, partidos))
+        return self.coalizoes
+
+    def _bloco_majoritario(self, sentidos, tamanhos):
+        """Recebe a matriz (partidos x votações) com o sentido (+1, -1 ou 0) dos votos 
+        de cada partido e o tamanho de cada partido; retorna vetor booleano indicando
+        os partidos do bloco majoritário."""
+        sim = (sentidos > 0).astype(float)
+        nao = (sentidos < 0).astype(float)
+        posicionados = sim + nao
+        ambos = numpy.dot(posicionados, posicionados.T)
+        concordancias = (numpy.dot(sim, sim.T) + numpy.dot(nao, nao.T)) / numpy.maximum(ambos, 1)
+        presentes = (posicionados.sum(axis=1) > 0) & (tamanhos > 0)
+        bloco = numpy.zeros(len(tamanhos), dtype=bool)
+        if presentes.sum() <= 1:
+            bloco[presentes] = True
+            return bloco
+        k = concordancias[presentes][:, presentes]
+        k = k - k.mean(axis=0) - k.mean(axis=1)[:, numpy.newaxis] + k.mean()
+        autovalores, autovetores = numpy.linalg.eigh(k)
+        lado = autovetores[:, -1] >= 0
+        if tamanhos[presentes][lado].sum() < tamanhos[presentes][~lado].sum():
+            lado = ~lado
+        bloco[numpy.flatnonzero(presentes)[lado]] = True
+        return bloco
+
+    def salva_coalizoes(self):
+        """Substitui no banco de dados as coalizões desta casa legislativa e periodicidade"""
+        if not self.coalizoes:
+            self.gera_coalizoes()
+        Coalizao.objects.filter(casa_legislativa=self.casa_legislativa, 
+                                periodicidade=self.periodicidade).delete()
+        for periodo, partidos in self.coalizoes:
+            coalizao = Coalizao.objects.create(casa_legislativa=self.casa_legislativa, 
+                    periodicidade=self.periodicidade, inicio=periodo.ini, fim=periodo.fim)
+            coalizao.partidos.add(*partidos)
+
+
+def detecta_coalizoes(periodicidade=models.MES):
+    """Detecta e salva as coalizões de todas as casas legislativas"""
+    for casa_legislativa in models.CasaLegislativa.objects.all():
+        if models.Votacao.objects.filter(casa_legislativa=casa_legislativa).exists():
+            logger.info("Detectando coalizões de %s" % casa_legislativa.nome_curto)
+            CoalizaoBuilder(casa_legislativa, periodicidade).salva_coalizoes()
+
+def calcula_similaridades(periodicidade=models.ANO, k=10):
+    """Calcula e salva as similaridades entre parlamentares de todas as casas legislativas"""
+    for casa_legislativa in models.CasaLegislativa.objects.all():
+        if models.Votacao.objects.filter(casa_legislativa=casa_legislativa).exists():
+            logger.info("Calculando similaridades de %s" % casa_legislativa.nome_curto)
+            SimilaridadeBuilder(casa_legislativa, periodicidade, k).salva_similaridades()
+
+def colunas_unicas(matriz):
+    """Agrupa as colunas iguais da matriz.
+
+    Retorna (unicas, contagens, inversa): a matriz com uma coluna de cada grupo, na ordem
+    da primeira ocorrência, a quantidade de colunas de cada grupo e, para cada coluna
+    da matriz, o índice do seu grupo (matriz == unicas[:, inversa]).
+    """
+    num_colunas = matriz.shape[1]
+    if num_colunas == 0:
+        return matriz, numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    ordem = numpy.lexsort(matriz[::-1]) # colunas em ordem lexicográfica (estável)
+    ordenada = matriz[:, ordem]
+    novo_grupo = numpy.ones(num_colunas, dtype=bool)
+    novo_grupo[1:] = (ordenada[:, 1:] != ordenada[:, :-1]).any(axis=0)
+    grupo_ordenado = numpy.cumsum(novo_grupo) - 1
+    # numera os grupos pela ordem da primeira ocorrência (ordem[novo_grupo] é crescente no grupo)
+    primeiras = ordem[novo_grupo]
+    renumeracao = numpy.empty(len(primeiras), dtype=int)
+    renumeracao[numpy.argsort(primeiras, kind='mergesort')] = numpy.arange(len(primeiras))
+    inversa = numpy.empty(num_colunas, dtype=int)
+    inversa[ordem] = renumeracao[grupo_ordenado]
+    contagens = numpy.bincount(inversa)
+    return matriz[:, numpy.sort(primeiras)], contagens, inversa
+
+
 class AnalisadorPeriodo:
 
-    def __init__(self, casa_legislativa, periodo=None, votacoes=None, partidos=None):
+    def __init__(self, casa_legislativa, periodo=None, votacoes=None, partidos=None, codificacao=CODIFICACAO_PADRAO,
+                 cubo=None):
         """Argumentos:
             casa_legislativa -- objeto do tipo CasaLegislativa; somente votações desta casa serão analisados.
             periodo -- objeto do tipo PeriodoCasaLegislativa; 
@@ -111,6 +748,9 @@ class AnalisadorPeriodo:
                         se não for especificado, procura votações na base de dados de acordo data_inicio e data_fim.
             partidos -- lista de objetos do tipo Partido para serem usados na análise;
                         se não for especificado, usa todos os partidos no banco de dados.
+            codificacao -- nome da codificação dos votos (uma das chaves de CODIFICACOES)
+            cubo -- objeto do tipo CuboDeVotos da casa, de onde vêm os tamanhos dos partidos;
+                    se não for especificado, usa o cubo guardado no cache.
         """
         # TODO que acontece se algum partido for ausente neste período?
         self.casa_legislativa = casa_legislativa
@@ -120,6 +760,8 @@ class AnalisadorPeriodo:
         self.partidos = partidos
         if not partidos:
             self.partidos = self.casa_legislativa.partidos()
+        self.codificacao = codificacao
+        self.cubo = cubo # descartado depois de usado, para não ir para o cache com a análise
         self.votacoes = votacoes
         if not self.votacoes: 
             self._inicializa_votacoes()
@@ -134,31 +776,81 @@ class AnalisadorPeriodo:
         self.tamanhos_partidos = {}
         self.presencas_partidos = {}
         self.soma_dos_tamanhos_dos_partidos = 0
+        self.coesoes = []             # coesão de cada partido em cada votação
+        self.coesoes_partidos = {}    # coesão média de cada partido no período
+        self.pivos_partidos = {}      # fração das votações do período em que cada partido foi decisivo
+        self.vitorias_partidos = {}   # fração das votações em que cada partido ficou do lado vencedor
         
         self.pca_partido = None # É calculado por self._pca_partido()
         self.coordenadas = {} # É o produto final da análise realizada por esta classe
+        self.dendrograma = None # É calculado por self.agrupa_partidos()
+        self.previa = False     # True se a análise foi feita com uma amostra das votações (ver previa_do_periodo)
+        self.erro_previa = None # disparidade de Procrustes entre a prévia e a última análise exata do período
 
     def _inicializa_votacoes(self):
         """Pega votações do banco de dados e seta a lista self.votacoes"""
         if self.ini == None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=self.casa_legislativa) 
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=self.casa_legislativa) 
         if self.ini == None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=self.casa_legislativa).filter(data__lte=self.fim)
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=self.casa_legislativa).filter(data__lte=self.fim)
         if self.ini != None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=self.casa_legislativa).filter(data__gte=self.ini)
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=self.casa_legislativa).filter(data__gte=self.ini)
         if self.ini != None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=self.casa_legislativa).filter(data__gte=self.ini, data__lte=self.fim)
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=self.casa_legislativa).filter(data__gte=self.ini, data__lte=self.fim)
 
     def _inicializa_vetores(self):
-        matrizesBuilder = MatrizDeVotacoesBuilder(self.votacoes, self.partidos)
-        self.vetores_votacao = matrizesBuilder.gera_matriz()
+        matrizesBuilder = MatrizDeVotacoesBuilder(self.votacoes, self.partidos, self.codificacao)
+        matrizesBuilder.gera_matriz()
+        tamanhosBuilder = TamanhoPartidoBuilder(self.partidos, self.casa_legislativa, self.ini, self.fim, self.cubo)
+        tamanhosBuilder.gera_dic_tamanho_partidos()
+        self.cubo = None
+        self.inicializa_vetores_de(matrizesBuilder, tamanhosBuilder)
+
+    def inicializa_vetores_de(self, matrizesBuilder, tamanhosBuilder, matriz_votacoes=None):
+        """Inicializa os vetores a partir de um MatrizDeVotacoesBuilder e de um 
+        TamanhoPartidoBuilder já calculados (usado por aquece_cache).
+        Se matriz_votacoes não for fornecida, usa a do matrizesBuilder."""
+        self.vetores_votacao = matrizesBuilder.matriz_votacoes if matriz_votacoes is None else matriz_votacoes
         self.vetores_presenca = matrizesBuilder.matriz_presencas
-        tamanhosBuilder = TamanhoPartidoBuilder(self.partidos, self.casa_legislativa)
-        self.tamanhos_partidos = tamanhosBuilder.gera_dic_tamanho_partidos()
-        # Presencas dos partidos está quebrado:
-        self.presencas_partidos = {}
+        self._inicializa_coesoes(matrizesBuilder)
+        self._inicializa_pivos(matrizesBuilder)
+        self._inicializa_vitorias(matrizesBuilder)
+        self.tamanhos_partidos = tamanhosBuilder.tamanhos
+        self.presencas_partidos = tamanhosBuilder.presencas
         self.soma_dos_tamanhos_dos_partidos = tamanhosBuilder.soma_dos_tamanhos_dos_partidos 
 
+    def _inicializa_coesoes(self, matrizesBuilder):
+        """Calcula a coesão de cada partido em cada votação e a média no período,
+        considerando apenas as votações em que o partido esteve presente."""
+        self.coesoes = matrizesBuilder.gera_matriz_coesoes()
+        presencas = matrizesBuilder.matriz_contagens.sum(axis=2) > 0
+        num_presencas = presencas.sum(axis=1)
+        medias = (self.coesoes * presencas).sum(axis=1) / numpy.maximum(num_presencas, 1.0)
+        self.coesoes_partidos = {}
+        for partido, media, n in zip(self.partidos, medias, num_presencas):
+            self.coesoes_partidos[partido.nome] = media if n > 0 else None
+
+    def _inicializa_pivos(self, matrizesBuilder):
+        """Calcula a fração das votações do período em que cada partido foi decisivo
+        (ver MatrizDeVotacoesBuilder.gera_matriz_pivos)."""
+        pivos = matrizesBuilder.gera_matriz_pivos()
+        fracoes = pivos.sum(axis=1) / float(max(pivos.shape[1], 1))
+        self.pivos_partidos = dict((partido.nome, fracao) for partido, fracao in zip(self.partidos, fracoes))
+
+    def _inicializa_vitorias(self, matrizesBuilder):
+        """Calcula a fração das votações do período em que cada partido ficou do lado
+        vencedor: o sinal do seu voto médio é igual ao resultado normalizado da votação.
+        Votações sem resultado, em que o partido não votou ou ficou dividido não contam;
+        partidos sem votações contadas ficam com None."""
+        sentidos = numpy.sign(self.vetores_votacao)
+        resultados = matrizesBuilder.resultados
+        contadas = (sentidos != 0) & (resultados != models.SEM_RESULTADO)
+        vitorias = ((sentidos == resultados) & contadas).sum(axis=1)
+        num_contadas = contadas.sum(axis=1)
+        self.vitorias_partidos = {}
+        for partido, v, n in zip(self.partidos, vitorias, num_contadas):
+            self.vitorias_partidos[partido.nome] = float(v) / n if n > 0 else None
+
     def _pca_partido(self):
         """Roda a análise de componentes principais por partido.
 
@@ -173,8 +865,14 @@ class AnalisadorPeriodo:
             matriz = self.vetores_votacao
             matriz = matriz[ipnn,:] # exclui partidos de tamanho zero
             matriz = matriz - matriz.mean(axis=0) # centraliza dados
-            self.pca_partido = pca.PCA(matriz,fraction=1) # faz o pca
+            # votações com colunas iguais entram uma só vez, com peso raiz(quantidade):
+            # U e os autovalores são os mesmos da matriz completa
+            unicas, contagens, inversa = colunas_unicas(matriz)
+            self.pca_partido = pca.PCA(unicas * numpy.sqrt(contagens), fraction=1) # faz o pca
+            # Vt volta a ter uma coluna por votação (colunas iguais têm a mesma composição)
+            self.pca_partido.Vt = self.pca_partido.Vt[:, inversa] / numpy.sqrt(contagens[inversa])
             self._preenche_pca_de_partidos_nulos(ipnn)
+            self._completa_duas_componentes()
             logger.info("PCA terminada com sucesso. ini=%s, fim=%s" % (str(self.ini),str(self.fim)))
         # Criar dicionario a ser retornado:
         dicionario = {}
@@ -208,6 +906,14 @@ class AnalisadorPeriodo:
                 self.pca_partido.U[ip,:] = numpy.zeros((1,self.num_votacoes))
         
 
+    def _completa_duas_componentes(self):
+        """Se a pca tem uma só componente (ex: período com uma única votação), 
+        acrescenta uma segunda componente nula, usada na criação do json."""
+        faltam = 2 - len(self.pca_partido.eigen)
+        if faltam > 0:
+            self.pca_partido.eigen = numpy.append(self.pca_partido.eigen, numpy.zeros(faltam))
+            self.pca_partido.Vt = numpy.vstack((self.pca_partido.Vt, numpy.zeros((faltam, self.pca_partido.Vt.shape[1]))))
+
     def partidos_2d(self):
         """Retorna mapa com as coordenadas dos partidos no plano 2D formado
         pelas duas primeiras componentes principais. Para isso é preciso
@@ -231,6 +937,26 @@ class AnalisadorPeriodo:
                     self.coordenadas[partido] = [ 0. , 0. ]
         return self.coordenadas
     
+    def agrupa_partidos(self, distancias):
+        """Faz o agrupamento hierárquico (ligação média) dos partidos de tamanho não nulo.
+
+        Argumentos:
+            distancias -- matriz com as distâncias entre os vetores de votação de
+                          todos os partidos (ver agrupamento.distancias_por_periodo)
+
+        Guarda em self.dendrograma um dicionário com a lista "partidos" (nomes)
+        e a lista "juncoes" no formato de agrupamento.ligacao_media.
+        """
+        ipnn = self._lista_de_indices_de_partidos_naos_nulos()
+        distancias = numpy.asarray(distancias)[numpy.ix_(ipnn, ipnn)]
+        juncoes = agrupamento.ligacao_media(distancias)
+        nomes = [partido.nome for partido in self.partidos]
+        self.dendrograma = {
+            "partidos": [nomes[ip] for ip in ipnn],
+            "juncoes": [[a, b, round(d, 4), t] for a, b, d, t in juncoes]
+        }
+        return self.dendrograma
+
     def _energia(self,dados_fixos,dados_meus,graus=0,espelho=0):
         """Calcula energia envolvida no movimento entre dois instantes (fixo e meu), onde o meu é rodado (entre 0 e 360 graus), e primeiro eixo multiplicado por -1 se espelho=1. Ver pdf intitulado "Solução Analítica para o Problema de Rotação dos Eixos de Representação dos Partidos no Radar Parlamentar" (algoritmo_rotacao.pdf)."""
         e = 0
@@ -308,6 +1034,387 @@ class AnalisadorPeriodo:
         print campeao
         return dados_meus
 
+class AnalisadorDecaimento:
+    """Análise da "posição atual" dos partidos, sem recorte de período.
+
+    Todas as votações da casa entram na análise, mas a coluna de cada votação
+    é multiplicada pelo peso 0.5**(d/meia_vida), em que d é o número de dias 
+    entre a votação e a data de referência; votações posteriores à data de 
+    referência têm peso zero.
+
+    A matriz de votações da casa vem do cache (ver matrizes_da_casa), então
+    mudar a data de referência ou a meia-vida custa apenas uma decomposição 
+    da matriz partidos x partidos, sem acesso ao banco de dados.
+    """
+
+    def __init__(self, casa_legislativa, data_referencia=None, meia_vida=365, codificacao=CODIFICACAO_PADRAO):
+        """Argumentos:
+            casa_legislativa -- objeto do tipo CasaLegislativa
+            data_referencia -- objeto date (ou datetime); se não for especificada, 
+                               usa a data da última votação da casa.
+            meia_vida -- em dias
+            codificacao -- nome da codificação dos votos (uma das chaves de CODIFICACOES)
+        """
+        self.casa_legislativa = casa_legislativa
+        self.codificacao = codificacao
+        self.data_referencia = data_referencia
+        self.meia_vida = meia_vida
+        self.pesos = None              # peso de cada votação (na ordem de matrizes.ids_votacoes)
+        self.var_explicada = [0., 0.]  # porcentagem da variância (ponderada) em cada eixo
+        self.coordenadas = {}
+
+    def _pesos(self, datas):
+        if len(datas) == 0:
+            return numpy.zeros(0)
+        referencia = datas[-1] if self.data_referencia == None else self.data_referencia.toordinal()
+        dias = referencia - datas
+        pesos = 0.5 ** (dias / float(self.meia_vida))
+        pesos[dias < 0] = 0
+        return pesos
+
+    def partidos_2d(self):
+        """Retorna mapa com as coordenadas [x,y] de cada partido (chave é o nome do partido).
+        Partidos sem votos nas votações com peso não nulo ficam na origem."""
+        matrizes = matrizes_da_casa(self.casa_legislativa)
+        self.pesos = self._pesos(matrizes.datas)
+        presentes = numpy.dot(matrizes.builder.matriz_presencas, self.pesos) > 0
+        self.coordenadas = dict((partido.nome, [0., 0.]) for partido in matrizes.partidos)
+        if not presentes.any():
+            return self.coordenadas
+        matriz = matrizes.builder.gera_matrizes_codificadas([self.codificacao])[self.codificacao]
+        matriz = matriz[presentes, :]
+        matriz = (matriz - matriz.mean(axis=0)) * self.pesos # centraliza e pondera as colunas
+        autovalores, autovetores = numpy.linalg.eigh(numpy.dot(matriz, matriz.T))
+        autovalores = numpy.maximum(autovalores[::-1][:2], 0)
+        autovetores = autovetores[:, ::-1][:, :2]
+        # sinal de cada eixo escolhido de forma determinística (maior componente positiva):
+        maiores = autovetores[numpy.abs(autovetores).argmax(axis=0), range(autovetores.shape[1])]
+        autovetores = autovetores * numpy.where(maiores < 0, -1, 1)
+        U = numpy.zeros((len(matrizes.partidos), 2))
+        U[presentes, 0:autovetores.shape[1]] = autovetores * (autovalores > 1e-12)
+        total = (matriz**2).sum()
+        if total > 0:
+            self.var_explicada = [round(el / total * 100, 1) for el in autovalores]
+        for partido, linha in zip(matrizes.partidos, U):
+            self.coordenadas[partido.nome] = list(linha)
+        return self.coordenadas
+
+
+def chave_cache_periodo(casa_legislativa, periodo, codificacao=CODIFICACAO_PADRAO):
+    """Chave do cache em que fica guardada a análise (ainda não rotacionada) de um período"""
+    return 'analise_periodo:%s:%s:%s:%s' % (casa_legislativa.nome_curto, periodo.ini, periodo.fim, codificacao)
+
+def analise_do_periodo(casa_legislativa, periodo, codificacao=CODIFICACAO_PADRAO, cubo=None):
+    """Retorna o AnalisadorPeriodo (já analisado) de um período da casa legislativa,
+    recuperando-o do cache quando possível. Retorna None se não houve votações no período.
+    O cubo de votos da casa pode ser passado por quem analisa vários períodos."""
+    chave = chave_cache_periodo(casa_legislativa, periodo, codificacao)
+    x = cache.get(chave)
+    if x == None:
+        x = AnalisadorPeriodo(casa_legislativa, periodo, codificacao=codificacao, cubo=cubo)
+        if not x.votacoes:
+            return None
+        x.partidos_2d()
+        x.agrupa_partidos(agrupamento.distancias_por_periodo([x.vetores_votacao])[0])
+        guarda_no_cache(x)
+    return x
+
+def guarda_no_cache(x):
+    """Guarda no cache a análise (já feita e ainda não rotacionada) x, do tipo AnalisadorPeriodo.
+    As coordenadas dos partidos também são guardadas por mais tempo, para avaliar prévias."""
+    x.votacoes = list(x.votacoes)
+    cache.set(chave_cache_periodo(x.casa_legislativa, x.periodo, x.codificacao), x, CACHE_TIMEOUT)
+    cache.set(chave_cache_coordenadas(x.casa_legislativa, x.periodo, x.codificacao), x.coordenadas, 
+              CACHE_TIMEOUT_COORDENADAS)
+
+def chave_cache_coordenadas(casa_legislativa, periodo, codificacao=CODIFICACAO_PADRAO):
+    """Chave do cache em que ficam guardadas as coordenadas da última análise exata de um período"""
+    return 'coordenadas_periodo:%s:%s:%s:%s' % (casa_legislativa.nome_curto, periodo.ini, periodo.fim, codificacao)
+
+def disparidade_procrustes(a, b):
+    """Disparidade de Procrustes entre duas configurações de pontos (matrizes n x d):
+    1 - (soma dos valores singulares de a'b)^2, com a e b centralizadas e normalizadas,
+    após a melhor rotação/reflexão de uma sobre a outra. Vale 0 para configurações iguais
+    a menos de translação, escala, rotação e reflexão, e no máximo 1."""
+    a = numpy.asarray(a, dtype=float)
+    b = numpy.asarray(b, dtype=float)
+    a = a - a.mean(axis=0)
+    b = b - b.mean(axis=0)
+    norma_a = numpy.sqrt((a**2).sum())
+    norma_b = numpy.sqrt((b**2).sum())
+    if norma_a == 0 or norma_b == 0:
+        return 0. if norma_a == norma_b else 1.
+    valores_singulares = numpy.linalg.svd(numpy.dot((a / norma_a).T, b / norma_b), compute_uv=False)
+    return max(0., 1 - valores_singulares.sum()**2)
+
+def previa_do_periodo(casa_legislativa, periodo, codificacao=CODIFICACAO_PADRAO, fracao=FRACAO_PREVIA, semente=None,
+                      cubo=None, matrizes=None):
+    """Retorna um AnalisadorPeriodo (já analisado, com previa=True) feito com uma amostra 
+    aleatória de uma fração das votações do período, a partir das matrizes da casa
+    (por padrão, as do cache; quem faz prévias de vários períodos as passa em matrizes).
+    Se houver no cache uma análise exata anterior do período, x.erro_previa traz a
+    disparidade de Procrustes entre as duas. Retorna None se não houve votações no período."""
+    if matrizes == None:
+        matrizes = matrizes_da_casa(casa_legislativa)
+    colunas = numpy.arange(len(matrizes.ids_votacoes))[matrizes.colunas(periodo)]
+    if len(colunas) == 0:
+        return None
+    tamanho_amostra = min(len(colunas), max(2, int(numpy.ceil(fracao * len(colunas)))))
+    amostra = numpy.sort(numpy.random.RandomState(semente).permutation(colunas)[:tamanho_amostra])
+    fatia = matrizes.builder.fatia(amostra)
+    tamanhosBuilder = TamanhoPartidoBuilder(matrizes.partidos, casa_legislativa, periodo.ini, periodo.fim, cubo)
+    tamanhosBuilder.gera_dic_tamanho_partidos()
+    x = AnalisadorPeriodo(casa_legislativa, periodo, matrizes.carrega_votacoes(amostra), matrizes.partidos, codificacao)
+    x.inicializa_vetores_de(fatia, tamanhosBuilder, fatia.gera_matrizes_codificadas([codificacao])[codificacao])
+    x.partidos_2d()
+    x.previa = True
+    exata = cache.get(chave_cache_coordenadas(casa_legislativa, periodo, codificacao))
+    if exata != None:
+        nomes = sorted(nome for nome in x.coordenadas if nome in exata)
+        x.erro_previa = disparidade_procrustes([x.coordenadas[nome] for nome in nomes], 
+                                               [exata[nome] for nome in nomes])
+    return x
+
+def matrizes_e_mascaras_da_casa(casa_legislativa):
+    """Retorna (MatrizesDaCasaLegislativa, MascarasDeVotacoes) da casa, recuperadas do
+    cache quando possível; as máscaras são reconstruídas se estiverem desatualizadas."""
+    matrizes = matrizes_da_casa(casa_legislativa)
+    mascaras = mascaras_da_casa(casa_legislativa)
+    if mascaras.num_votacoes != len(matrizes.ids_votacoes): # máscaras desatualizadas
+        mascaras = constroi_mascaras(casa_legislativa)
+    return matrizes, mascaras
+
+def analise_filtrada(casa_legislativa, periodo, codificacao=CODIFICACAO_PADRAO, matrizes=None, mascaras=None, **filtros):
+    """Retorna o AnalisadorPeriodo (já analisado) de um período da casa legislativa
+    considerando apenas as votações que satisfazem os filtros (ver MascarasDeVotacoes.mascara).
+    As colunas são selecionadas nas matrizes da casa (por padrão, as do cache; quem
+    analisa vários períodos as passa em matrizes e mascaras), sem consultar os votos,
+    e os tamanhos dos partidos são calculados só com as votações selecionadas.
+    Retorna None se nenhuma votação do período satisfaz os filtros."""
+    if matrizes == None or mascaras == None:
+        matrizes, mascaras = matrizes_e_mascaras_da_casa(casa_legislativa)
+    colunas = numpy.arange(len(matrizes.ids_votacoes))[matrizes.colunas(periodo)]
+    colunas = colunas[mascaras.mascara(**filtros)[colunas]]
+    if len(colunas) == 0:
+        return None
+    fatia = matrizes.builder.fatia(colunas)
+    tamanhosBuilder = TamanhoPartidoBuilder(matrizes.partidos, casa_legislativa, periodo.ini, periodo.fim)
+    tamanhosBuilder.gera_dic_tamanho_partidos_de(fatia)
+    x = AnalisadorPeriodo(casa_legislativa, periodo, matrizes.carrega_votacoes(colunas), matrizes.partidos, codificacao)
+    x.inicializa_vetores_de(fatia, tamanhosBuilder, fatia.gera_matrizes_codificadas([codificacao])[codificacao])
+    x.partidos_2d()
+    return x
+
+def aquece_cache(casa_legislativa, periodicidades=None, codificacoes=None):
+    """Faz e guarda no cache as análises de todos os períodos da casa legislativa,
+    em todas as periodicidades (por padrão, todas as de models.PERIODOS) e 
+    codificações de votos (por padrão, todas as de CODIFICACOES).
+
+    Os votos da casa são lidos do banco uma única vez (MatrizesDaCasaLegislativa) e
+    as matrizes de cada período são fatias desta matriz. Os tamanhos dos partidos 
+    em cada período vêm do cubo de votos da casa, obtido uma única vez.
+
+    Retorna a lista de objetos AnalisadorPeriodo que foram guardados no cache.
+    """
+    if periodicidades == None:
+        periodicidades = [periodicidade for periodicidade, nome in models.PERIODOS]
+    if codificacoes == None:
+        codificacoes = sorted(CODIFICACOES.keys())
+    if not models.Votacao.objects.filter(casa_legislativa=casa_legislativa).exists():
+        return []
+    matrizes = MatrizesDaCasaLegislativa(casa_legislativa)
+    cache.set(chave_cache_matrizes(casa_legislativa), matrizes, CACHE_TIMEOUT)
+    if len(matrizes.ids_votacoes) == 0: # só votações sem data
+        return []
+    votacoes = matrizes.carrega_votacoes()
+    datas = [votacao.data for votacao in votacoes]
+    cubo = models.CuboDeVotos.da_casa(casa_legislativa)
+    analises = []
+    for periodicidade in periodicidades:
+        periodos = models.PeriodoCasaLegislativa.lista_de_periodos(casa_legislativa, datas[0], datas[-1], 
+                                                                   periodicidade, datas_votacoes=datas)
+        analises_periodicidade = []
+        for periodo in periodos:
+            colunas = matrizes.colunas(periodo)
+            if colunas.start == colunas.stop:
+                continue
+            fatia = matrizes.builder.fatia(colunas)
+            matrizes_codificadas = fatia.gera_matrizes_codificadas(codificacoes)
+            tamanhosBuilder = TamanhoPartidoBuilder(matrizes.partidos, casa_legislativa, periodo.ini, periodo.fim, cubo)
+            tamanhosBuilder.gera_dic_tamanho_partidos()
+            for codificacao in codificacoes:
+                x = AnalisadorPeriodo(casa_legislativa, periodo, votacoes[colunas], matrizes.partidos, codificacao)
+                x.inicializa_vetores_de(fatia, tamanhosBuilder, matrizes_codificadas[codificacao])
+                x.partidos_2d()
+                analises_periodicidade.append(x)
+        # dendrogramas calculados em lote para cada periodicidade
+        distancias = agrupamento.distancias_por_periodo([x.vetores_votacao for x in analises_periodicidade])
+        for x, d in zip(analises_periodicidade, distancias):
+            x.agrupa_partidos(d)
+            guarda_no_cache(x)
+        analises += analises_periodicidade
+    logger.info("%d análises de períodos guardadas no cache." % len(analises))
+    return analises
+
+def aquece_caches(periodicidades=None, codificacoes=None):
+    """Executa aquece_cache para todas as casas legislativas"""
+    for casa_legislativa in models.CasaLegislativa.objects.all():
+        if models.Votacao.objects.filter(casa_legislativa=casa_legislativa).exists():
+            logger.info("Aquecendo o cache de %s" % casa_legislativa.nome_curto)
+            aquece_cache(casa_legislativa, periodicidades, codificacoes)
+            if periodicidades == None or models.MES in periodicidades:
+                for codificacao in codificacoes or CODIFICACOES.keys():
+                    mudancas_de_posicao(casa_legislativa, codificacao)
+
+def detecta_mudancas(coordenadas, presentes, limiar=LIMIAR_MUDANCA, minimo=MINIMO_PERIODOS_MUDANCA):
+    """Detecta, para todos os partidos ao mesmo tempo, o período em que a posição
+    de cada partido mudou mais abruptamente (estatística de somas acumuladas).
+
+    Argumentos:
+        coordenadas -- array partidos x períodos x 2 com as posições (já rotacionadas)
+        presentes -- array booleano partidos x períodos; posições de períodos em que
+                     o partido não votou são ignoradas
+
+    Para cada corte t (o segundo trecho começa no período t), o ganho é a fração da 
+    dispersão das posições do partido explicada pela diferença entre as posições
+    médias antes e depois do corte: n1 n2 / n |média1 - média2|^2 / soma dos quadrados.
+
+    Retorna (cortes, ganhos): para cada partido, o índice do período do corte de maior
+    ganho (-1 se o ganho é menor que o limiar) e este ganho.
+    """
+    num_partidos, num_periodos = presentes.shape
+    if num_periodos < 2:
+        return -numpy.ones(num_partidos, dtype=int), numpy.zeros(num_partidos)
+    pesos = presentes.astype(float)
+    ponderadas = coordenadas * pesos[:, :, numpy.newaxis]
+    n = pesos.sum(axis=1)
+    soma = ponderadas.sum(axis=1)
+    # acumulados até o período anterior a cada corte
+    n1 = numpy.cumsum(pesos, axis=1)[:, :-1]
+    s1 = numpy.cumsum(ponderadas, axis=1)[:, :-1]
+    n2 = n[:, numpy.newaxis] - n1
+    s2 = soma[:, numpy.newaxis, :] - s1
+    diferencas = s1 / numpy.maximum(n1, 1)[:, :, numpy.newaxis] - s2 / numpy.maximum(n2, 1)[:, :, numpy.newaxis]
+    entre = n1 * n2 / numpy.maximum(n, 1)[:, numpy.newaxis] * (diferencas**2).sum(axis=2)
+    medias = soma / numpy.maximum(n, 1)[:, numpy.newaxis]
+    total = ((coordenadas - medias[:, numpy.newaxis, :])**2).sum(axis=2)
+    total = (total * pesos).sum(axis=1)
+    validos = (n1 >= minimo) & (n2 >= minimo) & (total > 0)[:, numpy.newaxis]
+    ganhos = numpy.where(validos, entre / numpy.maximum(total, 1e-12)[:, numpy.newaxis], 0.)
+    melhores = ganhos.argmax(axis=1)
+    maiores = ganhos[numpy.arange(num_partidos), melhores]
+    cortes = numpy.where(maiores >= limiar, melhores + 1, -1)
+    return cortes, maiores
+
+def chave_cache_mudancas(casa_legislativa, codificacao=CODIFICACAO_PADRAO):
+    return 'mudancas:%s:%s' % (casa_legislativa.nome_curto, codificacao)
+
+def mudancas_de_posicao(casa_legislativa, codificacao=CODIFICACAO_PADRAO, tempo_limite=None):
+    """Retorna as mudanças abruptas de posição dos partidos da casa legislativa,
+    detectadas nas posições mensais (rotacionadas) dos partidos (ver detecta_mudancas).
+    As análises dos meses vêm do cache; o resultado também é guardado no cache.
+
+    Com tempo_limite (em segundos), as análises mensais que não estão no cache são
+    feitas como em AnalisadorTemporal: esgotado o tempo, as mudanças são detectadas
+    só nos meses mais recentes já analisados, o resultado (parcial) não vai para o
+    cache e os demais meses continuam sendo analisados em segundo plano.
+
+    Retorna (mudancas, parcial): mudancas é uma lista de dicionários com as chaves
+    "partido" (nome), "data" (início do primeiro mês após a mudança, 'aaaa-mm-dd')
+    e "ganho"; parcial é True se o tempo limite esgotou.
+    """
+    chave = chave_cache_mudancas(casa_legislativa, codificacao)
+    mudancas = cache.get(chave)
+    if mudancas != None:
+        return mudancas, False
+    at = AnalisadorTemporal(casa_legislativa, models.MES, codificacao=codificacao, tempo_limite=tempo_limite)
+    analises = at.get_analises()
+    if not analises: # casa sem votações
+        return [], False
+    nomes = [partido.nome for partido in casa_legislativa.partidos()]
+    coordenadas = numpy.zeros((len(nomes), len(analises), 2))
+    presentes = numpy.zeros((len(nomes), len(analises)), dtype=bool)
+    for j, ap in enumerate(analises):
+        for i, nome in enumerate(nomes):
+            if ap.tamanhos_partidos.get(nome, 0) > 0:
+                coordenadas[i, j] = ap.coordenadas[nome][0:2]
+                presentes[i, j] = True
+    cortes, ganhos = detecta_mudancas(coordenadas, presentes)
+    mudancas = [{"partido": nome, "data": unicode(analises[corte].periodo.ini)[0:10], "ganho": round(float(ganho), 3)}
+                for nome, corte, ganho in zip(nomes, cortes, ganhos) if corte >= 0]
+    if not at.parcial:
+        cache.set(chave, mudancas, CACHE_TIMEOUT)
+    return mudancas, at.parcial
+
+
+class AnalisadorConjunto:
+    """Análise conjunta de um mesmo período em várias casas legislativas.
+
+    As matrizes de votação dos partidos de cada casa (recuperadas do cache) são
+    colocadas lado a lado, formando uma única matriz cujas linhas são os partidos
+    (identificados pelo nome) e cujas colunas são todas as votações das casas. 
+    Sobre esta matriz é feita uma única PCA, de forma que as posições dos partidos 
+    ficam em eixos comuns às casas e são comparáveis entre si.
+
+    Quando um partido não tem parlamentares em uma das casas, suas posições nas
+    votações desta casa são preenchidas com a média dos demais partidos (ou seja,
+    não influenciam as componentes principais).
+    """
+
+    def __init__(self, casas_legislativas, periodo):
+        """Argumentos:
+            casas_legislativas -- lista de objetos do tipo CasaLegislativa
+            periodo -- objeto do tipo PeriodoCasaLegislativa
+        """
+        self.casas_legislativas = casas_legislativas
+        self.periodo = periodo
+        self.analisadores_periodo = [] # um por casa (somente casas com votações no período)
+        self.nomes_partidos = []       # linhas da matriz conjunta
+        self.tamanhos_partidos = {}    # soma dos tamanhos do partido nas casas
+        self.pca_partido = None
+        self.coordenadas = {}
+
+    def _matriz_conjunta(self):
+        for casa in self.casas_legislativas:
+            x = analise_do_periodo(casa, self.periodo)
+            if x != None:
+                self.analisadores_periodo.append(x)
+        nomes = set()
+        for x in self.analisadores_periodo:
+            nomes.update(nome for nome, t in x.tamanhos_partidos.items() if t != 0)
+        self.nomes_partidos = sorted(nomes)
+        indices = dict((nome, i) for i, nome in enumerate(self.nomes_partidos))
+        blocos = []
+        for x in self.analisadores_periodo:
+            vetores = numpy.asarray(x.vetores_votacao, dtype=float)
+            ipnn = x._lista_de_indices_de_partidos_naos_nulos()
+            nomes_casa = [partido.nome for partido in x.partidos]
+            linhas = [indices[nomes_casa[ip]] for ip in ipnn]
+            bloco = numpy.empty((len(self.nomes_partidos), vetores.shape[1]))
+            bloco[:] = vetores[ipnn, :].mean(axis=0) # partidos ausentes da casa ficam na média
+            bloco[linhas, :] = vetores[ipnn, :]
+            blocos.append(bloco)
+        for nome in self.nomes_partidos:
+            self.tamanhos_partidos[nome] = sum(x.tamanhos_partidos.get(nome, 0) for x in self.analisadores_periodo)
+        return numpy.hstack(blocos) if blocos else numpy.zeros((0, 0))
+
+    def partidos_2d(self):
+        """Retorna mapa com as coordenadas [x,y] de cada partido (chave é o nome do partido)
+        nas duas primeiras componentes principais da análise conjunta."""
+        if self.pca_partido == None:
+            matriz = self._matriz_conjunta()
+            if matriz.size == 0: # nenhuma casa teve votações no período
+                return self.coordenadas
+            matriz = matriz - matriz.mean(axis=0) # centraliza dados
+            self.pca_partido = pca.PCA(matriz, fraction=1)
+            U = numpy.zeros((len(self.nomes_partidos), 2))
+            cpmaximo = min(2, self.pca_partido.U.shape[1])
+            U[:, 0:cpmaximo] = self.pca_partido.U[:, 0:cpmaximo]
+            for nome, linha in zip(self.nomes_partidos, U):
+                self.coordenadas[nome] = list(linha)
+        return self.coordenadas
+
+
 class AnalisadorTemporal:
     """Um objeto da classe AnalisadorTemporal é um envelope para um conjunto de
     objetos do tipo AnalisadorPeriodo.
@@ -322,18 +1429,37 @@ class AnalisadorTemporal:
     A classe AnalisadorTemporal tem métodos para criar os objetos AnalisadorPeriodo e
     fazer as análises.
 
+    Se for dado um tempo limite, os períodos são analisados do mais recente para
+    o mais antigo e, esgotado o tempo, a análise é feita apenas com os períodos
+    já analisados (self.parcial vale True); os demais períodos continuam sendo 
+    analisados em segundo plano e vão para o cache.
+
+    Com previa=True, os períodos que não estão no cache são analisados rapidamente
+    com uma amostra das votações (ver previa_do_periodo), e as análises exatas são
+    feitas em segundo plano. As prévias só são feitas se as matrizes da casa já
+    estiverem no cache (construí-las custa mais que as análises exatas).
+
     Atributos:
         data_inicio e data_fim -- strings no formato 'aaaa-mm-dd'.
         analisadores_periodo -- lista de objetos da classe AnalisadorPeriodo
+        parcial -- True se o tempo limite esgotou antes de todos os períodos serem analisados
 
     """
-    def __init__(self, casa_legislativa, periodicidade=models.BIENIO, votacoes=[]):
+    def __init__(self, casa_legislativa, periodicidade=models.BIENIO, votacoes=[], codificacao=CODIFICACAO_PADRAO,
+                 tempo_limite=None, filtros=None, previa=False):
 
         self.casa_legislativa = casa_legislativa
+        self.codificacao = codificacao # nome da codificação dos votos (uma das chaves de CODIFICACOES)
+        self.tempo_limite = tempo_limite # em segundos; None para não ter limite
+        self.parcial = False
+        self.completa_em_segundo_plano = True # se False, os períodos restantes não são analisados
+        self.filtros = filtros # filtros de votações (ver MascarasDeVotacoes.mascara); None para não filtrar
+        self.previa = previa # se True, períodos fora do cache são analisados por amostragem (ver previa_do_periodo)
         self.periodos = self.casa_legislativa.periodos(periodicidade)
 
-        self.ini = self.periodos[0].ini
-        self.fim = self.periodos[len(self.periodos)-1].fim
+        # casa sem votações não tem períodos
+        self.ini = self.periodos[0].ini if self.periodos else None
+        self.fim = self.periodos[-1].fim if self.periodos else None
         
         self.periodicidade = periodicidade
         self.area_total = 1
@@ -341,6 +1467,7 @@ class AnalisadorTemporal:
         self.votacoes = []
         self.partidos = []
         self.json = ""
+        self._cubo = None # cubo de votos da casa, obtido uma única vez (ver _cubo_de_votos)
 
 
     def get_json(self):
@@ -348,15 +1475,61 @@ class AnalisadorTemporal:
         self._cria_json()
         return self.json
 
-    # deprecated (serve para o json antigo funcionar)
-    # Este método poderá ser apagado quando o json antigo não for mais usado (ou seja, quando o método get_json da classe JsonAnaliseGenerator do módulo gráfico não for mais usado).
+    def get_json_dendrogramas(self):
+        """Retorna json com o dendrograma dos partidos em cada período."""
+        self._analisa_periodos()
+        periodos = []
+        for ap in self.analisadores_periodo:
+            periodos.append({"nome": ap.periodo.string, "dendrograma": ap.dendrograma})
+        return json.dumps({"periodos": periodos})
+
     def get_analises(self):
+        """Faz as análises de todos os períodos, já rotacionadas em relação ao período
+        anterior, e retorna a lista de AnalisadorPeriodo em ordem cronológica."""
         self._faz_analises()
         return self.analisadores_periodo
             
     def _faz_analises(self):
         """ Método da classe AnalisadorTemporal que cria os objetos AnalisadorPeriodo e faz as análises."""
-        for periodo in self.periodos:
+        self._analisa_periodos()
+        if not self.analisadores_periodo: # ex: filtros que não selecionam nenhuma votação
+            return
+
+        # Rotacionar as análises, e determinar área máxima:
+        maior = self.analisadores_periodo[0].soma_dos_tamanhos_dos_partidos
+        for i in range(1,len(self.analisadores_periodo)): # a partir da segunda analise
+            # Rotacionar/espelhar a análise baseado na análise anterior
+            self.analisadores_periodo[i].espelha_ou_roda(self.analisadores_periodo[i-1].coordenadas)
+            # Área Máxima:
+            candidato = self.analisadores_periodo[i].soma_dos_tamanhos_dos_partidos
+            if candidato > maior:
+                maior = candidato
+        self.area_total = maior
+
+    def _cubo_de_votos(self):
+        """Cubo de votos da casa, compartilhado pelas análises de todos os períodos"""
+        if self._cubo == None:
+            self._cubo = models.CuboDeVotos.da_casa(self.casa_legislativa)
+        return self._cubo
+
+    def _analisa_periodos(self):
+        """Cria os objetos AnalisadorPeriodo (ou os recupera do cache) e faz as análises, sem rotacioná-las."""
+        self.analisadores_periodo = []
+        self.parcial = False
+        novos = [] # análises que não estavam no cache
+        sem_analise_exata = [] # períodos com prévia
+        inicio = time.time()
+        # prévias só com as matrizes da casa já no cache, lidas uma vez para todos os períodos
+        matrizes_previa = cache.get(chave_cache_matrizes(self.casa_legislativa)) if self.previa else None
+        if self.filtros: # análises filtradas selecionam colunas das matrizes da casa
+            matrizes, mascaras = matrizes_e_mascaras_da_casa(self.casa_legislativa)
+        periodos = list(reversed(self.periodos)) # do mais recente para o mais antigo
+        for i, periodo in enumerate(periodos):
+            if self.tempo_limite != None and novos and time.time() - inicio >= self.tempo_limite:
+                logger.info("Tempo limite esgotado; faltaram %d períodos." % (len(periodos) - i))
+                self.parcial = True
+                self._completa_analises(periodos[i:])
+                break
             logger.info("Analisando periodo %s a %s." % (str(periodo.ini),str(periodo.fim)) )
             if len(self.votacoes) == 0: # FUNFA?
                 votacoes = None
@@ -366,26 +1539,69 @@ class AnalisadorTemporal:
                 partidos = None
             else:
                 partidos = self.partidos
-            x = AnalisadorPeriodo(self.casa_legislativa, periodo, votacoes, partidos)
+            if self.filtros:
+                x = analise_filtrada(self.casa_legislativa, periodo, self.codificacao, matrizes, mascaras, **self.filtros)
+                if x != None:
+                    novos.append((x, False))
+                    self.analisadores_periodo.append(x)
+                continue
+            usa_cache = votacoes == None and partidos == None
+            x = cache.get(self._chave_cache(periodo)) if usa_cache else None
+            if x != None:
+                logger.info("Análise do periodo recuperada do cache.")
+                self.analisadores_periodo.append(x)
+                continue
+            if matrizes_previa != None and usa_cache:
+                x = previa_do_periodo(self.casa_legislativa, periodo, self.codificacao, cubo=self._cubo_de_votos(),
+                                      matrizes=matrizes_previa)
+                if x != None:
+                    self.analisadores_periodo.append(x)
+                    sem_analise_exata.append(periodo)
+                continue
+            x = AnalisadorPeriodo(self.casa_legislativa, periodo, votacoes, partidos, self.codificacao,
+                                  self._cubo_de_votos())
             if x.votacoes:
                 logger.info("O periodo possui %d votações." % len(x.votacoes))
                 x.partidos_2d()
+                novos.append((x, usa_cache))
                 self.analisadores_periodo.append(x)
             else:
                 logger.info("O periodo não possui nenhuma votação.")
             logger.info("Soma dos Tamanhos dos Partidos %f" % x.soma_dos_tamanhos_dos_partidos)
 
-        # Rotacionar as análises, e determinar área máxima:
-        maior = self.analisadores_periodo[0].soma_dos_tamanhos_dos_partidos
-        for i in range(1,len(self.analisadores_periodo)): # a partir da segunda analise
-            # Rotacionar/espelhar a análise baseado na análise anterior
-            self.analisadores_periodo[i].espelha_ou_roda(self.analisadores_periodo[i-1].coordenadas)
-            # Área Máxima:
-            candidato = self.analisadores_periodo[i].soma_dos_tamanhos_dos_partidos
-            if candidato > maior:
-                maior = candidato
-        self.area_total = maior
+        self.analisadores_periodo.reverse() # ordem cronológica
+        if sem_analise_exata:
+            self._completa_analises(sem_analise_exata)
+
+        # Dendrogramas de todos os períodos recém analisados são calculados em lote:
+        distancias = agrupamento.distancias_por_periodo([x.vetores_votacao for x, usa_cache in novos])
+        for (x, usa_cache), d in zip(novos, distancias):
+            x.agrupa_partidos(d)
+            if usa_cache:
+                guarda_no_cache(x)
+
+    def _completa_analises(self, periodos):
+        """Analisa em segundo plano os períodos que faltaram, guardando-os no cache"""
+        usa_cache = len(self.votacoes) == 0 and len(self.partidos) == 0 and not self.filtros
+        if not usa_cache or not self.completa_em_segundo_plano:
+            return
+        thread = threading.Thread(target=self._analisa_em_cache, args=(periodos,))
+        thread.daemon = True
+        thread.start()
+
+    def _analisa_em_cache(self, periodos):
+        try:
+            for periodo in periodos:
+                analise_do_periodo(self.casa_legislativa, periodo, self.codificacao, self._cubo_de_votos())
+            logger.info("Análise em segundo plano terminada (%d períodos)." % len(periodos))
+        except Exception:
+            logger.exception("Erro na análise em segundo plano.")
+        finally:
+            connection.close() # cada thread tem sua própria conexão com o banco
 
+    def _chave_cache(self, periodo):
+        """Chave do cache em que fica guardada a análise (ainda não rotacionada) de um período"""
+        return chave_cache_periodo(self.casa_legislativa, periodo, self.codificacao)
 
     def _cria_json(self,constante_escala_tamanho=45):
         """Uma vez que a análise temporal está feita, este método cria o json. """
@@ -398,26 +1614,36 @@ class AnalisadorTemporal:
         self.json += '"atualizacao":"' + unicode(self.casa_legislativa.atualizacao) + '"'
         self.json += "}," # fecha casa legislativa
         escala = constante_escala_tamanho**2 / max(1,self.area_total)
-        escala_20px = 20**2 * (1/max(1,escala)) # numero de parlamentares representado
+        escala_20px = 20**2 * (1/max(1,escala)) # média de votos por votação representada
                                                 # por um circulo de raio 20 pixels.
         self.json += '"escala_tamanho":' + str(round(escala_20px,1)) + ','
+        self.json += '"codificacao":"' + self.codificacao + '",'
+        self.json += '"parcial":' + ('true' if self.parcial else 'false') + ','
         self.json += '"filtro_partidos":null,'
-        self.json += '"filtro_votacoes":null},' # fecha bloco "geral"
+        self.json += '"filtro_votacoes":' + json.dumps(self.filtros) + '},' # fecha bloco "geral"
         self.json += '"periodos":['
         for ap in self.analisadores_periodo:
             self.json += '{' # abre periodo
             self.json += '"nvotacoes":' + str(ap.periodo.quantidade_votacoes) + ','
+            self.json += '"nvotacoes_amostra":' + json.dumps(len(ap.votacoes) if ap.previa else None) + ','
             self.json += '"nome":"' + ap.periodo.string + '",'
-            var_explicada = round((ap.pca_partido.eigen[0] + ap.pca_partido.eigen[1])/ap.pca_partido.eigen.sum() * 100,1)
+            self.json += '"previa":' + json.dumps(ap.previa) + ','
+            self.json += '"erro_previa":' + json.dumps(ap.erro_previa) + ','
+            variancia_total = ap.pca_partido.eigen.sum() or 1.0 # zero se não há variação (ex: uma única votação unânime)
+            var_explicada = round((ap.pca_partido.eigen[0] + ap.pca_partido.eigen[1])/variancia_total * 100,1)
             self.json += '"var_explicada":' + str(var_explicada) + ","
             self.json += '"cp1":{"theta":' + str(round(ap.theta,0)%180) + ','
-            var_explicada = round(ap.pca_partido.eigen[0]/ap.pca_partido.eigen.sum() * 100,1)
+            var_explicada = round(ap.pca_partido.eigen[0]/variancia_total * 100,1)
             self.json += '"var_explicada":' + str(var_explicada) + ","
             self.json += '"composicao":' + str([round(el,2) for el in 100*ap.pca_partido.Vt[0,:]**2]) + "}," # fecha cp1
             self.json += '"cp2":{"theta":' + str(round(ap.theta,0)%180 + 90) + ','
-            var_explicada = str(round(ap.pca_partido.eigen[1]/ap.pca_partido.eigen.sum() * 100,1))
+            var_explicada = str(round(ap.pca_partido.eigen[1]/variancia_total * 100,1))
             self.json += '"var_explicada":' + str(var_explicada) + ","
             self.json += '"composicao":' + str([round(el,2) for el in 100*ap.pca_partido.Vt[1,:]**2]) + "}," # fecha cp2
+            coesoes = {} # coesão de cada partido em cada votação, na ordem da lista de votações
+            for partido, linha in zip(ap.partidos, ap.coesoes):
+                coesoes[partido.nome] = [round(el,3) for el in linha]
+            self.json += '"coesoes":' + json.dumps(coesoes) + ','
             self.json += '"votacoes":' # deve trazer a lista de votacoes do periodo
                                         # na mesma ordem apresentada nos vetores
                                         # composicao das componentes principais.
@@ -426,7 +1652,7 @@ class AnalisadorTemporal:
                 lista_votacoes.append({"id":unicode(votacao).replace('"',"'")})
             self.json += json.dumps(lista_votacoes)
             self.json += ' },' # fecha lista de votações e fecha período
-        self.json = self.json[0:-1] # apaga última vírgula
+        self.json = self.json.rstrip(',') # apaga última vírgula
         self.json += '],' # fecha lista de períodos
         self.json += '"partidos":['
         for partido in self.casa_legislativa.partidos():
@@ -436,23 +1662,28 @@ class AnalisadorTemporal:
             dict_partido["x"] =  []
             dict_partido["y"] =  []
             dict_partido["p"] =  []
+            dict_partido["c"] =  []
+            dict_partido["pivo"] =  []
+            dict_partido["vitorias"] =  []
             for ap in self.analisadores_periodo:
                 scaler = grafico.GraphScaler()
                 mapa = scaler.scale(ap.coordenadas)
                 dict_partido["x"].append(round(mapa[partido.nome][0],2))
                 dict_partido["y"].append(round(mapa[partido.nome][1],2))
                 t = ap.tamanhos_partidos[partido.nome]
-                dict_partido["t"].append(t)
+                dict_partido["t"].append(round(t,1))
                 r = numpy.sqrt(t*escala)
                 dict_partido["r"].append(round(r,1))
-                # linha abaixo comentada até corrigir presencas_partidos:
-                #p = ap.presencas_partidos[partido.nome] * 100
-                # substituída pela linha abaixo:
-                p = 100
+                p = ap.presencas_partidos.get(partido.nome, 0) * 100
                 dict_partido["p"].append(round(p,1))
+                c = ap.coesoes_partidos.get(partido.nome)
+                dict_partido["c"].append(round(c,3) if c != None else None)
+                dict_partido["pivo"].append(round(ap.pivos_partidos.get(partido.nome, 0),3))
+                v = ap.vitorias_partidos.get(partido.nome)
+                dict_partido["vitorias"].append(round(v,3) if v != None else None)
                 dict_partido["parlamentares"]=None
             self.json += json.dumps(dict_partido) + ','
-        self.json = self.json[0:-1] # apaga última vírgula
+        self.json = self.json.rstrip(',') # apaga última vírgula
         self.json += '] }' # fecha lista de partidos e fecha json
 
 
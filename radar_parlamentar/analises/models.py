@@ -17,3 +17,121 @@
 # You should have received a copy of the GNU General Public License
 # along with Radar Parlamentar.  If not, see <http://www.gnu.org/licenses/>.
 
+
+from __future__ import unicode_literals
+from django.db import models
+from django.dispatch import receiver
+from django.core.cache import cache
+from modelagem.models import CasaLegislativa, Legislatura, Parlamentar, Partido, PERIODOS, importacao_concluida
+
+
+class LealdadePartidaria(models.Model):
+    """Fração dos votos de uma legislatura que seguiram a posição majoritária do
+    seu partido nas votações de um período.
+
+    Atributos:
+        casa_legislativa -- objeto do tipo CasaLegislativa
+        parlamentar, legislatura -- objetos do tipo Parlamentar e Legislatura
+        periodicidade -- uma constante em modelagem.models.PERIODOS
+        inicio, fim -- datas do período
+        votos -- quantidade de votos considerados (votações em que a legislatura votou
+                 e em que o partido teve uma posição majoritária)
+        votos_com_partido -- quantidade desses votos iguais à posição majoritária do partido
+        lealdade -- votos_com_partido / votos
+    """
+
+    casa_legislativa = models.ForeignKey(CasaLegislativa)
+    parlamentar = models.ForeignKey(Parlamentar)
+    legislatura = models.ForeignKey(Legislatura)
+    periodicidade = models.CharField(max_length=10, choices=PERIODOS)
+    inicio = models.DateField()
+    fim = models.DateField()
+    votos = models.IntegerField()
+    votos_com_partido = models.IntegerField()
+    lealdade = models.FloatField()
+
+    def __unicode__(self):
+        return '%s [%s, %s]: %s' % (self.legislatura, self.inicio, self.fim, self.lealdade)
+
+
+class Coalizao(models.Model):
+    """Bloco majoritário de partidos de uma casa legislativa em um período,
+    detectado a partir da concordância entre os votos dos partidos.
+
+    Atributos:
+        casa_legislativa -- objeto do tipo CasaLegislativa
+        periodicidade -- uma constante em modelagem.models.PERIODOS
+        inicio, fim -- datas do período
+        partidos -- partidos que compõem a coalizão
+
+    Métodos da classe:
+        por_periodo(casa_legislativa, periodicidade): lista de tuplas (inicio, fim, nomes dos partidos)
+    """
+
+    casa_legislativa = models.ForeignKey(CasaLegislativa)
+    periodicidade = models.CharField(max_length=10, choices=PERIODOS)
+    inicio = models.DateField()
+    fim = models.DateField()
+    partidos = models.ManyToManyField(Partido)
+
+    @staticmethod
+    def por_periodo(casa_legislativa, periodicidade):
+        """Retorna lista (ordenada por data) de tuplas (inicio, fim, conjunto com nomes dos partidos)"""
+        coalizoes = Coalizao.objects.filter(casa_legislativa=casa_legislativa, periodicidade=periodicidade)
+        coalizoes = coalizoes.order_by('inicio').prefetch_related('partidos')
+        return [(c.inicio, c.fim, set(p.nome for p in c.partidos.all())) for c in coalizoes]
+
+    def __unicode__(self):
+        return '%s [%s, %s]' % (self.casa_legislativa.nome_curto, self.inicio, self.fim)
+
+
+class SimilaridadeParlamentar(models.Model):
+    """Um dos k parlamentares (legislaturas) que votaram de forma mais parecida com
+    uma legislatura nas votações de um período, considerando apenas as votações
+    em que ambos votaram.
+
+    Atributos:
+        casa_legislativa -- objeto do tipo CasaLegislativa
+        periodicidade -- uma constante em modelagem.models.PERIODOS
+        inicio, fim -- datas do período
+        legislatura -- objeto do tipo Legislatura
+        similar -- objeto do tipo Legislatura; legislatura parecida com a primeira
+        posicao -- 1 para a mais parecida, 2 para a segunda, etc.
+        votacoes -- quantidade de votações em que ambas votaram
+        similaridade -- fração dessas votações em que ambas votaram igual
+    """
+
+    casa_legislativa = models.ForeignKey(CasaLegislativa)
+    periodicidade = models.CharField(max_length=10, choices=PERIODOS)
+    inicio = models.DateField()
+    fim = models.DateField()
+    legislatura = models.ForeignKey(Legislatura, related_name='similaridades')
+    similar = models.ForeignKey(Legislatura, related_name='+')
+    posicao = models.SmallIntegerField()
+    votacoes = models.IntegerField()
+    similaridade = models.FloatField()
+
+    def __unicode__(self):
+        return '%s ~ %s [%s, %s]: %s' % (self.legislatura, self.similar, self.inicio, self.fim, self.similaridade)
+
+
+@receiver(importacao_concluida)
+def atualiza_dados_das_votacoes(sender, casa_legislativa, **kwargs):
+    """Ao fim de uma importação, descarta as matrizes, as presenças, as análises dos
+    períodos e as mudanças de posição da casa guardadas no cache e reconstrói as 
+    máscaras de votações.
+
+    As análises descartadas são as dos períodos atuais da casa (as listas de períodos
+    já foram refeitas por modelagem.models.atualiza_caches_da_casa, que é conectado 
+    antes); análises de períodos que deixaram de existir não são mais consultadas."""
+    from analises import analise # importado aqui porque o módulo analise importa este
+    cache.delete(analise.chave_cache_matrizes(casa_legislativa))
+    cache.delete(analise.chave_cache_presencas(casa_legislativa))
+    chaves = []
+    for codificacao in analise.CODIFICACOES:
+        chaves.append(analise.chave_cache_mudancas(casa_legislativa, codificacao))
+        for periodicidade, nome in PERIODOS:
+            chaves += [analise.chave_cache_periodo(casa_legislativa, periodo, codificacao)
+                       for periodo in casa_legislativa.periodos(periodicidade)]
+    cache.delete_many(chaves)
+    analise.constroi_mascaras(casa_legislativa)
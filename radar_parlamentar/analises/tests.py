@@ -21,10 +21,16 @@ from __future__ import unicode_literals
 from django.test import TestCase
 from analises import analise
 from analises import grafico
+from analises import agrupamento
+from analises import views
+from analises.models import LealdadePartidaria, Coalizao, SimilaridadeParlamentar
 from grafico import GeradorGrafico
 from importadores import convencao
 from modelagem import models
+from django.core.cache import cache
+from django.http import Http404
 import numpy
+import json
 
 def mean(v):
     return 1.0 * sum(v) / len(v)
@@ -73,6 +79,464 @@ class AnaliseTest(TestCase):
         matriz_votacao = builder.gera_matriz()
         self.assertTrue((matriz_votacao == MATRIZ_VOTACAO_ESPERADA).all()) 
 
+    def test_contagens_opcoes(self):
+        votacoes = self.votacoes.order_by('id')
+        builder = analise.MatrizDeVotacoesBuilder(votacoes, list(self.partidos))
+        builder.gera_matriz()
+        nomes = [p.nome for p in builder.partidos]
+        im = nomes.index(convencao.MONARQUISTAS)
+        contagens = builder.contagens_opcoes[im][3] # sim, não, ausente
+        self.assertEqual(contagens[analise.CODIGOS_OPCOES[models.AUSENTE]], 1)
+        self.assertEqual(contagens.sum(), 3)
+        self.assertEqual(builder.matriz_presencas[im][3], 2) # ausência não conta como presença
+        self.assertEqual(builder.matriz_votacoes[im][3], 0)
+
+    def test_matriz_de_votacao_sem_votos(self):
+        votacao = models.Votacao(id_vot='9', descricao='Votação sem votos', data=convencao.DATA_NO_SEGUNDO_SEMESTRE)
+        votacao.save()
+        outro_partido = models.Partido(nome='Feuillants', numero=11)
+        outro_partido.save()
+        try:
+            builder = analise.MatrizDeVotacoesBuilder([votacao], list(self.partidos))
+            self.assertEqual(builder.gera_matriz().tolist(), [[0], [0], [0]])
+            self.assertEqual(builder.matriz_presencas.sum(), 0)
+            self.assertEqual(builder.gera_matriz_codigos().shape, (0, 1))
+            self.assertEqual(builder.fatia([0]).matriz_votacoes.shape, (3, 1))
+            # votos só de partidos fora da análise
+            builder = analise.MatrizDeVotacoesBuilder(list(self.votacoes[0:2]), [outro_partido])
+            self.assertEqual(builder.gera_matriz().tolist(), [[0, 0]])
+            self.assertEqual(builder.contagens_opcoes.sum(), 0)
+        finally:
+            votacao.delete()
+            outro_partido.delete()
+
+    def test_pivos(self):
+        votacoes = self.votacoes.order_by('id')
+        builder = analise.MatrizDeVotacoesBuilder(votacoes, list(self.partidos))
+        builder.gera_matriz()
+        pivos = builder.gera_matriz_pivos()
+        nomes = [p.nome for p in builder.partidos]
+        ig = nomes.index(convencao.GIRONDINOS)
+        ij = nomes.index(convencao.JACOBINOS)
+        im = nomes.index(convencao.MONARQUISTAS)
+        # votação 1 empatada (girondinos divididos): jacobinos e monarquistas desempatam
+        self.assertEqual([pivos[ig][0], pivos[ij][0], pivos[im][0]], [False, True, True])
+        # votação 2: 6 não contra 3 sim
+        self.assertEqual([pivos[ig][1], pivos[ij][1], pivos[im][1]], [True, True, False])
+        ap = analise.AnalisadorPeriodo(self.casa_legislativa)
+        ap.partidos_2d()
+        self.assertAlmostEqual(ap.pivos_partidos[convencao.JACOBINOS], pivos[ij].mean())
+
+    def test_vitorias(self):
+        votacoes = list(self.votacoes.order_by('id')[0:3])
+        for votacao, resultado in zip(votacoes, [models.APROVADO, models.REJEITADO, models.SEM_RESULTADO]):
+            votacao.resultado_normalizado = resultado # não é salvo no banco
+        ap = analise.AnalisadorPeriodo(self.casa_legislativa, votacoes=votacoes)
+        ap.partidos_2d()
+        # votação 1: jacobinos sim, monarquistas não, girondinos divididos
+        # votação 2: girondinos e jacobinos não, monarquistas sim
+        self.assertEqual(ap.vitorias_partidos[convencao.JACOBINOS], 1.0)
+        self.assertEqual(ap.vitorias_partidos[convencao.MONARQUISTAS], 0.0)
+        self.assertEqual(ap.vitorias_partidos[convencao.GIRONDINOS], 1.0)
+        sem_resultado = analise.AnalisadorPeriodo(self.casa_legislativa, votacoes=votacoes[2:])
+        sem_resultado.partidos_2d()
+        self.assertEqual(sem_resultado.vitorias_partidos[convencao.JACOBINOS], None)
+
+    def test_presencas_mensais(self):
+        cache.clear()
+        presencas = analise.presencas_da_casa(self.casa_legislativa)
+        self.assertEqual(presencas.meses, ['1989-02', '1989-10'])
+        self.assertEqual(presencas.votacoes.tolist(), [4, 4])
+        self.assertEqual(len(presencas.parlamentares), 9)
+        self.assertEqual(presencas.presencas.dtype, numpy.int16)
+        self.assertEqual(presencas.votos.sum(), 72)
+        self.assertEqual(presencas.presencas.sum(), 72 - 4) # 4 votos AUSENTE
+        monarquista = AnaliseTest.importer.legs[convencao.MONARQUISTAS][1].parlamentar.id
+        linha = [id_parl for id_parl, nome in presencas.parlamentares].index(monarquista)
+        self.assertEqual(presencas.presencas[linha].tolist(), [4, 2])
+        self.assertEqual(presencas.votos[linha].tolist(), [4, 4])
+        dic = json.loads(presencas.json())
+        self.assertEqual(dic['presencas'][linha], [4, 2])
+
+    def test_codificacoes(self):
+        votacoes = self.votacoes.order_by('id')
+        builder = analise.MatrizDeVotacoesBuilder(votacoes, list(self.partidos))
+        builder.gera_matriz()
+        matrizes = builder.gera_matrizes_codificadas(analise.CODIFICACOES.keys())
+        self.assertTrue((matrizes[analise.CODIFICACAO_PADRAO] == builder.matriz_votacoes).all())
+        nomes = [p.nome for p in builder.partidos]
+        ig = nomes.index(convencao.GIRONDINOS)
+        im = nomes.index(convencao.MONARQUISTAS)
+        self.assertAlmostEqual(matrizes[analise.CODIFICACAO_PADRAO][ig][4], 2.0/3) # sim, sim, abstenção
+        self.assertAlmostEqual(matrizes['somente_sim_e_nao'][ig][4], 1)
+        self.assertAlmostEqual(matrizes[analise.CODIFICACAO_PADRAO][im][5], 1) # ausente, sim, sim
+        self.assertAlmostEqual(matrizes['ausencia_como_abstencao'][im][5], 2.0/3)
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.BIENIO, codificacao='somente_sim_e_nao')
+        dic = json.loads(at.get_json())
+        self.assertEqual(dic['geral']['codificacao'], 'somente_sim_e_nao')
+
+    def test_matriz_coesoes(self):
+        builder = analise.MatrizDeVotacoesBuilder(self.votacoes, self.partidos)
+        builder.gera_matriz()
+        coesoes = builder.gera_matriz_coesoes()
+        nomes = [p.nome for p in self.partidos]
+        ig = nomes.index(convencao.GIRONDINOS)
+        ij = nomes.index(convencao.JACOBINOS)
+        im = nomes.index(convencao.MONARQUISTAS)
+        self.assertAlmostEqual(coesoes[ig][0], 0) # sim, abstenção, não
+        self.assertAlmostEqual(coesoes[ij][0], 1) # sim, sim, sim
+        self.assertAlmostEqual(coesoes[ig][2], 1.0/3) # não, não, sim
+        self.assertAlmostEqual(coesoes[im][3], 0) # sim, não, ausente
+
+    def test_coesao_media(self):
+        an = analise.AnalisadorPeriodo(self.casa_legislativa, partidos=self.partidos)
+        an.partidos_2d()
+        self.assertAlmostEqual(an.coesoes_partidos[convencao.JACOBINOS], (6 + 2.0/3) / 8)
+        self.assertAlmostEqual(an.coesoes_partidos[convencao.MONARQUISTAS], 7.0 / 8) # sim, não, ausente na votação 4
+
+    def test_json_temporal_com_coesoes(self):
+        for i in range(2): # a segunda análise é recuperada do cache
+            at = analise.AnalisadorTemporal(self.casa_legislativa, periodicidade=models.BIENIO)
+            dic = json.loads(at.get_json())
+            jacobinos = [p for p in dic['partidos'] if p['nome'] == convencao.JACOBINOS][0]
+            self.assertAlmostEqual(jacobinos['c'][0], 0.833, 3)
+            self.assertEqual(len(dic['periodos'][0]['coesoes'][convencao.JACOBINOS]), 8)
+
+    def test_matriz_codigos(self):
+        builder = analise.MatrizDeVotacoesBuilder(self.votacoes, self.partidos)
+        builder.gera_matriz()
+        codigos = builder.gera_matriz_codigos()
+        self.assertEqual(codigos.shape, (9, 8))
+        leg = AnaliseTest.importer.legs[convencao.MONARQUISTAS][2]
+        il = list(builder.legislaturas).index(leg.id)
+        nomes = [p.nome for p in self.partidos]
+        self.assertEqual(nomes[builder.partidos_legislaturas[il]], convencao.MONARQUISTAS)
+        self.assertEqual(codigos[il][3], analise.CODIGOS_OPCOES[models.AUSENTE])
+        self.assertEqual(codigos[il][4], analise.CODIGOS_OPCOES[models.NAO])
+
+    def test_lealdades(self):
+        builder = analise.LealdadeBuilder(self.casa_legislativa, models.BIENIO)
+        builder.salva_lealdades()
+        self.assertEqual(LealdadePartidaria.objects.filter(casa_legislativa=self.casa_legislativa).count(), 9)
+        # votação 4 não conta (empate no partido) e na votação 8 se absteve contra o partido:
+        leg = AnaliseTest.importer.legs[convencao.JACOBINOS][0]
+        lealdade = LealdadePartidaria.objects.get(legislatura=leg)
+        self.assertEqual(lealdade.votos, 7)
+        self.assertEqual(lealdade.votos_com_partido, 6)
+        leg = AnaliseTest.importer.legs[convencao.JACOBINOS][1]
+        self.assertEqual(LealdadePartidaria.objects.get(legislatura=leg).lealdade, 1)
+
+    def test_similaridades(self):
+        builder = analise.SimilaridadeBuilder(self.casa_legislativa, models.ANO, k=2)
+        builder.salva_similaridades()
+        self.assertEqual(SimilaridadeParlamentar.objects.filter(casa_legislativa=self.casa_legislativa).count(), 18)
+        jacobino = AnaliseTest.importer.legs[convencao.JACOBINOS][1]
+        similares = SimilaridadeParlamentar.objects.filter(legislatura=jacobino).order_by('posicao')
+        esperados = set([AnaliseTest.importer.legs[convencao.JACOBINOS][2].id, AnaliseTest.importer.legs[convencao.GIRONDINOS][0].id])
+        self.assertEqual(set(s.similar_id for s in similares), esperados)
+        for s in similares:
+            self.assertEqual(s.votacoes, 8)
+            self.assertAlmostEqual(s.similaridade, 7.0 / 8)
+        # ausências não contam como votações em comum
+        ausente = analise.CODIGOS_OPCOES[models.AUSENTE]
+        codigos = numpy.array([[0, 1, ausente], [0, 0, 0], [analise.SEM_VOTO, 1, 0]])
+        similaridades, comuns, ordem = builder._mais_parecidas(codigos)
+        self.assertEqual(comuns[0].tolist(), [2, 2, 1])
+        self.assertEqual(similaridades[0].tolist(), [-1, 0.5, 1])
+        self.assertEqual(ordem[0].tolist(), [2, 1])
+
+    def test_coalizoes(self):
+        builder = analise.CoalizaoBuilder(self.casa_legislativa, models.ANO)
+        builder.salva_coalizoes()
+        coalizoes = Coalizao.por_periodo(self.casa_legislativa, models.ANO)
+        self.assertEqual(len(coalizoes), 1)
+        inicio, fim, partidos = coalizoes[0]
+        self.assertEqual(partidos, set([convencao.GIRONDINOS, convencao.JACOBINOS]))
+        builder = analise.CoalizaoBuilder(self.casa_legislativa, models.MES)
+        coalizoes = builder.gera_coalizoes()
+        self.assertEqual(len(coalizoes), 2) # apenas meses com votações
+
+    def test_ligacao_media(self):
+        pontos = numpy.array([[0.], [1.], [5.]])
+        distancias = agrupamento.distancias_por_periodo([pontos])[0]
+        self.assertAlmostEqual(distancias[0][2], 5)
+        juncoes = agrupamento.ligacao_media(distancias)
+        self.assertEqual(juncoes, [[0, 1, 1, 2], [2, 3, 4.5, 3]])
+
+    def test_distancias_por_periodo(self):
+        periodos = [numpy.array([[1., 0., 1.], [0., 0., 1.], [1., 1., 0.]]), numpy.array([[2.], [0.], [-1.]])]
+        distancias = agrupamento.distancias_por_periodo(periodos)
+        for matriz, d in zip(periodos, distancias):
+            diferencas = matriz[:, numpy.newaxis, :] - matriz[numpy.newaxis, :, :]
+            esperadas = numpy.sqrt((diferencas**2).sum(axis=2) / matriz.shape[1])
+            self.assertTrue(numpy.allclose(d, esperadas))
+        self.assertEqual(distancias[1][0][2], 3)
+
+    def test_json_dendrogramas(self):
+        for i in range(2): # a segunda análise é recuperada do cache
+            at = analise.AnalisadorTemporal(self.casa_legislativa, periodicidade=models.BIENIO)
+            dic = json.loads(at.get_json_dendrogramas())
+            dendrograma = dic['periodos'][0]['dendrograma']
+            self.assertEqual(len(dendrograma['juncoes']), 2)
+            a, b, distancia, tamanho = dendrograma['juncoes'][0]
+            unidos = set([dendrograma['partidos'][a], dendrograma['partidos'][b]])
+            self.assertEqual(unidos, set([convencao.GIRONDINOS, convencao.JACOBINOS]))
+            self.assertEqual(dendrograma['juncoes'][1][3], 3)
+
+    def test_analise_conjunta(self):
+        periodo = self.casa_legislativa.periodos(models.BIENIO)[0]
+        individual = analise.analise_do_periodo(self.casa_legislativa, periodo).partidos_2d()
+        # a mesma casa duas vezes: votações duplicadas não mudam as direções principais
+        conjunta = analise.AnalisadorConjunto([self.casa_legislativa, self.casa_legislativa], periodo)
+        coordenadas = conjunta.partidos_2d()
+        self.assertEqual(sorted(coordenadas.keys()), sorted(p.nome for p in self.partidos))
+        for nome in coordenadas:
+            for c in range(2):
+                self.assertAlmostEqual(abs(coordenadas[nome][c]), abs(individual[nome][c]), 4)
+        self.assertEqual(conjunta.tamanhos_partidos[convencao.JACOBINOS], 2 * convencao.PARLAMENTARES_POR_PARTIDO)
+
+    def test_analise_com_decaimento(self):
+        # com meia-vida muito longa e referência no primeiro semestre, equivale à análise das votações 1 a 4
+        votacoes = self.votacoes.filter(data=convencao.DATA_NO_PRIMEIRO_SEMESTRE).order_by('id')
+        esperado = analise.AnalisadorPeriodo(self.casa_legislativa, votacoes=list(votacoes), 
+                                             partidos=self.casa_legislativa.partidos()).partidos_2d()
+        an = analise.AnalisadorDecaimento(self.casa_legislativa, convencao.DATA_NO_PRIMEIRO_SEMESTRE, meia_vida=10**9)
+        coordenadas = an.partidos_2d()
+        self.assertEqual(an.pesos.tolist(), [1]*4 + [0]*4)
+        for nome in esperado:
+            for c in range(2):
+                self.assertAlmostEqual(abs(coordenadas[nome][c]), abs(esperado[nome][c]), 4)
+        # referência anterior a todas as votações: partidos na origem
+        an = analise.AnalisadorDecaimento(self.casa_legislativa, convencao.INICIO_PERIODO)
+        self.assertEqual(an.partidos_2d()[convencao.JACOBINOS], [0, 0])
+
+    def test_aquece_cache(self):
+        cache.clear()
+        antes = json.loads(analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE).get_json())
+        cache.clear()
+        analises = analise.aquece_cache(self.casa_legislativa)
+        # 1 quadriênio, 1 biênio, 1 ano, 2 semestres e 2 meses, em cada codificação:
+        self.assertEqual(len(analises), 7 * len(analise.CODIFICACOES))
+        chave = analise.chave_cache_periodo(self.casa_legislativa, analises[-1].periodo)
+        self.assertTrue(cache.get(chave) != None)
+        depois = json.loads(analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE).get_json())
+        for p_antes, p_depois in zip(antes['partidos'], depois['partidos']):
+            self.assertEqual(p_antes['nome'], p_depois['nome'])
+            for c in ['x', 'y', 't', 'c']:
+                self.assertEqual(p_antes[c], p_depois[c])
+
+    def test_cubo_obtido_uma_vez_por_analise_temporal(self):
+        cache.clear()
+        da_casa = models.CuboDeVotos.da_casa
+        chamadas = []
+        def conta(casa_legislativa):
+            chamadas.append(casa_legislativa)
+            return da_casa(casa_legislativa)
+        models.CuboDeVotos.da_casa = staticmethod(conta)
+        try:
+            dic = json.loads(analise.AnalisadorTemporal(self.casa_legislativa, models.MES).get_json())
+            self.assertEqual(len(dic['periodos']), 2)
+            self.assertEqual(len(chamadas), 1)
+            del chamadas[:]
+            analise.aquece_cache(self.casa_legislativa, [models.MES, models.SEMESTRE])
+            self.assertEqual(len(chamadas), 1)
+        finally:
+            models.CuboDeVotos.da_casa = staticmethod(da_casa)
+        for partido in dic['partidos']:
+            self.assertEqual(partido['t'], [round(t, 1) for t in partido['t']])
+
+    def test_importacao_descarta_analises_dos_periodos(self):
+        cache.clear()
+        analise.aquece_caches([models.MES], [analise.CODIFICACAO_PADRAO])
+        periodo = self.casa_legislativa.periodos(models.MES)[0]
+        chaves = [analise.chave_cache_periodo(self.casa_legislativa, periodo),
+                  analise.chave_cache_mudancas(self.casa_legislativa)]
+        for chave in chaves:
+            self.assertTrue(cache.get(chave) != None)
+        models.importacao_concluida.send(sender=convencao.ImportadorConvencao, casa_legislativa=self.casa_legislativa)
+        for chave in chaves:
+            self.assertEqual(cache.get(chave), None)
+        # as coordenadas da última análise exata continuam, para avaliar prévias
+        self.assertTrue(cache.get(analise.chave_cache_coordenadas(self.casa_legislativa, periodo)) != None)
+
+    def test_aquece_caches_com_casa_sem_votacoes(self):
+        vazia = models.CasaLegislativa(nome='Casa vazia', nome_curto='vazia', esfera=models.MUNICIPAL, local='')
+        vazia.save()
+        try:
+            self.assertEqual(analise.aquece_cache(vazia), [])
+            analise.aquece_caches([models.MES], [analise.CODIFICACAO_PADRAO])
+            chave = analise.chave_cache_mudancas(self.casa_legislativa)
+            self.assertTrue(cache.get(chave) != None)
+        finally:
+            vazia.delete()
+
+    def test_analise_com_tempo_limite(self):
+        cache.clear()
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE, tempo_limite=0)
+        at.completa_em_segundo_plano = False
+        dic = json.loads(at.get_json())
+        self.assertTrue(dic['geral']['parcial'])
+        self.assertEqual([p['nome'] for p in dic['periodos']], ['1989 2o Semestre'])
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE)
+        dic = json.loads(at.get_json())
+        self.assertFalse(dic['geral']['parcial'])
+        self.assertEqual(len(dic['periodos']), 2)
+
+    def test_mascaras_de_votacoes(self):
+        prop = models.Proposicao.objects.get(casa_legislativa=self.casa_legislativa, numero='5')
+        prop.sigla = 'PEC'
+        prop.save()
+        try:
+            models.importacao_concluida.send(sender=convencao.ImportadorConvencao, casa_legislativa=self.casa_legislativa)
+            mascaras = analise.mascaras_da_casa(self.casa_legislativa)
+            self.assertEqual(mascaras.valores('sigla'), ['PEC', 'PL'])
+            self.assertEqual(mascaras.mascara(sigla=['PEC']).tolist(), [False]*4 + [True] + [False]*3)
+            self.assertEqual(mascaras.mascara(sigla=['PL', 'PEC'], ano=[1989], nominal=True).sum(), 8)
+            self.assertEqual(mascaras.mascara(ano=[1990]).sum(), 0)
+            periodo = self.casa_legislativa.periodos(models.SEMESTRE)[1]
+            x = analise.analise_filtrada(self.casa_legislativa, periodo, sigla=['PL'])
+            self.assertEqual([v.id_vot for v in x.votacoes], ['6', '7', '8'])
+            self.assertEqual(analise.analise_filtrada(self.casa_legislativa, periodo, ano=[1990]), None)
+            # tamanhos dos partidos contados só nas votações selecionadas
+            x = analise.analise_filtrada(self.casa_legislativa, periodo, sigla=['PEC'])
+            votos = models.Voto.objects.filter(votacao__proposicao=prop)
+            for partido in self.partidos:
+                self.assertEqual(x.tamanhos_partidos[partido.nome], votos.filter(partido=partido).count())
+            # resultado normalizado
+            models.Votacao.objects.filter(proposicao=prop).update(resultado_normalizado=models.APROVADO)
+            models.importacao_concluida.send(sender=convencao.ImportadorConvencao, casa_legislativa=self.casa_legislativa)
+            mascaras = analise.mascaras_da_casa(self.casa_legislativa)
+            self.assertEqual(mascaras.mascara(resultado=[models.APROVADO]).tolist(), [False]*4 + [True] + [False]*3)
+            response = self.client.get('/analises/json_analise/conv/', {'resultado': 'aprovado'})
+            self.assertEqual(len(json.loads(response.content)['periodos']), 1)
+            self.assertEqual(views._resultado_normalizado('-1'), models.REJEITADO)
+            self.assertRaises(Http404, views._resultado_normalizado, 'talvez')
+            at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE, filtros={'sigla': ['PEC']})
+            dic = json.loads(at.get_json())
+            self.assertEqual(dic['geral']['filtro_votacoes'], {'sigla': ['PEC']})
+            self.assertEqual(len(dic['periodos']), 1)
+        finally:
+            prop.sigla = 'PL'
+            prop.save()
+            models.Votacao.objects.filter(proposicao=prop).update(resultado_normalizado=models.SEM_RESULTADO)
+            models.importacao_concluida.send(sender=convencao.ImportadorConvencao, casa_legislativa=self.casa_legislativa)
+
+    def test_json_analise_com_filtro_sem_votacoes(self):
+        cache.clear()
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE, filtros={'sigla': ['XYZ']})
+        dic = json.loads(at.get_json())
+        self.assertEqual(dic['periodos'], [])
+        self.assertEqual(dic['geral']['filtro_votacoes'], {'sigla': ['XYZ']})
+        response = self.client.get('/analises/json_analise/conv/', {'sigla': 'XYZ'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['periodos'], [])
+
+    def test_disparidade_procrustes(self):
+        a = numpy.array([[0., 0.], [1., 0.], [0., 2.]])
+        rotacao = numpy.array([[0., -1.], [1., 0.]])
+        self.assertAlmostEqual(analise.disparidade_procrustes(a, 3 * numpy.dot(a, rotacao) + 5), 0)
+        self.assertTrue(analise.disparidade_procrustes(a, [[0., 0.], [1., 0.], [2., 0.]]) > 0.1)
+
+    def test_colunas_unicas(self):
+        matriz = numpy.array([[1., 0., 1., -1., 0.], [0., 1., 0., 1., 1.]])
+        unicas, contagens, inversa = analise.colunas_unicas(matriz)
+        numpy.testing.assert_array_equal(unicas, [[1., 0., -1.], [0., 1., 1.]])
+        numpy.testing.assert_array_equal(contagens, [2, 2, 1])
+        numpy.testing.assert_array_equal(unicas[:, inversa], matriz)
+
+    def test_pca_com_colunas_repetidas(self):
+        ap = analise.AnalisadorPeriodo(self.casa_legislativa)
+        ap.partidos_2d()
+        matriz = ap.vetores_votacao - ap.vetores_votacao.mean(axis=0)
+        U, d, Vt = numpy.linalg.svd(matriz, full_matrices=False)
+        numpy.testing.assert_array_almost_equal(ap.pca_partido.eigen[:2], d[:2]**2)
+        numpy.testing.assert_array_almost_equal(numpy.abs(ap.pca_partido.U[:, :2]), numpy.abs(U[:, :2]))
+        numpy.testing.assert_array_almost_equal(ap.pca_partido.Vt[:2]**2, Vt[:2]**2)
+
+    def test_detecta_mudancas(self):
+        num_periodos = 12
+        coordenadas = numpy.zeros((3, num_periodos, 2))
+        coordenadas[0, 7:, 0] = 1 # partido 0 muda de posição no período 7
+        coordenadas[1, :, 1] = numpy.linspace(0, 0.1, num_periodos) # deriva lenta
+        coordenadas[1, 3, 1] = 0.5 # um ponto fora da curva não é mudança
+        coordenadas[2, 11:, 0] = 1 # mudança sem períodos suficientes depois
+        presentes = numpy.ones((3, num_periodos), dtype=bool)
+        presentes[0, 8] = False
+        coordenadas[0, 8] = -5 # posição de período sem votos é ignorada
+        cortes, ganhos = analise.detecta_mudancas(coordenadas, presentes)
+        numpy.testing.assert_array_equal(cortes, [7, -1, -1])
+        self.assertAlmostEqual(ganhos[0], 1.0)
+
+    def test_mudancas_de_posicao(self):
+        cache.clear()
+        # tempo esgotado: resultado parcial fora do cache (sem completar os meses em segundo plano)
+        completa_analises = analise.AnalisadorTemporal._completa_analises
+        analise.AnalisadorTemporal._completa_analises = lambda at, periodos: None
+        try:
+            mudancas, parcial = analise.mudancas_de_posicao(self.casa_legislativa, tempo_limite=0)
+        finally:
+            analise.AnalisadorTemporal._completa_analises = completa_analises
+        self.assertTrue(parcial)
+        chave = analise.chave_cache_mudancas(self.casa_legislativa)
+        self.assertEqual(cache.get(chave), None)
+        cache.clear()
+        mudancas, parcial = analise.mudancas_de_posicao(self.casa_legislativa)
+        self.assertEqual(mudancas, []) # só há dois meses com votações
+        self.assertFalse(parcial)
+        self.assertEqual(cache.get(chave), [])
+        dic = json.loads(self.client.get('/analises/json_mudancas/conv/').content)
+        self.assertEqual(dic, {'mudancas': [], 'parcial': False})
+        vazia = models.CasaLegislativa(nome='Casa vazia', nome_curto='vazia', esfera=models.MUNICIPAL, local='')
+        vazia.save()
+        try:
+            self.assertEqual(analise.mudancas_de_posicao(vazia), ([], False))
+        finally:
+            vazia.delete()
+
+    def test_previa(self):
+        cache.clear()
+        analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE).get_json()
+        for periodo in self.casa_legislativa.periodos(models.SEMESTRE):
+            cache.delete(analise.chave_cache_periodo(self.casa_legislativa, periodo))
+        # sem as matrizes da casa no cache, a análise é exata
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE, previa=True)
+        dic = json.loads(at.get_json())
+        self.assertEqual([periodo['previa'] for periodo in dic['periodos']], [False, False])
+        self.assertEqual(cache.get(analise.chave_cache_matrizes(self.casa_legislativa)), None)
+        for periodo in self.casa_legislativa.periodos(models.SEMESTRE):
+            cache.delete(analise.chave_cache_periodo(self.casa_legislativa, periodo))
+        analise.matrizes_da_casa(self.casa_legislativa)
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.SEMESTRE, previa=True)
+        at.completa_em_segundo_plano = False
+        dic = json.loads(at.get_json())
+        self.assertEqual(len(dic['periodos']), 2)
+        for periodo in dic['periodos']:
+            self.assertTrue(periodo['previa'])
+            self.assertTrue(0 <= periodo['erro_previa'] <= 1)
+            self.assertEqual(len(periodo['votacoes']), 2) # 20% das 4 votações, mas ao menos 2
+            self.assertEqual(periodo['nvotacoes_amostra'], 2)
+            self.assertEqual(periodo['nvotacoes'], 4)
+
+    def test_json_periodo_com_uma_votacao(self):
+        votacao = self.votacoes.order_by('id')[0]
+        x = analise.AnalisadorPeriodo(self.casa_legislativa, votacoes=[votacao], partidos=list(self.partidos))
+        x.partidos_2d()
+        self.assertEqual(len(x.pca_partido.eigen), 2)
+        self.assertEqual(x.pca_partido.Vt.shape, (2, 1))
+        self.assertEqual(x.pca_partido.eigen[1], 0)
+        # votação unânime: não há variância para explicar
+        unanime = self.votacoes.order_by('id')[5]
+        periodo = self.casa_legislativa.periodos(models.ANO)[0]
+        x = analise.AnalisadorPeriodo(self.casa_legislativa, periodo, votacoes=[unanime], partidos=list(self.partidos))
+        x.partidos_2d()
+        at = analise.AnalisadorTemporal(self.casa_legislativa, models.ANO)
+        at.analisadores_periodo = [x]
+        at._cria_json()
+        dic = json.loads(at.json)
+        self.assertEqual(dic['periodos'][0]['var_explicada'], 0)
+        self.assertEqual(dic['periodos'][0]['nvotacoes_amostra'], None)
+        self.assertEqual(len(dic['periodos'][0]['cp1']['composicao']), 1)
+
     def test_partidos_2d(self):
         an = analise.AnalisadorPeriodo(self.casa_legislativa, partidos=self.partidos)
         grafico = an.partidos_2d()
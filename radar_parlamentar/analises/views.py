@@ -19,40 +19,144 @@
 
 from __future__ import unicode_literals
 from django.template import RequestContext
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import render_to_response, get_object_or_404, get_list_or_404, redirect
 from modelagem import models
 from grafico import JsonAnaliseGenerator
-from analise import AnalisadorTemporal
+from analise import AnalisadorTemporal, CODIFICACOES, CODIFICACAO_PADRAO, mudancas_de_posicao, presencas_da_casa
+from analises.models import SimilaridadeParlamentar
 import logging
+import json
 from django.views.decorators.cache import cache_page
+from django.utils.cache import add_never_cache_headers
 
 logger = logging.getLogger("radar")
 
+# tempo (em segundos) para a análise do json_analise, abaixo do timeout do proxy;
+# esgotado o tempo, é retornado o resultado parcial (ver AnalisadorTemporal)
+TEMPO_LIMITE_ANALISE = 20
+
 def analises(request):
     return render_to_response('analises.html', {}, context_instance=RequestContext(request))
 
 def analise(request, nome_curto_casa_legislativa):
-    """ Retorna a lista de partidos para montar a legenda do gráfico"""
-    partidos = models.Partido.objects.order_by('numero').all()
+    """ Retorna a lista de partidos para montar a legenda do gráfico e as estatísticas
+    da casa legislativa (calculadas nas importações, ver models.EstatisticasCasaLegislativa)"""
     casa_legislativa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
-    num_votacao = casa_legislativa.num_votacao()
+    estatisticas = models.EstatisticasCasaLegislativa.da_casa(casa_legislativa)
+    partidos = estatisticas.partidos.order_by('numero')
     return render_to_response(
                 'analise.html',
-                {'casa_legislativa':casa_legislativa, 'partidos':partidos,'num_votacao':num_votacao},
+                {'casa_legislativa':casa_legislativa, 'partidos':partidos,
+                 'num_votacao':estatisticas.num_votacoes, 'estatisticas':estatisticas},
                 context_instance=RequestContext(request)
             )
 
 @cache_page(60 * 60)
 def json_analise(request,nome_curto_casa_legislativa):
-    """Retorna (novo) JSON com dados da análise solicitada."""
+    """Retorna (novo) JSON com dados da análise solicitada.
+    
+    O parâmetro GET opcional 'codificacao' escolhe a codificação dos votos
+    (uma das chaves de analise.CODIFICACOES). Os parâmetros opcionais 'sigla', 
+    'ano' e 'resultado' (que podem ser repetidos) e 'nominal' (true ou false) 
+    filtram as votações consideradas; 'resultado' é o resultado normalizado,
+    pelo número ou pelo nome (ex: 'aprovado', 'rejeitado', 'sem resultado'). Com 'previa=true', períodos ainda não 
+    analisados são estimados com uma amostra das votações (se as matrizes
+    da casa estiverem no cache; senão, são analisados normalmente)."""
     casa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
-    at = AnalisadorTemporal(casa,periodicidade=models.BIENIO,votacoes=[])
+    codificacao = request.GET.get('codificacao', CODIFICACAO_PADRAO)
+    if codificacao not in CODIFICACOES:
+        raise Http404
+    filtros = _filtros_de_votacoes(request)
+    at = AnalisadorTemporal(casa,periodicidade=models.BIENIO,votacoes=[],codificacao=codificacao,
+                            tempo_limite=TEMPO_LIMITE_ANALISE,filtros=filtros,
+                            previa=request.GET.get('previa') == 'true')
     # O argumento votacoes passado em branco irá utilizar todas as votações.
     # Se for uma lista de votações, serão consideras apenas estas.
     json = at.get_json()
+    response = HttpResponse(json, mimetype='application/json')
+    if at.parcial or any(ap.previa for ap in at.analisadores_periodo): 
+        # resultado parcial ou aproximado não deve ficar no cache
+        add_never_cache_headers(response)
+    return response
+
+def _filtros_de_votacoes(request):
+    """Extrai da requisição os filtros de votações (ver analise.MascarasDeVotacoes)"""
+    filtros = {}
+    if request.GET.getlist('sigla'):
+        filtros['sigla'] = request.GET.getlist('sigla')
+    if request.GET.getlist('ano'):
+        try:
+            filtros['ano'] = [int(ano) for ano in request.GET.getlist('ano')]
+        except ValueError:
+            raise Http404
+    if request.GET.getlist('resultado'):
+        filtros['resultado'] = [_resultado_normalizado(resultado) for resultado in request.GET.getlist('resultado')]
+    if 'nominal' in request.GET:
+        filtros['nominal'] = request.GET['nominal'] == 'true'
+    return filtros or None
+
+def _resultado_normalizado(resultado):
+    """Converte o valor do filtro 'resultado' (o número ou o nome de um dos 
+    models.RESULTADOS, ex: '1' ou 'aprovado') em resultado normalizado"""
+    for valor, nome in models.RESULTADOS:
+        if resultado.strip().lower() in [unicode(valor), nome.lower()]:
+            return valor
+    raise Http404
+
+@cache_page(60 * 60)
+def json_dendrograma(request, nome_curto_casa_legislativa):
+    """Retorna JSON com o agrupamento hierárquico dos partidos em cada período."""
+    casa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
+    at = AnalisadorTemporal(casa,periodicidade=models.BIENIO,votacoes=[])
+    json = at.get_json_dendrogramas()
     return HttpResponse(json, mimetype='application/json')
 
+def json_mudancas(request, nome_curto_casa_legislativa):
+    """Retorna JSON com as mudanças abruptas de posição dos partidos, detectadas
+    nas análises mensais (ver analise.mudancas_de_posicao). O parâmetro GET 
+    opcional 'codificacao' escolhe a codificação dos votos. Como em json_analise, 
+    esgotado o tempo limite as mudanças são detectadas só nos meses já analisados
+    ("parcial": true)."""
+    casa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
+    codificacao = request.GET.get('codificacao', CODIFICACAO_PADRAO)
+    if codificacao not in CODIFICACOES:
+        raise Http404
+    mudancas, parcial = mudancas_de_posicao(casa, codificacao, TEMPO_LIMITE_ANALISE)
+    response = HttpResponse(json.dumps({"mudancas": mudancas, "parcial": parcial}), mimetype='application/json')
+    if parcial: # resultado parcial não deve ficar no cache
+        add_never_cache_headers(response)
+    return response
+
+def json_presencas(request, nome_curto_casa_legislativa):
+    """Retorna JSON com a presença de cada parlamentar em cada mês (mapa de calor;
+    ver analise.PresencasMensais)."""
+    casa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
+    return HttpResponse(presencas_da_casa(casa).json(), mimetype='application/json')
+
+@cache_page(60 * 60)
+def json_similares(request, nome_curto_casa_legislativa, id_parlamentar):
+    """Retorna JSON com os parlamentares que votaram de forma mais parecida com
+    o parlamentar (id do banco de dados) em cada período (ver analise.SimilaridadeBuilder).
+    O parâmetro GET opcional 'periodicidade' escolhe a periodicidade (padrão: ANO)."""
+    casa = get_object_or_404(models.CasaLegislativa,nome_curto=nome_curto_casa_legislativa)
+    parlamentar = get_object_or_404(models.Parlamentar,id=id_parlamentar)
+    periodicidade = request.GET.get('periodicidade', models.ANO)
+    if periodicidade not in [p for p, nome in models.PERIODOS]:
+        raise Http404
+    similaridades = SimilaridadeParlamentar.objects.filter(casa_legislativa=casa, periodicidade=periodicidade,
+                                                          legislatura__parlamentar=parlamentar)
+    similaridades = similaridades.select_related('similar__parlamentar', 'similar__partido').order_by('inicio', 'posicao')
+    periodos = []
+    for sim in similaridades:
+        if not periodos or periodos[-1]['inicio'] != unicode(sim.inicio):
+            periodos.append({'inicio': unicode(sim.inicio), 'fim': unicode(sim.fim), 'similares': []})
+        periodos[-1]['similares'].append({'id': sim.similar.parlamentar.id, 'nome': sim.similar.parlamentar.nome, 
+                                          'partido': sim.similar.partido.nome, 'votacoes': sim.votacoes, 
+                                          'similaridade': round(sim.similaridade, 3)})
+    dados = {'parlamentar': {'id': parlamentar.id, 'nome': parlamentar.nome}, 'periodos': periodos}
+    return HttpResponse(json.dumps(dados), mimetype='application/json')
+
 @cache_page(60 * 60)
 def json_pca(request, nome_curto_casa_legislativa):
     """Retorna o JSON com as coordenadas do gráfico PCA"""
@@ -22,7 +22,10 @@
 import os
 import codecs
 from modelagem import models
+from analises.models import Coalizao
+from analises.analise import CoalizaoBuilder
 from django.utils.dateparse import parse_datetime
+import bisect
 
 # Resultado da exportação deveria ser lido pelo R com
 # dados <- read.table("votes.Rdata", header=TRUE)
@@ -30,8 +33,8 @@ from django.utils.dateparse import parse_datetime
 
 MODULE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-COALITION_PARTIES = ['PT', 'PCdoB', 'PSB', 'PP', 'PMDB', 'PTB']
-# PR, PDT não são coalition?
+# periodicidade das coalizões (vide analises.analise.CoalizaoBuilder) usadas na exportação
+PERIODICIDADE_COALIZOES = models.MES
 
 ROLLCALL = 'rollcall' 
 ID = 'id'
@@ -65,6 +68,8 @@ class ExportadorR:
         self.ini = data_ini
         self.fim = data_fim
         self.votacoes = None
+        self.coalizoes = [] # lista de tuplas (inicio, fim, nomes dos partidos da coalizão)
+        self.inicios_coalizoes = []
         self.votes = []
 
     def exportar(self):
@@ -75,35 +80,54 @@ class ExportadorR:
     def retrieve_votacoes(self):
         casa = models.CasaLegislativa.objects.get(nome_curto=self.nome_curto)
         if self.ini == None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).order_by('data') 
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).order_by('data') 
         if self.ini == None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__lte=self.fim).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__lte=self.fim).order_by('data')
         if self.ini != None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__gte=self.ini).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__gte=self.ini).order_by('data')
         if self.ini != None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__gte=self.ini, data__lte=self.fim).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__gte=self.ini, data__lte=self.fim).order_by('data')
+        self.retrieve_coalizoes(casa)
+
+    def retrieve_coalizoes(self, casa):
+        self.coalizoes = Coalizao.por_periodo(casa, PERIODICIDADE_COALIZOES)
+        if not self.coalizoes:
+            CoalizaoBuilder(casa, PERIODICIDADE_COALIZOES).salva_coalizoes()
+            self.coalizoes = Coalizao.por_periodo(casa, PERIODICIDADE_COALIZOES)
+        self.inicios_coalizoes = [inicio for inicio, fim, partidos in self.coalizoes]
     
+    def _votos(self):
+        """Retorna (id_vot da votação, data da votação, id do voto, nome do parlamentar, 
+        nome do partido, opção) de todos os votos das votações, numa só consulta.
+        O partido é o copiado para o voto; em bancos em que a cópia ainda não foi
+        preenchida, é o da legislatura."""
+        votos = models.Voto.objects.filter(votacao__in=self.votacoes).order_by('votacao__data', 'votacao', 'id')
+        for id_vot, data, id_voto, nome, partido, partido_legislatura, opcao in votos.values_list(
+                'votacao__id_vot', 'votacao__data', 'id', 'legislatura__parlamentar__nome',
+                'partido__nome', 'legislatura__partido__nome', 'opcao'):
+            yield id_vot, data, id_voto, nome, partido or partido_legislatura, opcao
+
     def transform_data(self):
-        for votacao in self.votacoes:
-            votos = votacao.votos()
-            for voto in votos:
-                legislatura = voto.legislatura
-                parlamentar = legislatura.parlamentar
-                partido = legislatura.partido
-                v = RollCallVote()
-                v.rollcall = votacao.id_vot
-                v.id = voto.id
-                v.name = parlamentar.nome
-                v.party = partido.nome
-                v.coalition =  self.coalition(partido.nome)
-                try:
-                    v.vote = self.voto(voto.opcao)
-                    self.votes.append(v)
-                except:
-                    print 'Ignorando voto ', voto.opcao
+        for id_vot, data, id_voto, nome_parlamentar, nome_partido, opcao in self._votos():
+            v = RollCallVote()
+            v.rollcall = id_vot
+            v.id = id_voto
+            v.name = nome_parlamentar
+            v.party = nome_partido
+            v.coalition =  self.coalition(nome_partido, data)
+            try:
+                v.vote = self.voto(opcao)
+                self.votes.append(v)
+            except:
+                print 'Ignorando voto ', opcao
                 
-    def coalition(self, nome_partido):
-        return '1' if nome_partido in COALITION_PARTIES else '0'
+    def coalition(self, nome_partido, data):
+        i = bisect.bisect_right(self.inicios_coalizoes, data) - 1
+        if i >= 0:
+            inicio, fim, partidos = self.coalizoes[i]
+            if data <= fim and nome_partido in partidos:
+                return '1'
+        return '0'
                 
     def voto(self, opcao):
         if opcao == models.SIM:
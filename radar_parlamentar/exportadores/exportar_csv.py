@@ -23,12 +23,15 @@
 import os
 import csv
 from modelagem import models
+from analises.models import Coalizao
+from analises.analise import CoalizaoBuilder
 from django.utils.dateparse import parse_datetime
+import bisect
 
 MODULE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-COALITION_PARTIES = ['PT', 'PCdoB', 'PSB', 'PP', 'PMDB', 'PTB']
-# PR, PDT não são coalition?
+# periodicidade das coalizões (vide analises.analise.CoalizaoBuilder) usadas na exportação
+PERIODICIDADE_COALIZOES = models.MES
 
 ROLLCALL = 'rollcall' 
 ID = 'id'
@@ -48,6 +51,8 @@ class ExportadorCSV:
         self.ini = data_ini
         self.fim = data_fim
         self.votacoes = None
+        self.coalizoes = [] # lista de tuplas (inicio, fim, nomes dos partidos da coalizão)
+        self.inicios_coalizoes = []
         self.csv_rows = []
 
     def exportar_csv(self):
@@ -58,36 +63,55 @@ class ExportadorCSV:
     def retrieve_votacoes(self):
         casa = models.CasaLegislativa.objects.get(nome_curto=self.nome_curto)
         if self.ini == None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).order_by('data') 
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).order_by('data') 
         if self.ini == None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__lte=self.fim).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__lte=self.fim).order_by('data')
         if self.ini != None and self.fim == None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__gte=self.ini).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__gte=self.ini).order_by('data')
         if self.ini != None and self.fim != None:
-            self.votacoes = models.Votacao.objects.filter(proposicao__casa_legislativa=casa).filter(data__gte=self.ini, data__lte=self.fim).order_by('data')
+            self.votacoes = models.Votacao.objects.filter(casa_legislativa=casa).filter(data__gte=self.ini, data__lte=self.fim).order_by('data')
+        self.retrieve_coalizoes(casa)
+
+    def retrieve_coalizoes(self, casa):
+        self.coalizoes = Coalizao.por_periodo(casa, PERIODICIDADE_COALIZOES)
+        if not self.coalizoes:
+            CoalizaoBuilder(casa, PERIODICIDADE_COALIZOES).salva_coalizoes()
+            self.coalizoes = Coalizao.por_periodo(casa, PERIODICIDADE_COALIZOES)
+        self.inicios_coalizoes = [inicio for inicio, fim, partidos in self.coalizoes]
     
+    def _votos(self):
+        """Retorna (id_vot da votação, data da votação, id do voto, nome do parlamentar, 
+        nome do partido, opção) de todos os votos das votações, numa só consulta.
+        O partido é o copiado para o voto; em bancos em que a cópia ainda não foi
+        preenchida, é o da legislatura."""
+        votos = models.Voto.objects.filter(votacao__in=self.votacoes).order_by('votacao__data', 'votacao', 'id')
+        for id_vot, data, id_voto, nome, partido, partido_legislatura, opcao in votos.values_list(
+                'votacao__id_vot', 'votacao__data', 'id', 'legislatura__parlamentar__nome',
+                'partido__nome', 'legislatura__partido__nome', 'opcao'):
+            yield id_vot, data, id_voto, nome, partido or partido_legislatura, opcao
+
     def transform_data(self):
         self.csv_rows.append(LABELS)
-        for votacao in self.votacoes:
-            votos = votacao.votos()
-            for voto in votos:
-                legislatura = voto.legislatura
-                parlamentar = legislatura.parlamentar
-                partido = legislatura.partido
-                csv_row = []
-                csv_row.append(votacao.id_vot)
-                csv_row.append(voto.id)
-                csv_row.append(parlamentar.nome.encode('UTF-8'))
-                csv_row.append(partido.nome)
-                csv_row.append(self.coalition(partido.nome))
-                try:
-                    csv_row.append(self.voto(voto.opcao))
-                    self.csv_rows.append(csv_row)
-                except:
-                    print 'Ignorando voto ', voto.opcao
+        for id_vot, data, id_voto, nome_parlamentar, nome_partido, opcao in self._votos():
+            csv_row = []
+            csv_row.append(id_vot)
+            csv_row.append(id_voto)
+            csv_row.append(nome_parlamentar.encode('UTF-8'))
+            csv_row.append(nome_partido)
+            csv_row.append(self.coalition(nome_partido, data))
+            try:
+                csv_row.append(self.voto(opcao))
+                self.csv_rows.append(csv_row)
+            except:
+                print 'Ignorando voto ', opcao
                 
-    def coalition(self, nome_partido):
-        return '1' if nome_partido in COALITION_PARTIES else '0'
+    def coalition(self, nome_partido, data):
+        i = bisect.bisect_right(self.inicios_coalizoes, data) - 1
+        if i >= 0:
+            inicio, fim, partidos = self.coalizoes[i]
+            if data <= fim and nome_partido in partidos:
+                return '1'
+        return '0'
                 
     def voto(self, opcao):
         if opcao == models.SIM:
@@ -89,6 +89,7 @@ class importador_interno:
 				votacao.descricao = child_votacao.attrib.get("descricao")
 			   	votacao.data = child_votacao.attrib.get("data")
 				votacao.resultado = child_votacao.attrib.get("resultado")
+				votacao.resultado_normalizado = models.Votacao.normaliza_resultado(votacao.resultado)
 				votacao.save()
 				#self.verifica_votacao = True
 
@@ -148,6 +149,8 @@ class importador_interno:
 def main(nome_curto):
 	x = importador_interno()
 	x.carrega_xml(nome_curto)
+	casa_legislativa = models.CasaLegislativa.objects.get(nome_curto=nome_curto)
+	models.importacao_concluida.send(sender=importador_interno, casa_legislativa=casa_legislativa)
 
 
 
@@ -434,7 +434,7 @@ class ImportadorCamara:
         hora_str = votacao_xml.get('Hora').strip()
         date_time = self._converte_data(data_str, hora_str)
 
-        query = models.Votacao.objects.filter(descricao=descricao, data=date_time, proposicao__casa_legislativa=self.camara_dos_deputados)
+        query = models.Votacao.objects.filter(descricao=descricao, data=date_time, casa_legislativa=self.camara_dos_deputados)
         if query:
             votacao = query[0]
         else:
@@ -442,6 +442,8 @@ class ImportadorCamara:
             votacao = models.Votacao()
             votacao.descricao = descricao
             votacao.data = date_time
+            # a câmara não informa o resultado à parte; ele aparece no resumo da votação
+            votacao.resultado_normalizado = models.Votacao.normaliza_resultado(votacao_xml.get('Resumo'))
             votacao.proposicao = prop
             votacao.save()
             for voto_xml in votacao_xml.find('votos'):
@@ -500,6 +502,11 @@ class ImportadorCamara:
         votante = self._votante(voto_xml.get('Nome'), partido.nome)
 
         # TODO filtrar tb por inicio e fim
+        leg = self.legislaturas.da_filiacao(votante, partido)
+        if leg != None:
+            return leg
+
+        # pode ter sido criada por outra thread de importação
         legs = models.Legislatura.objects.filter(parlamentar=votante,partido=partido,casa_legislativa=self.camara_dos_deputados)
 
         if legs:
@@ -513,6 +520,7 @@ class ImportadorCamara:
             leg.inicio = INICIO_PERIODO # TODO refinar
             leg.fim = FIM_PERIODO # TODO refinar
             leg.save()
+        self.legislaturas.adiciona(leg)
 
         return leg
 
@@ -561,6 +569,7 @@ class ImportadorCamara:
     def importar(self):
 
         self.camara_dos_deputados = self._gera_casa_legislativa()
+        self.legislaturas = models.IndiceDeLegislaturas(self.camara_dos_deputados)
 
         f = lambda dic: ( dic['id'], dic['sigla'], dic['num'], dic['ano'] )
         for id_prop,sigla,num,ano in [ f(dic) for dic in self.votadas ]:
@@ -629,6 +638,8 @@ def main():
         threads.append(thread)
         thread.start()
     wait_threads(threads)
+    camara_dos_deputados = models.CasaLegislativa.objects.get(nome_curto='cdep')
+    models.importacao_concluida.send(sender=ImportadorCamara, casa_legislativa=camara_dos_deputados)
     logger.info('IMPORTACAO DE DADOS DA CAMARA DOS DEPUTADOS FINALIZADA')
     
     
@@ -85,7 +85,9 @@ class GeradorCasaLegislativa(object):
 class XmlCMSP:
     def __init__(self, cmsp, verbose=False):
         self.parlamentares = {}
+        self.partidos = {} # cache de partidos (chave é nome, e valor é objeto Partido)
         self.cmsp = cmsp
+        self.legislaturas = models.IndiceDeLegislaturas(cmsp)
         self.verbose = verbose
 
     def converte_data(self, data_str):
@@ -132,10 +134,13 @@ class XmlCMSP:
 
     def partido(self, ver_tree):
         nome_partido = ver_tree.get('Partido').strip()
+        if nome_partido in self.partidos:
+            return self.partidos[nome_partido]
         partido = models.Partido.from_nome(nome_partido)
         if partido == None:
             print 'Não achou o partido %s' % nome_partido
             partido = models.Partido.get_sem_partido()
+        self.partidos[nome_partido] = partido
         return partido
 
     def votante(self, ver_tree):
@@ -160,8 +165,13 @@ class XmlCMSP:
         partido = self.partido(ver_tree)
         votante = self.votante(ver_tree)
 
+        # TODO filtrar tb por inicio e fim
+        leg = self.legislaturas.da_filiacao(votante, partido)
+        if leg != None:
+            return leg
+
+        # legislaturas criadas depois da construção do índice
         legs = models.Legislatura.objects.filter(parlamentar=votante,partido=partido,casa_legislativa=self.cmsp)
-        # TODO acima filtrar tb por inicio e fim
         if legs:
             leg = legs[0]
         else:
@@ -172,6 +182,7 @@ class XmlCMSP:
             leg.inicio = INICIO_PERIODO # TODO este período deve ser mais refinado para suportar caras que trocaram de partido
             leg.fim = FIM_PERIODO
             leg.save()
+        self.legislaturas.adiciona(leg)
 
         return leg
 
@@ -219,6 +230,7 @@ class XmlCMSP:
                 vot.descricao = resumo
                 vot.data = self.converte_data(vot_tree.get('DataDaSessao'))
                 vot.resultado = vot_tree.get('Resultado')
+                vot.resultado_normalizado = models.Votacao.normaliza_resultado(vot.resultado)
                 self.votos_from_tree(vot_tree, vot)
                 vot.proposicao = prop
                 if self.verbose:
@@ -273,5 +285,6 @@ def main():
     importer = ImportadorCMSP(cmsp)
     for xml in [XML2010,XML2011,XML2012]:
         importer.importar_de(xml)
+    models.importacao_concluida.send(sender=ImportadorCMSP, casa_legislativa=cmsp)
     print 'Importação dos dados da Câmara Municipal de São Paulo (CMSP) terminada'
 
@@ -266,3 +266,4 @@ def main():
     print 'IMPORTANDO DADOS DA CONVENÇÃO NACIONAL FRANCESA'
     importer = ImportadorConvencao()
     importer.importar()
+    models.importacao_concluida.send(sender=ImportadorConvencao, casa_legislativa=importer.casa)
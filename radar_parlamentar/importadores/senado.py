@@ -104,6 +104,7 @@ class ImportadorVotacoesSenado:
     def __init__(self):
         self.senado = models.CasaLegislativa.objects.get(nome_curto=NOME_CURTO)
         self.proposicoes = {} # chave é o nome da proposição (sigla num/ano), valor é objeto Proposicao
+        self.legislaturas = models.IndiceDeLegislaturas(self.senado)
 
     def _converte_data(self, data_str):
         """Converte string "aaaa-mm-dd para objeto datetime; retona None se data_str é inválido"""
@@ -168,6 +169,7 @@ class ImportadorVotacoesSenado:
         leg.partido = self._find_partido(sigla_partido)
         leg.localidade = voto_parlamentar_tree.find('SiglaUF').text
         leg.save()
+        self.legislaturas.adiciona(leg)
         return leg
         
     def _votos_from_tree(self, votos_tree, votacao):
@@ -178,7 +180,7 @@ class ImportadorVotacoesSenado:
         for voto_parlamentar_tree in votos_tree:
             nome_senador = voto_parlamentar_tree.find('NomeParlamentar').text
             try:
-                legislatura = models.Legislatura.find(votacao.data, nome_senador)
+                legislatura = self.legislaturas.find(votacao.data, nome_senador)
             except ValueError:
                 logger.warn('Não encontramos legislatura do senador %s' % nome_senador)
                 logger.info('Criando legislatura para o senador %s' % nome_senador)
@@ -259,6 +261,7 @@ class ImportadorVotacoesSenado:
                         votacao.data = self._converte_data(votacao_tree.find('DataSessao').text)
                         if votacao_tree.find('Resultado') != None:
                             votacao.resultado = votacao_tree.find('Resultado').text
+                            votacao.resultado_normalizado = models.Votacao.normaliza_resultado(votacao.resultado)
                         votacao.proposicao = proposicao
                         votos_tree = votacao_tree.find('Votos')
                         if votos_tree != None:
@@ -384,12 +387,13 @@ def main():
 
     logger.info('IMPORTANDO DADOS DO SENADO')
     geradorCasaLeg = CasaLegislativaGerador()
-    geradorCasaLeg.gera_senado()
+    sen = geradorCasaLeg.gera_senado()
     logger.info('IMPORTANDO SENADORES')
     importer = ImportadorSenadores()
     importer.importar_senadores()
     logger.info('IMPORTANDO VOTAÇÕES DO SENADO')
     importer = ImportadorVotacoesSenado()
     importer.importar_votacoes()
+    models.importacao_concluida.send(sender=ImportadorVotacoesSenado, casa_legislativa=sen)
 
 
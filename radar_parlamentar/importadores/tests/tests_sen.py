@@ -22,6 +22,8 @@ from __future__ import unicode_literals
 from django.test import TestCase
 from importadores import senado
 from modelagem import models
+from datetime import date
+import xml.etree.ElementTree as etree
 import os
 
 
@@ -33,3 +35,39 @@ class SenadoWSTest(TestCase):
         tree = senws.obter_senadores_from_legislatura(id_leg)
         self.assertIsNotNone(tree)
         self.assertTrue(len(tree.findall('Metadados')) == 1)
+
+
+VOTOS_XML = """<Votos>
+    <VotoParlamentar>
+        <CodigoParlamentar>1</CodigoParlamentar><NomeParlamentar>Rui Barbosa</NomeParlamentar>
+        <SexoParlamentar>M</SexoParlamentar><SiglaPartido>PT</SiglaPartido><SiglaUF>BA</SiglaUF><Voto>Sim</Voto>
+    </VotoParlamentar>
+    <VotoParlamentar>
+        <CodigoParlamentar>2</CodigoParlamentar><NomeParlamentar>Joaquim Nabuco</NomeParlamentar>
+        <SexoParlamentar>M</SexoParlamentar><SiglaPartido>PSDB</SiglaPartido><SiglaUF>PE</SiglaUF><Voto>Não</Voto>
+    </VotoParlamentar>
+</Votos>"""
+
+class ImportadorVotacoesSenadoTest(TestCase):
+
+    def setUp(self):
+        senado.CasaLegislativaGerador().gera_senado()
+        self.importer = senado.ImportadorVotacoesSenado()
+
+    def _votacao(self, data):
+        votacao = models.Votacao(data=data)
+        votacao.save()
+        return votacao
+
+    def test_votos_from_tree(self):
+        votos_tree = etree.fromstring(VOTOS_XML.encode('utf8'))
+        votos = self.importer._votos_from_tree(votos_tree, self._votacao(date(2012, 5, 2)))
+        self.assertEquals([voto.opcao for voto in votos], [models.SIM, models.NAO])
+        self.assertEquals(models.Legislatura.objects.count(), 2)
+        # as legislaturas criadas na primeira votação são achadas no índice nas seguintes
+        votos = self.importer._votos_from_tree(votos_tree, self._votacao(date(2013, 6, 3)))
+        self.assertEquals(models.Legislatura.objects.count(), 2)
+        self.assertEquals(votos[1].legislatura.parlamentar.nome, 'Joaquim Nabuco')
+        self.assertEquals(votos[1].legislatura.localidade, 'PE')
+        votos = self.importer._votos_from_tree(votos_tree, self._votacao(date(2008, 6, 3)))
+        self.assertEquals(models.Legislatura.objects.count(), 4)
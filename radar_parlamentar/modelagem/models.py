@@ -19,11 +19,16 @@
 
 from __future__ import unicode_literals
 from django.db import models
+from django.dispatch import Signal, receiver
+from django.db.models.signals import pre_save
+from django.core.cache import cache
 from calendar import monthrange
+from bisect import bisect_left, bisect_right
 import re
 import logging
 import os
 import datetime
+import numpy
 
 logger = logging.getLogger("radar")
 MODULE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -76,6 +81,27 @@ PERIODOS = (
 
 SEM_PARTIDO = 'Sem partido'
 
+# resultado normalizado das votações (ver Votacao.normaliza_resultado)
+APROVADO = 1
+REJEITADO = -1
+SEM_RESULTADO = 0
+
+RESULTADOS = (
+    (APROVADO, 'Aprovado'),
+    (REJEITADO, 'Rejeitado'),
+    (SEM_RESULTADO, 'Sem resultado'),
+)
+
+# Tempo (em segundos) que os cubos de votos ficam no cache; são atualizados pelos importadores
+CACHE_TIMEOUT_CUBOS = 60*60*24*30
+# Tempo (em segundos) que as datas das votações e as listas de períodos de cada casa 
+# ficam no cache; são descartadas ao fim de cada importação
+CACHE_TIMEOUT_PERIODOS = 60*60*24*30
+
+# Enviado pelos importadores ao fim da importação de uma casa legislativa, para que
+# dados derivados das votações (caches, índices) sejam recalculados.
+importacao_concluida = Signal(providing_args=['casa_legislativa'])
+
 class Partido(models.Model):
     """Partido político.
 
@@ -183,23 +209,58 @@ class CasaLegislativa(models.Model):
 
         Retorna:
             Uma lista de objetos do tipo PeriodoCasaLegislativa.
+
+        A lista de todos os períodos de cada periodicidade fica no cache até a próxima
+        importação de votações da casa.
         """
-        votacao_datas = [votacao.data for votacao in Votacao.objects.filter(proposicao__casa_legislativa=self)]
-        data_inicial = min(votacao_datas)
-        data_final = max(votacao_datas)
-        return PeriodoCasaLegislativa.lista_de_periodos(self,data_inicial,data_final,periodicidade,numero_minimo_de_votacoes)
+        chave = 'periodos:%s:%s' % (self.nome_curto, periodicidade)
+        periodos = cache.get(chave)
+        if periodos == None:
+            datas = self.datas_das_votacoes() # os limites são a primeira e a última data
+            if not datas:
+                return []
+            periodos = PeriodoCasaLegislativa.lista_de_periodos(self,datas[0],datas[-1],periodicidade,
+                                                                 datas_votacoes=datas)
+            cache.set(chave, periodos, CACHE_TIMEOUT_PERIODOS)
+        return [periodo for periodo in periodos if periodo.quantidade_votacoes >= numero_minimo_de_votacoes]
+
+    def datas_das_votacoes(self):
+        """Retorna lista ordenada com as datas de todas as votações (com data) desta casa;
+        a lista fica no cache até a próxima importação de votações da casa."""
+        chave = 'datas_votacoes:%s' % self.nome_curto
+        datas = cache.get(chave)
+        if datas == None:
+            datas = list(Votacao.objects.filter(casa_legislativa=self, data__isnull=False)
+                                        .order_by('data').values_list('data', flat=True))
+            cache.set(chave, datas, CACHE_TIMEOUT_PERIODOS)
+        return datas
+
+    def limites_das_datas(self):
+        """Retorna tupla (data da primeira votação, data da última votação) desta casa,
+        ou (None, None) se a casa não tem votações; os limites ficam no cache até a
+        próxima importação de votações da casa."""
+        chave = 'limites_datas:%s' % self.nome_curto
+        limites = cache.get(chave)
+        if limites == None:
+            agregados = Votacao.objects.filter(casa_legislativa=self).aggregate(
+                                                ini=models.Min('data'), fim=models.Max('data'))
+            limites = (agregados['ini'], agregados['fim'])
+            cache.set(chave, limites, CACHE_TIMEOUT_PERIODOS)
+        return limites
+
+    def descarta_periodos_do_cache(self):
+        """Descarta do cache as datas das votações, seus limites e as listas de períodos desta casa"""
+        cache.delete('datas_votacoes:%s' % self.nome_curto)
+        cache.delete('limites_datas:%s' % self.nome_curto)
+        cache.delete_many(['periodos:%s:%s' % (self.nome_curto, periodicidade) for periodicidade, nome in PERIODOS])
 
     def num_votacao(self,data_inicial=None,data_final=None):
         """retorna a quantidade de votacao numa casa legislativa"""
         return Votacao.por_casa_legislativa(self,data_inicial,data_final).count()
 
     def num_votos(self,data_inicio=None,data_fim=None):
-        """retorna a quantidade de votos numa casa legislativa"""
-        votacoes = Votacao.por_casa_legislativa(self,data_inicio,data_fim)
-        votos = []
-        for votacao in votacoes:
-            votos+=votacao.votos()
-        return len(votos)
+        """retorna a quantidade de votos numa casa legislativa (vide CuboDeVotos)"""
+        return CuboDeVotos.da_casa(self).num_votos(data_inicio, data_fim)
 
     @staticmethod
     def deleta_casa(nome_casa_curto):
@@ -257,7 +318,7 @@ class PeriodoCasaLegislativa(object):
         return self.string
 
     @staticmethod
-    def lista_de_periodos(casa_legislativa,inicio,fim,periodicidade,numero_minimo_de_votacoes=0):
+    def lista_de_periodos(casa_legislativa,inicio,fim,periodicidade,numero_minimo_de_votacoes=0,datas_votacoes=None):
         """ Retorna uma lista de objetos da classe PeriodoCasaLegislativa.
 
         Argumentos:        
@@ -266,6 +327,9 @@ class PeriodoCasaLegislativa(object):
           inicio, fim: objetos datetime.
           periodicidade: uma constante em PERIODOS (ex. ANO, SEMESTRE).
           numero_minimo_de_votacoes: periodos com menos votações são excluídos da lista.
+          datas_votacoes: lista ordenada com as datas das votações da casa; se não for 
+              fornecida, é usada casa_legislativa.datas_das_votacoes(). As votações de cada
+              período são contadas nesta lista (busca binária), sem consultas ao banco.
         Detalhes:
           Se a data de início for por exemplo 15/08/1999 e a periodicidade for quadrianual,
           bianual, anual, ou semestral, o primeiro período irá começar em 01/01/1999. Se
@@ -277,6 +341,8 @@ class PeriodoCasaLegislativa(object):
         data_inicial = PeriodoCasaLegislativa._inicio(inicio,periodicidade)
         data_fim = PeriodoCasaLegislativa._fim(fim,periodicidade)
         valor_delta = PeriodoCasaLegislativa.delta_para_numero(periodicidade)
+        if datas_votacoes == None:
+            datas_votacoes = casa_legislativa.datas_das_votacoes()
         periodos_candidatos = []
         dias_que_faltam = 1
         while dias_que_faltam > 0:
@@ -290,7 +356,8 @@ class PeriodoCasaLegislativa(object):
             # ir ate ultimo dia do mes:
             dia_final = monthrange(data_final.year,data_final.month)[1]
             data_final = data_final.replace(day=dia_final)
-            periodos_candidatos.append(PeriodoCasaLegislativa(data_inicial,data_final,casa_legislativa.num_votacao(data_inicial,data_final)))
+            quantidade = bisect_right(datas_votacoes, data_final) - bisect_left(datas_votacoes, data_inicial)
+            periodos_candidatos.append(PeriodoCasaLegislativa(data_inicial,data_final,quantidade))
             data_inicial = data_final + datetime.timedelta(days=1)
             delta_que_falta = data_fim - data_final
             dias_que_faltam = delta_que_falta.days
@@ -344,8 +411,8 @@ class Parlamentar(models.Model):
         nome, genero -- strings
     """
 
-    id_parlamentar = models.CharField(max_length=100, blank=True) # obs: não é chave primária!
-    nome = models.CharField(max_length=100)
+    id_parlamentar = models.CharField(max_length=100, blank=True, db_index=True) # obs: não é chave primária!
+    nome = models.CharField(max_length=100, db_index=True)
     genero = models.CharField(max_length=10, choices=GENEROS, blank=True)
 
     def __unicode__(self):
@@ -395,6 +462,107 @@ class Legislatura(models.Model):
         return "%s - %s@%s [%s, %s]" % (self.parlamentar, self.partido, self.casa_legislativa.nome_curto, self.inicio, self.fim)
 
 
+class IndiceDeLegislaturas(object):
+    """Índice em memória das legislaturas de uma casa legislativa, para os importadores
+    acharem a legislatura de um parlamentar em uma data sem consultar o banco a cada voto.
+
+    Para cada nome de parlamentar e para cada id_parlamentar o índice guarda as legislaturas
+    ordenadas pela data de início, junto com o máximo acumulado das datas de fim;
+    a busca é uma busca binária nas datas de início seguida de um recuo que para
+    assim que nenhuma legislatura anterior pode conter a data.
+    Legislaturas sem início ou sem fim não entram no índice.
+
+    O índice também guarda, para cada par (parlamentar, partido), a legislatura de menor id,
+    para os importadores que identificam a legislatura pela filiação e não pela data
+    (estas entram no índice mesmo sem início ou fim).
+
+    O índice é construído uma vez por importação (uma consulta ao banco);
+    as legislaturas criadas durante a importação devem ser acrescentadas com adiciona.
+
+    Métodos:
+        find -- busca legislatura por data e nome ou id do parlamentar (como Legislatura.find)
+        da_filiacao -- busca legislatura pelo parlamentar e pelo partido
+        adiciona -- acrescenta uma legislatura ao índice
+    """
+
+    def __init__(self, casa_legislativa):
+        self.casa_legislativa = casa_legislativa
+        self.por_nome = {} # nome do parlamentar => _IntervalosDeLegislaturas
+        self.por_id_parlamentar = {} # id_parlamentar => _IntervalosDeLegislaturas
+        self.por_filiacao = {} # (id do Parlamentar, id do Partido) => legislatura de menor id
+        for leg in Legislatura.objects.filter(casa_legislativa=casa_legislativa).select_related(
+                                            'parlamentar', 'partido').order_by('inicio'):
+            self.adiciona(leg)
+
+    def adiciona(self, legislatura):
+        filiacao = (legislatura.parlamentar_id, legislatura.partido_id)
+        primeira = self.por_filiacao.get(filiacao)
+        if primeira == None or (legislatura.id != None and legislatura.id < primeira.id):
+            self.por_filiacao[filiacao] = legislatura
+        if legislatura.inicio == None or legislatura.fim == None:
+            return
+        parlamentar = legislatura.parlamentar
+        self.por_nome.setdefault(parlamentar.nome, _IntervalosDeLegislaturas()).adiciona(legislatura)
+        if parlamentar.id_parlamentar:
+            self.por_id_parlamentar.setdefault(parlamentar.id_parlamentar, _IntervalosDeLegislaturas()).adiciona(legislatura)
+
+    def find(self, data, nome_parlamentar=None, id_parlamentar=None):
+        """Busca a legislatura de um parlamentar em uma determinada data
+           Argumentos:
+             data -- objeto do tipo date (ou datetime)
+             nome_parlamentar -- string
+             id_parlamentar -- string; se fornecido, a busca é pelo id e não pelo nome
+           Retorno: objeto do tipo Legislatura
+           Se não existir, lança exceção ValueError
+        """
+        if isinstance(data, datetime.datetime):
+            data = data.date()
+        if id_parlamentar:
+            intervalos = self.por_id_parlamentar.get(id_parlamentar)
+        else:
+            intervalos = self.por_nome.get(nome_parlamentar)
+        leg = intervalos.busca(data) if intervalos else None
+        if leg == None:
+            raise ValueError('Não achei legislatura para %s em %s' % (id_parlamentar or nome_parlamentar, data))
+        return leg
+
+    def da_filiacao(self, parlamentar, partido):
+        """Retorna a legislatura (a de menor id) do parlamentar pelo partido na casa, 
+        ou None se não houver"""
+        return self.por_filiacao.get((parlamentar.id, partido.id))
+
+
+class _IntervalosDeLegislaturas(object):
+    """Legislaturas de um parlamentar ordenadas por início;
+    maximos[i] é a maior data de fim entre as legislaturas 0..i"""
+
+    def __init__(self):
+        self.inicios = []
+        self.fins = []
+        self.maximos = []
+        self.legislaturas = []
+
+    def adiciona(self, legislatura):
+        i = bisect_right(self.inicios, legislatura.inicio)
+        self.inicios.insert(i, legislatura.inicio)
+        self.fins.insert(i, legislatura.fim)
+        self.legislaturas.insert(i, legislatura)
+        maximo = self.maximos[i-1] if i > 0 else None
+        self.maximos[i:] = []
+        for fim in self.fins[i:]:
+            maximo = fim if maximo == None or fim > maximo else maximo
+            self.maximos.append(maximo)
+
+    def busca(self, data):
+        """Retorna a legislatura de início mais recente que contém a data, ou None"""
+        i = bisect_right(self.inicios, data) - 1
+        while i >= 0 and self.maximos[i] >= data:
+            if self.fins[i] >= data:
+                return self.legislaturas[i]
+            i -= 1
+        return None
+
+
 class Proposicao(models.Model):
     """Proposição parlamentar (proposta de lei).
 
@@ -413,7 +581,7 @@ class Proposicao(models.Model):
         nome: retorna "sigla numero/ano"
     """
 
-    id_prop = models.CharField(max_length=100, blank=True) # obs: não é chave primária!
+    id_prop = models.CharField(max_length=100, blank=True, db_index=True) # obs: não é chave primária!
     sigla = models.CharField(max_length=10)
     numero = models.CharField(max_length=10)
     ano = models.CharField(max_length=4)
@@ -438,19 +606,24 @@ class Votacao(models.Model):
     Atributos:
         id_vot - string identificadora de acordo a fonte de dados
         descricao, resultado -- strings
+        resultado_normalizado -- APROVADO, REJEITADO ou SEM_RESULTADO (ver normaliza_resultado)
         data -- data da votação (tipo date)
         proposicao -- objeto do tipo Proposicao
+        casa_legislativa -- objeto do tipo CasaLegislativa; cópia de proposicao.casa_legislativa,
+                            preenchida ao salvar, para consultas sem junções
 
     Métodos:
         votos()
         por_partido()
     """
 
-    id_vot = models.CharField(max_length=100, blank=True) # obs: não é chave primária!
+    id_vot = models.CharField(max_length=100, blank=True, db_index=True) # obs: não é chave primária!
     descricao = models.TextField(blank=True)
-    data = models.DateField(blank=True, null=True)
+    data = models.DateField(blank=True, null=True, db_index=True)
     resultado = models.TextField(blank=True)
+    resultado_normalizado = models.SmallIntegerField(choices=RESULTADOS, default=SEM_RESULTADO)
     proposicao = models.ForeignKey(Proposicao, null=True)
+    casa_legislativa = models.ForeignKey(CasaLegislativa, null=True)
 
     def votos(self):
         """Retorna os votos da votação (depende do banco de dados)"""
@@ -462,18 +635,62 @@ class Votacao(models.Model):
         Retorno: um dicionário cuja chave é o nome do partido (string) e o valor é um VotoPartido
         """
         dic = {}
-        for voto in self.votos():
+        for voto in self.votos().select_related('partido', 'legislatura__partido'):
             # TODO poderia ser mais complexo: checar se a data da votação bate com o período da legislatura mais recente
-            part = voto.legislatura.partido.nome
+            # votos de bancos que ainda não passaram por scripts/desnormaliza_votacoes_e_votos.sql não têm partido
+            partido = voto.partido if voto.partido_id != None else voto.legislatura.partido
+            part = partido.nome
             if not dic.has_key(part):
                 dic[part] = VotoPartido(part)
             voto_partido = dic[part]
             voto_partido.add(voto.opcao)
         return dic
 
+    @staticmethod
+    def normaliza_resultado(texto):
+        """Converte o texto livre do resultado de uma votação (ex: 'Aprovado', 'REJEITADO',
+        'A' e 'R' do Senado) em APROVADO, REJEITADO ou SEM_RESULTADO. Se o texto cita
+        aprovação e rejeição, vale a que aparece primeiro."""
+        if not texto:
+            return SEM_RESULTADO
+        texto = texto.strip().lower()
+        if texto == 'a':
+            return APROVADO
+        if texto == 'r':
+            return REJEITADO
+        posicoes = [(texto.find(palavra), resultado) for palavra, resultado in 
+                    [('aprovad', APROVADO), ('rejeitad', REJEITADO), ('reprovad', REJEITADO)]]
+        posicoes = [(posicao, resultado) for posicao, resultado in posicoes if posicao >= 0]
+        if not posicoes:
+            return SEM_RESULTADO
+        return min(posicoes)[1]
+
+    @staticmethod
+    def preenche_resultados_normalizados(casa_legislativa=None, tamanho_lote=500):
+        """Preenche resultado_normalizado das votações gravadas sem ele (SEM_RESULTADO),
+        como as importadas antes da existência do campo, a partir do texto guardado:
+        o campo resultado (senado, cmsp) ou, se vazio, o trecho 'Resumo: [...]' da
+        descrição (câmara). Se casa_legislativa for None, trata todas as casas.
+        Retorna a quantidade de votações que passaram a ter resultado."""
+        votacoes = Votacao.objects.filter(resultado_normalizado=SEM_RESULTADO)
+        if casa_legislativa != None:
+            votacoes = votacoes.filter(casa_legislativa=casa_legislativa)
+        ids_por_resultado = {APROVADO: [], REJEITADO: []}
+        for id_votacao, resultado, descricao in votacoes.values_list('id', 'resultado', 'descricao'):
+            if not resultado and descricao:
+                resumo = re.match(r'Resumo: \[(.*)\]\. ObjVotacao: \[', descricao, re.DOTALL)
+                resultado = resumo.group(1) if resumo else None
+            normalizado = Votacao.normaliza_resultado(resultado)
+            if normalizado != SEM_RESULTADO:
+                ids_por_resultado[normalizado].append(id_votacao)
+        for normalizado, ids in ids_por_resultado.items():
+            for i in range(0, len(ids), tamanho_lote): # limite de parâmetros do SQLite
+                Votacao.objects.filter(id__in=ids[i:i+tamanho_lote]).update(resultado_normalizado=normalizado)
+        return sum(len(ids) for ids in ids_por_resultado.values())
+
     @staticmethod
     def por_casa_legislativa(casa_legislativa,data_inicial=None,data_final=None):
-        votacoes = Votacao.objects.filter(proposicao__casa_legislativa=casa_legislativa)
+        votacoes = Votacao.objects.filter(casa_legislativa=casa_legislativa)
         from django.utils.dateparse import parse_datetime
         if data_inicial != None:
             ini = parse_datetime('%s 0:0:0' % data_inicial)
@@ -498,15 +715,32 @@ class Voto(models.Model):
     Atributos:
         legislatura -- objeto do tipo Legislatura
         opcao -- qual foi o voto do parlamentar (sim, não, abstenção, obstrução, não votou)
+        partido, casa_legislativa -- cópias de legislatura.partido e legislatura.casa_legislativa,
+                                     preenchidas ao salvar, para consultas sem junções
     """
 
     votacao = models.ForeignKey(Votacao)
     legislatura = models.ForeignKey(Legislatura)
     opcao = models.CharField(max_length=10, choices=OPCOES)
+    partido = models.ForeignKey(Partido, null=True)
+    casa_legislativa = models.ForeignKey(CasaLegislativa, null=True)
 
     def __unicode__(self):
         return "%s votou %s" % (self.legislatura, self.opcao)
 
+@receiver(pre_save, sender=Votacao)
+def preenche_casa_da_votacao(sender, instance, **kwargs):
+    """Copia a casa legislativa da proposição para a votação"""
+    if instance.casa_legislativa_id == None and instance.proposicao_id != None:
+        instance.casa_legislativa_id = instance.proposicao.casa_legislativa_id
+
+@receiver(pre_save, sender=Voto)
+def preenche_partido_e_casa_do_voto(sender, instance, **kwargs):
+    """Copia o partido e a casa legislativa da legislatura para o voto"""
+    if instance.partido_id == None or instance.casa_legislativa_id == None:
+        instance.partido_id = instance.legislatura.partido_id
+        instance.casa_legislativa_id = instance.legislatura.casa_legislativa_id
+
 class VotosAgregados:
     """Um conjunto de votos.
 
@@ -575,6 +809,230 @@ class VotoPartido(VotosAgregados):
 # TODO class VotoUF(VotosAgregados):
 
 
+class EstatisticasCasaLegislativa(models.Model):
+    """Estatísticas de uma casa legislativa, recalculadas ao fim de cada importação
+    (ver atualiza_caches_da_casa) para não serem contadas a cada requisição.
+
+    Atributos:
+        casa_legislativa -- objeto do tipo CasaLegislativa
+        num_votacoes, num_votos -- quantidades de votações e de votos da casa
+        num_parlamentares -- quantidade de parlamentares com legislaturas na casa
+        data_inicial, data_final -- datas da primeira e da última votação
+        partidos -- partidos com legislaturas na casa
+        atualizacao -- data e hora em que as estatísticas foram calculadas
+    """
+
+    casa_legislativa = models.OneToOneField(CasaLegislativa, related_name='estatisticas')
+    num_votacoes = models.IntegerField(default=0)
+    num_votos = models.IntegerField(default=0)
+    num_parlamentares = models.IntegerField(default=0)
+    data_inicial = models.DateField(blank=True, null=True)
+    data_final = models.DateField(blank=True, null=True)
+    partidos = models.ManyToManyField(Partido, related_name='+')
+    atualizacao = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def atualiza(casa_legislativa):
+        """Calcula (com consultas COUNT e agregadas) e salva as estatísticas da casa"""
+        try:
+            estatisticas = EstatisticasCasaLegislativa.objects.get(casa_legislativa=casa_legislativa)
+        except EstatisticasCasaLegislativa.DoesNotExist:
+            estatisticas = EstatisticasCasaLegislativa(casa_legislativa=casa_legislativa)
+        votacoes = Votacao.objects.filter(casa_legislativa=casa_legislativa)
+        agregados = votacoes.aggregate(num=models.Count('id'), ini=models.Min('data'), fim=models.Max('data'))
+        estatisticas.num_votacoes = agregados['num']
+        estatisticas.data_inicial = agregados['ini']
+        estatisticas.data_final = agregados['fim']
+        estatisticas.num_votos = Voto.objects.filter(casa_legislativa=casa_legislativa).count()
+        estatisticas.num_parlamentares = Legislatura.objects.filter(casa_legislativa=casa_legislativa
+                                                                    ).values('parlamentar').distinct().count()
+        estatisticas.save()
+        estatisticas.partidos = casa_legislativa.partidos()
+        return estatisticas
+
+    @staticmethod
+    def da_casa(casa_legislativa):
+        """Retorna as estatísticas salvas da casa, calculando-as se ainda não existem"""
+        try:
+            return EstatisticasCasaLegislativa.objects.get(casa_legislativa=casa_legislativa)
+        except EstatisticasCasaLegislativa.DoesNotExist:
+            return EstatisticasCasaLegislativa.atualiza(casa_legislativa)
+
+    def __unicode__(self):
+        return 'Estatísticas de %s' % self.casa_legislativa
+
+
+class CuboDeVotos(object):
+    """Somas acumuladas, ao longo das datas das votações de uma casa legislativa, 
+    da quantidade de votos em cada opção por partido e por UF, e da quantidade de votações.
+
+    A contagem em qualquer intervalo de datas sai de duas buscas binárias no vetor 
+    de datas e de uma subtração entre linhas das somas acumuladas, sem consultas ao banco.
+    O cubo é atualizado incrementalmente: só as votações com id maior que o último já
+    contado são lidas do banco (se votações contadas foram removidas, o cubo é refeito).
+    Como votos novos de votações já contadas passariam despercebidos, o cubo é refeito
+    ao fim de cada importação (ver atualiza_caches_da_casa).
+    Votações sem data não entram no cubo.
+
+    Atributos:
+        datas -- vetor ordenado com os ordinais (date.toordinal) das datas que tiveram votações
+        partidos, ufs -- listas com os nomes dos partidos e as UFs (Legislatura.localidade)
+        acumulado_partidos -- array (datas+1) x partidos x opções; a linha i tem a soma
+                              dos votos de todas as datas anteriores a datas[i]
+        acumulado_ufs -- idem, por UF
+        acumulado_votacoes -- vetor (datas+1) com a soma acumulada das votações
+        ultimo_id_votacao -- maior id de votação já contado
+        num_votacoes -- quantidade de votações contadas
+    """
+
+    INDICES_OPCOES = dict((opcao, i) for i, (opcao, nome) in enumerate(OPCOES))
+
+    def __init__(self, casa_legislativa):
+        self.id_casa_legislativa = casa_legislativa.id
+        self.datas = numpy.zeros(0, dtype=int)
+        self.partidos = []
+        self.ufs = []
+        self.votos_partidos = numpy.zeros((0, 0, len(OPCOES)), dtype=int)
+        self.votos_ufs = numpy.zeros((0, 0, len(OPCOES)), dtype=int)
+        self.votacoes_por_data = numpy.zeros(0, dtype=int)
+        self.ultimo_id_votacao = 0
+        self.num_votacoes = 0
+        self._acumula()
+
+    @staticmethod
+    def chave_cache(casa_legislativa):
+        return 'cubo_de_votos:%s' % casa_legislativa.nome_curto
+
+    @staticmethod
+    def da_casa(casa_legislativa):
+        """Retorna o cubo da casa legislativa guardado no cache, atualizado 
+        (se houver votações novas) ou construído se ainda não estava no cache."""
+        cubo = cache.get(CuboDeVotos.chave_cache(casa_legislativa))
+        novo = cubo == None
+        if novo:
+            cubo = CuboDeVotos(casa_legislativa)
+        if cubo.atualiza() or novo:
+            cache.set(CuboDeVotos.chave_cache(casa_legislativa), cubo, CACHE_TIMEOUT_CUBOS)
+        return cubo
+
+    def _votacoes(self):
+        return Votacao.objects.filter(casa_legislativa__id=self.id_casa_legislativa, 
+                                      data__isnull=False)
+
+    def atualiza(self):
+        """Conta as votações novas da casa; retorna True se o cubo mudou"""
+        resumo = self._votacoes().aggregate(num=models.Count('id'), ultimo=models.Max('id'))
+        if resumo['num'] == self.num_votacoes and (resumo['ultimo'] or 0) == self.ultimo_id_votacao:
+            return False
+        novas = list(self._votacoes().filter(id__gt=self.ultimo_id_votacao).values_list('id', 'data'))
+        if self.num_votacoes + len(novas) != resumo['num']: # votações contadas foram removidas
+            self.__init__(CasaLegislativa(id=self.id_casa_legislativa))
+            novas = list(self._votacoes().values_list('id', 'data'))
+        if not novas:
+            return True
+        votos = list(Voto.objects.filter(casa_legislativa__id=self.id_casa_legislativa,
+                                    votacao__data__isnull=False, votacao__id__gt=self.ultimo_id_votacao
+                                    ).values_list('votacao__data', 'partido__nome', 
+                                                  'legislatura__localidade', 'opcao'))
+        datas_votos, nomes_partidos, ufs, opcoes = zip(*votos) if votos else ([], [], [], [])
+        datas_novas = numpy.array([data.toordinal() for id_votacao, data in novas], dtype=int)
+        datas = numpy.union1d(self.datas, datas_novas)
+        # realoca as contagens já feitas nas novas posições de datas, partidos e UFs
+        linhas = numpy.searchsorted(datas, self.datas)
+        self.votos_partidos = self._realoca(self.votos_partidos, linhas, len(datas), self.partidos, nomes_partidos)
+        self.votos_ufs = self._realoca(self.votos_ufs, linhas, len(datas), self.ufs, ufs)
+        votacoes_por_data = numpy.zeros(len(datas), dtype=int)
+        votacoes_por_data[linhas] = self.votacoes_por_data
+        self.votacoes_por_data = votacoes_por_data + numpy.bincount(numpy.searchsorted(datas, datas_novas), 
+                                                                    minlength=len(datas))
+        self.datas = datas
+        if votos:
+            linhas_votos = numpy.searchsorted(datas, [data.toordinal() for data in datas_votos])
+            indices_opcoes = numpy.array([self.INDICES_OPCOES[opcao] for opcao in opcoes], dtype=int)
+            self._conta(self.votos_partidos, linhas_votos, self.partidos, nomes_partidos, indices_opcoes)
+            self._conta(self.votos_ufs, linhas_votos, self.ufs, ufs, indices_opcoes)
+        self.ultimo_id_votacao = max(id_votacao for id_votacao, data in novas)
+        self.num_votacoes += len(novas)
+        self._acumula()
+        return True
+
+    @staticmethod
+    def _realoca(contagens, linhas, num_datas, nomes, nomes_novos):
+        """Acrescenta a nomes os nomes novos e devolve as contagens em um array do novo tamanho"""
+        for nome in sorted(set(nomes_novos) - set(nomes)):
+            nomes.append(nome)
+        realocado = numpy.zeros((num_datas, len(nomes), len(OPCOES)), dtype=int)
+        realocado[linhas, :contagens.shape[1]] = contagens
+        return realocado
+
+    @staticmethod
+    def _conta(contagens, linhas, nomes, nomes_votos, indices_opcoes):
+        indices = dict((nome, i) for i, nome in enumerate(nomes))
+        colunas = numpy.array([indices[nome] for nome in nomes_votos], dtype=int)
+        planos = (linhas * contagens.shape[1] + colunas) * contagens.shape[2] + indices_opcoes
+        contagens += numpy.bincount(planos, minlength=contagens.size).reshape(contagens.shape)
+
+    def _acumula(self):
+        def acumula(contagens):
+            acumulado = numpy.zeros((contagens.shape[0] + 1,) + contagens.shape[1:], dtype=int)
+            acumulado[1:] = numpy.cumsum(contagens, axis=0)
+            return acumulado
+        self.acumulado_partidos = acumula(self.votos_partidos)
+        self.acumulado_ufs = acumula(self.votos_ufs)
+        self.acumulado_votacoes = acumula(self.votacoes_por_data)
+
+    def _linhas(self, ini, fim):
+        """Linhas das somas acumuladas que delimitam o intervalo [ini, fim] (datas ou None)"""
+        a = 0 if ini == None else numpy.searchsorted(self.datas, ini.toordinal(), side='left')
+        b = len(self.datas) if fim == None else numpy.searchsorted(self.datas, fim.toordinal(), side='right')
+        return a, max(a, b)
+
+    def contagens_partidos(self, ini=None, fim=None):
+        """Retorna array partidos x opções (na ordem de OPCOES) com os votos no intervalo"""
+        a, b = self._linhas(ini, fim)
+        return self.acumulado_partidos[b] - self.acumulado_partidos[a]
+
+    def contagens_ufs(self, ini=None, fim=None):
+        """Retorna array UFs x opções (na ordem de OPCOES) com os votos no intervalo"""
+        a, b = self._linhas(ini, fim)
+        return self.acumulado_ufs[b] - self.acumulado_ufs[a]
+
+    def num_votacoes_entre(self, ini=None, fim=None):
+        a, b = self._linhas(ini, fim)
+        return int(self.acumulado_votacoes[b] - self.acumulado_votacoes[a])
+
+    def num_votos(self, ini=None, fim=None):
+        return int(self.contagens_partidos(ini, fim).sum())
+
+    def tamanhos_partidos(self, ini=None, fim=None):
+        """Dicionário nome do partido => quantidade média de votos do partido por votação no intervalo"""
+        num_votacoes = max(self.num_votacoes_entre(ini, fim), 1)
+        totais = self.contagens_partidos(ini, fim).sum(axis=1)
+        return dict((nome, float(total) / num_votacoes) for nome, total in zip(self.partidos, totais))
+
+    def presencas_partidos(self, ini=None, fim=None):
+        """Dicionário nome do partido => fração dos votos do partido no intervalo que não são AUSENTE;
+        partidos sem votos no intervalo ficam de fora"""
+        contagens = self.contagens_partidos(ini, fim)
+        totais = contagens.sum(axis=1)
+        presentes = totais - contagens[:, self.INDICES_OPCOES[AUSENTE]]
+        return dict((nome, float(p) / t) for nome, p, t in zip(self.partidos, presentes, totais) if t > 0)
+
+
+@receiver(importacao_concluida)
+def atualiza_caches_da_casa(sender, casa_legislativa, **kwargs):
+    """Ao fim de uma importação, preenche os resultados normalizados que faltam 
+    (votações antigas reaproveitadas pelos importadores), refaz o cubo de votos da casa
+    (a importação pode ter acrescentado votos a votações já contadas), descarta as listas de períodos da casa guardadas no cache, 
+    recalcula os limites das datas das votações e as estatísticas da casa"""
+    Votacao.preenche_resultados_normalizados(casa_legislativa)
+    cache.delete(CuboDeVotos.chave_cache(casa_legislativa))
+    CuboDeVotos.da_casa(casa_legislativa)
+    casa_legislativa.descarta_periodos_do_cache()
+    casa_legislativa.limites_das_datas()
+    EstatisticasCasaLegislativa.atualiza(casa_legislativa)
+
+
 class Temas():
 
     dicionario = {}   
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# coding=utf8
+
+# Copyright (C) 2013, Leonardo Leite
+#
+# This file is part of Radar Parlamentar.
+#
+# Radar Parlamentar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Radar Parlamentar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Radar Parlamentar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""módulo planos (planos de execução das consultas mais frequentes)
+
+Usa o EXPLAIN do banco de dados (EXPLAIN QUERY PLAN no SQLite, EXPLAIN no MySQL)
+para verificar se as consultas feitas pelos importadores e pelas análises usam os índices
+da modelagem. Uso no shell do Django:
+    from modelagem import planos
+    planos.main()
+
+Funções:
+    plano_de_execucao -- linhas do plano de execução de um queryset
+    varreduras_completas -- linhas do plano que leem uma tabela inteira
+    consultas_frequentes -- querysets dos caminhos de acesso mais usados para uma casa legislativa
+    varreduras_das_consultas_frequentes -- varreduras completas das consultas frequentes
+"""
+
+from __future__ import unicode_literals
+from django.db import connections
+from modelagem import models
+
+
+def plano_de_execucao(queryset):
+    """Retorna o plano de execução do queryset como uma lista de strings (uma por tabela acessada).
+
+    No SQLite cada linha é o campo 'detail' do EXPLAIN QUERY PLAN
+    (ex: 'SEARCH TABLE modelagem_voto USING INDEX ...').
+    No MySQL cada linha tem o formato 'tabela: type=... key=... rows=...'.
+    """
+    conexao = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    cursor = conexao.cursor()
+    if conexao.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+        return [linha[-1] for linha in cursor.fetchall()]
+    elif conexao.vendor == 'mysql':
+        cursor.execute('EXPLAIN %s' % sql, params)
+        colunas = [coluna[0] for coluna in cursor.description]
+        linhas = [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+        return ['%(table)s: type=%(type)s key=%(key)s rows=%(rows)s' % linha for linha in linhas]
+    else:
+        raise ValueError('Plano de execução não suportado para o banco %s' % conexao.vendor)
+
+def _varredura_completa(linha):
+    if ': type=' in linha: # MySQL
+        return ': type=ALL ' in linha
+    # SQLite: 'SCAN TABLE x' (ou 'SCAN x' nas versões novas) sem índice; 'SCAN TABLE x USING INDEX y' percorre só o índice
+    return linha.startswith('SCAN ') and ' USING ' not in linha
+
+def varreduras_completas(queryset):
+    """Retorna as linhas do plano de execução do queryset que leem uma tabela inteira, sem índice"""
+    return [linha for linha in plano_de_execucao(queryset) if _varredura_completa(linha)]
+
+def consultas_frequentes(casa_legislativa):
+    """Retorna lista de pares (descrição, queryset) com as consultas mais frequentes
+    dos importadores e das análises sobre a casa legislativa.
+
+    Os valores dos filtros são tirados de uma votação e de um voto da casa,
+    que precisa ter ao menos um voto.
+    """
+    voto = models.Voto.objects.filter(casa_legislativa=casa_legislativa).select_related(
+        'votacao', 'votacao__proposicao', 'legislatura', 'legislatura__parlamentar')[0]
+    votacao = voto.votacao
+    parlamentar = voto.legislatura.parlamentar
+    id_prop = votacao.proposicao.id_prop if votacao.proposicao else ''
+    ini, fim = casa_legislativa.limites_das_datas()
+    return [
+        ('votações do período', models.Votacao.objects.filter(
+            casa_legislativa=casa_legislativa, data__gte=ini, data__lte=fim)),
+        ('datas das votações', models.Votacao.objects.filter(
+            casa_legislativa=casa_legislativa, data__isnull=False).values_list('data', flat=True)),
+        ('votos da casa', models.Voto.objects.filter(
+            casa_legislativa=casa_legislativa).values_list('votacao', 'partido', 'opcao')),
+        ('votos da votação', models.Voto.objects.filter(votacao=votacao)),
+        ('voto da legislatura na votação', models.Voto.objects.filter(
+            votacao=votacao, legislatura=voto.legislatura)),
+        ('legislaturas do parlamentar', models.Legislatura.objects.filter(parlamentar__nome=parlamentar.nome)),
+        ('parlamentar por nome e id', models.Parlamentar.objects.filter(
+            nome=parlamentar.nome, id_parlamentar=parlamentar.id_parlamentar)),
+        ('proposição por id', models.Proposicao.objects.filter(
+            id_prop=id_prop, casa_legislativa=casa_legislativa)),
+        ('votação por id', models.Votacao.objects.filter(id_vot=votacao.id_vot)),
+    ]
+
+def varreduras_das_consultas_frequentes(casa_legislativa):
+    """Retorna dicionário descrição da consulta => varreduras completas do seu plano
+    de execução, só com as consultas frequentes que têm alguma varredura completa"""
+    varreduras = {}
+    for descricao, queryset in consultas_frequentes(casa_legislativa):
+        linhas = varreduras_completas(queryset)
+        if linhas:
+            varreduras[descricao] = linhas
+    return varreduras
+
+def main():
+    for casa in models.CasaLegislativa.objects.all():
+        if not models.Voto.objects.filter(casa_legislativa=casa).exists():
+            continue
+        print casa.nome_curto
+        for descricao, queryset in consultas_frequentes(casa):
+            print '  %s' % descricao
+            for linha in plano_de_execucao(queryset):
+                marca = '!!' if _varredura_completa(linha) else '  '
+                print '  %s  %s' % (marca, linha)
@@ -0,0 +1,3 @@
+-- Índice para as fatias de períodos das votações de uma casa legislativa
+-- (executado pelo syncdb depois da criação da tabela modelagem_votacao)
+CREATE INDEX modelagem_votacao_casa_legislativa_data ON modelagem_votacao (casa_legislativa_id, data);
@@ -0,0 +1,3 @@
+-- Índice para buscar o voto de uma legislatura em uma votação
+-- (executado pelo syncdb depois da criação da tabela modelagem_voto)
+CREATE INDEX modelagem_voto_votacao_legislatura ON modelagem_voto (votacao_id, legislatura_id);
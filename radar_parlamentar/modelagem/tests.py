@@ -22,6 +22,7 @@ from django.test import TestCase
 from importadores import convencao
 from datetime import date
 import models
+import planos
 import pdb
 
 class ModelsTest(TestCase):
@@ -88,6 +89,43 @@ class ModelsTest(TestCase):
         periodos = conv.periodos(models.MES,numero_minimo_de_votacoes=1)
         self.assertEqual(len(periodos),2)
         
+    def test_periodos_no_cache(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        conv.descarta_periodos_do_cache()
+        with self.assertNumQueries(1): # datas das votações (os limites são a primeira e a última)
+            conv.periodos(models.MES)
+            conv.periodos(models.ANO)
+        with self.assertNumQueries(0):
+            periodos = conv.periodos(models.MES, numero_minimo_de_votacoes=1)
+        self.assertEqual([p.quantidade_votacoes for p in periodos], [4, 4])
+        votacao = models.Votacao(data=date(1990, 3, 1), proposicao=models.Proposicao.objects.filter(casa_legislativa=conv)[0])
+        votacao.save()
+        self.assertEqual(len(conv.periodos(models.ANO)), 1) # cache só é descartado por importações
+        models.importacao_concluida.send(sender=None, casa_legislativa=conv)
+        self.assertEqual(len(conv.periodos(models.ANO)), 2)
+        self.assertEqual(conv.limites_das_datas(), (date(1989, 2, 2), date(1990, 3, 1)))
+        votacao.delete()
+        models.importacao_concluida.send(sender=None, casa_legislativa=conv)
+        self.assertEqual(len(conv.periodos(models.ANO)), 1)
+        with self.assertNumQueries(0): # limites recalculados pela importação
+            self.assertEqual(conv.limites_das_datas(), (date(1989, 2, 2), date(1989, 10, 10)))
+
+    def test_estatisticas_casa_legislativa(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        models.EstatisticasCasaLegislativa.objects.filter(casa_legislativa=conv).delete()
+        estatisticas = models.EstatisticasCasaLegislativa.da_casa(conv)
+        self.assertEquals(estatisticas.num_votacoes, 8)
+        self.assertEquals(estatisticas.num_votos, 72)
+        self.assertEquals(estatisticas.num_parlamentares, 9)
+        self.assertEquals(estatisticas.data_inicial, date(1989, 2, 2))
+        self.assertEquals(estatisticas.data_final, date(1989, 10, 10))
+        nomes = sorted(p.nome for p in estatisticas.partidos.all())
+        self.assertEquals(nomes, sorted([convencao.GIRONDINOS, convencao.JACOBINOS, convencao.MONARQUISTAS]))
+        with self.assertNumQueries(1):
+            models.EstatisticasCasaLegislativa.da_casa(conv)
+        models.importacao_concluida.send(sender=None, casa_legislativa=conv)
+        self.assertEquals(models.EstatisticasCasaLegislativa.objects.filter(casa_legislativa=conv).count(), 1)
+
     def test_sould_find_legislatura(self):
         dt = date(1989, 07, 14)
         try:
@@ -104,6 +142,143 @@ class ModelsTest(TestCase):
         except:
             self.assertTrue(True)
 
+    def test_indice_de_legislaturas(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        indice = models.IndiceDeLegislaturas(conv)
+        with self.assertNumQueries(0):
+            leg = indice.find(date(1989, 07, 14), 'Pierre')
+            self.assertEquals(leg.parlamentar.nome, 'Pierre')
+            leg = indice.find(date(1989, 07, 14), id_parlamentar='J1')
+            self.assertEquals(leg.parlamentar.id_parlamentar, 'J1')
+            self.assertEquals(leg.partido.nome, convencao.JACOBINOS)
+        self.assertRaises(ValueError, indice.find, date(1900, 07, 14), 'Pierre')
+        self.assertRaises(ValueError, indice.find, date(1989, 07, 14), 'Napoleão')
+        nova = models.Legislatura(parlamentar=leg.parlamentar, partido=leg.partido, casa_legislativa=conv,
+                                  inicio=date(1990, 1, 1), fim=date(1990, 12, 31))
+        indice.adiciona(nova)
+        self.assertEquals(indice.find(date(1990, 5, 1), id_parlamentar='J1'), nova)
+        self.assertEquals(indice.find(date(1989, 5, 1), id_parlamentar='J1'), leg)
+        self.assertRaises(ValueError, indice.find, date(1991, 5, 1), id_parlamentar='J1')
+        # busca pela filiação, sem consultar o banco
+        with self.assertNumQueries(0):
+            self.assertEquals(indice.da_filiacao(leg.parlamentar, leg.partido), leg)
+        outro_partido = models.Partido.objects.get(nome=convencao.GIRONDINOS)
+        self.assertEquals(indice.da_filiacao(leg.parlamentar, outro_partido), None)
+
+    def test_normaliza_resultado(self):
+        normaliza = models.Votacao.normaliza_resultado
+        self.assertEquals(normaliza('Aprovado'), models.APROVADO)
+        self.assertEquals(normaliza('Aprovado1'), models.APROVADO)
+        self.assertEquals(normaliza('Reprovado'), models.REJEITADO)
+        self.assertEquals(normaliza('A'), models.APROVADO)
+        self.assertEquals(normaliza(' R '), models.REJEITADO)
+        self.assertEquals(normaliza('Rejeitado o requerimento. Aprovada a emenda'), models.REJEITADO)
+        self.assertEquals(normaliza('PREJUDICADO POR FALTA DE QUÓRUM'), models.SEM_RESULTADO)
+        self.assertEquals(normaliza(None), models.SEM_RESULTADO)
+
+    def test_votacoes_e_votos_desnormalizados(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        self.assertEquals(models.Votacao.objects.filter(casa_legislativa=conv).count(), 8)
+        self.assertEquals(models.Voto.objects.filter(casa_legislativa=conv).count(), 72)
+        for voto in models.Voto.objects.filter(casa_legislativa=conv).select_related('legislatura'):
+            self.assertEquals(voto.partido_id, voto.legislatura.partido_id)
+        jacobinos = models.Partido.objects.get(nome=convencao.JACOBINOS)
+        self.assertEquals(models.Voto.objects.filter(partido=jacobinos).count(), 24)
+
+    def test_planos_das_consultas_frequentes(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        self.assertEquals(planos.varreduras_das_consultas_frequentes(conv), {})
+        self.assertEquals(len(planos.consultas_frequentes(conv)), 9)
+        sem_indice = models.Votacao.objects.filter(descricao='Reforma agrária')
+        self.assertEquals(len(planos.varreduras_completas(sem_indice)), 1)
+
+    def test_preenche_resultados_normalizados(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        votacoes = models.Votacao.objects.filter(casa_legislativa=conv).order_by('id')
+        sem_resultado = votacoes[0]
+        sem_resultado.resultado = 'Rejeitado'
+        sem_resultado.save()
+        do_resumo = votacoes[1]
+        descricao = do_resumo.descricao
+        do_resumo.descricao = 'Resumo: [Aprovada a redação final [art. 1]]. ObjVotacao: [Rejeitada a emenda]'
+        do_resumo.save()
+        try:
+            self.assertEquals(models.Votacao.preenche_resultados_normalizados(conv), 2)
+            self.assertEquals(models.Votacao.objects.get(id=sem_resultado.id).resultado_normalizado, models.REJEITADO)
+            self.assertEquals(models.Votacao.objects.get(id=do_resumo.id).resultado_normalizado, models.APROVADO)
+            self.assertEquals(models.Votacao.preenche_resultados_normalizados(conv), 0)
+        finally:
+            models.Votacao.objects.filter(id=sem_resultado.id).update(resultado='', resultado_normalizado=models.SEM_RESULTADO)
+            models.Votacao.objects.filter(id=do_resumo.id).update(descricao=descricao, resultado_normalizado=models.SEM_RESULTADO)
+
+    def test_cubo_de_votos(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        cubo = models.CuboDeVotos.da_casa(conv)
+        self.assertEquals(cubo.num_votacoes, 8)
+        self.assertEquals(conv.num_votos(), 72)
+        self.assertEquals(conv.num_votos(date(1989, 1, 1), date(1989, 6, 30)), 36)
+        self.assertEquals(cubo.num_votacoes_entre(date(1989, 7, 1), None), 4)
+        self.assertEquals(cubo.num_votos(date(1990, 1, 1), None), 0)
+        tamanhos = cubo.tamanhos_partidos()
+        self.assertEquals(tamanhos[convencao.JACOBINOS], convencao.PARLAMENTARES_POR_PARTIDO)
+        presencas = cubo.presencas_partidos(date(1989, 7, 1), date(1989, 12, 31))
+        self.assertAlmostEqual(presencas[convencao.MONARQUISTAS], 9.0/12)
+        self.assertEquals(presencas[convencao.GIRONDINOS], 1.0)
+        # atualização incremental com uma votação nova
+        leg = models.Legislatura.objects.filter(casa_legislativa=conv)[0]
+        leg.localidade = 'PB'
+        leg.save()
+        votacao = models.Votacao(data=date(1990, 3, 1), proposicao=models.Proposicao.objects.filter(casa_legislativa=conv)[0])
+        votacao.save()
+        models.Voto(votacao=votacao, legislatura=leg, opcao=models.SIM).save()
+        cubo = models.CuboDeVotos.da_casa(conv)
+        self.assertEquals(cubo.num_votacoes, 9)
+        self.assertEquals(conv.num_votos(), 73)
+        sim = cubo.INDICES_OPCOES[models.SIM]
+        self.assertEquals(cubo.contagens_ufs(date(1990, 1, 1))[cubo.ufs.index('PB'), sim], 1)
+        # remoção de votação contada faz o cubo ser refeito
+        votacao.delete()
+        leg.localidade = ''
+        leg.save()
+        cubo = models.CuboDeVotos.da_casa(conv)
+        self.assertEquals(cubo.num_votacoes, 8)
+        self.assertEquals(conv.num_votos(), 72)
+        self.assertEquals(cubo.ufs, [''])
+
+    def test_por_partido_sem_partido_no_voto(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        votacao = models.Votacao.objects.filter(casa_legislativa=conv).order_by('id')[0]
+        esperado = dict((nome, (vp.sim, vp.nao, vp.abstencao)) for nome, vp in votacao.por_partido().items())
+        # banco anterior à cópia do partido para o voto
+        models.Voto.objects.filter(votacao=votacao).update(partido=None)
+        try:
+            obtido = dict((nome, (vp.sim, vp.nao, vp.abstencao)) for nome, vp in votacao.por_partido().items())
+            self.assertEquals(obtido, esperado)
+            self.assertEquals(sorted(obtido.keys()), sorted([convencao.GIRONDINOS, convencao.JACOBINOS, convencao.MONARQUISTAS]))
+        finally:
+            for voto in models.Voto.objects.filter(votacao=votacao):
+                voto.save() # o partido é copiado da legislatura
+
+    def test_cubo_refeito_ao_fim_da_importacao(self):
+        conv = models.CasaLegislativa.objects.get(nome_curto='conv')
+        models.CuboDeVotos.da_casa(conv)
+        # voto novo em votação já contada: a atualização incremental não o vê
+        votacao = models.Votacao.objects.filter(casa_legislativa=conv)[0]
+        leg = models.Legislatura(parlamentar=models.Parlamentar.objects.filter(legislatura__casa_legislativa=conv)[0],
+                                 partido=models.Partido.objects.get(nome=convencao.JACOBINOS),
+                                 casa_legislativa=conv, inicio=convencao.INICIO_PERIODO, fim=convencao.FIM_PERIODO)
+        leg.save()
+        voto = models.Voto(votacao=votacao, legislatura=leg, opcao=models.SIM)
+        voto.save()
+        try:
+            self.assertEquals(conv.num_votos(), 72)
+            models.importacao_concluida.send(sender=None, casa_legislativa=conv)
+            self.assertEquals(conv.num_votos(), 73)
+        finally:
+            voto.delete()
+            leg.delete()
+            models.importacao_concluida.send(sender=None, casa_legislativa=conv)
+
     def test_deleta_casa(self):
 
     	partidoTest1 = models.Partido()
@@ -28,6 +28,10 @@ urlpatterns = patterns('',
     url(r'^analises/analise/(?P<nome_curto_casa_legislativa>\w*)/$', 'analises.views.analise'),
     url(r'^analises/analise/(?P<nome_curto_casa_legislativa>\w*)/json_pca/$', 'analises.views.json_pca'),
     url(r'^analises/json_analise/(?P<nome_curto_casa_legislativa>\w*)/$', 'analises.views.json_analise'),
+    url(r'^analises/json_dendrograma/(?P<nome_curto_casa_legislativa>\w*)/$', 'analises.views.json_dendrograma'),
+    url(r'^analises/json_mudancas/(?P<nome_curto_casa_legislativa>\w*)/$', 'analises.views.json_mudancas'),
+    url(r'^analises/json_presencas/(?P<nome_curto_casa_legislativa>\w*)/$', 'analises.views.json_presencas'),
+    url(r'^analises/json_similares/(?P<nome_curto_casa_legislativa>\w*)/(?P<id_parlamentar>\d+)/$', 'analises.views.json_similares'),
 
     # Uncomment the admin/doc line below to enable admin documentation:
     # url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
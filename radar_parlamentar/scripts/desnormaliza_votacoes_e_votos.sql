@@ -0,0 +1,20 @@
+-- Acrescenta, em bancos criados antes delas, as colunas casa_legislativa_id de
+-- modelagem_votacao e partido_id e casa_legislativa_id de modelagem_voto
+-- (cópias de proposicao.casa_legislativa e de legislatura.partido e
+-- legislatura.casa_legislativa), preenche essas colunas em lote e cria os índices.
+-- Ex: sqlite3 radar_parlamentar.db < scripts/desnormaliza_votacoes_e_votos.sql
+
+ALTER TABLE modelagem_votacao ADD COLUMN casa_legislativa_id integer NULL REFERENCES modelagem_casalegislativa (id);
+ALTER TABLE modelagem_voto ADD COLUMN partido_id integer NULL REFERENCES modelagem_partido (id);
+ALTER TABLE modelagem_voto ADD COLUMN casa_legislativa_id integer NULL REFERENCES modelagem_casalegislativa (id);
+
+UPDATE modelagem_votacao SET casa_legislativa_id = 
+    (SELECT prop.casa_legislativa_id FROM modelagem_proposicao AS prop WHERE prop.id = modelagem_votacao.proposicao_id);
+UPDATE modelagem_voto SET 
+    partido_id = (SELECT leg.partido_id FROM modelagem_legislatura AS leg WHERE leg.id = modelagem_voto.legislatura_id),
+    casa_legislativa_id = (SELECT leg.casa_legislativa_id FROM modelagem_legislatura AS leg WHERE leg.id = modelagem_voto.legislatura_id);
+
+CREATE INDEX modelagem_votacao_casa_legislativa_id ON modelagem_votacao (casa_legislativa_id);
+CREATE INDEX modelagem_votacao_casa_legislativa_data ON modelagem_votacao (casa_legislativa_id, data);
+CREATE INDEX modelagem_voto_partido_id ON modelagem_voto (partido_id);
+CREATE INDEX modelagem_voto_casa_legislativa_id ON modelagem_voto (casa_legislativa_id);
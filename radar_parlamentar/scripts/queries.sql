@@ -16,3 +16,21 @@ SELECT count(*) FROM modelagem_votacao AS vot JOIN modelagem_proposicao AS prop
 SELECT prop.casa_legislativa_id, count(*) FROM modelagem_votacao AS vot JOIN modelagem_proposicao AS prop ON vot.proposicao_id = prop.id GROUP BY prop.casa_legislativa_id;
 
 
+-- Acrescenta a coluna resultado_normalizado (Votacao.resultado_normalizado) em bancos criados antes dela.
+-- As votações existentes ficam sem resultado (0); para preenchê-las a partir do resultado
+-- (ou do resumo, na câmara) já gravado, execute no shell do Django (python manage.py shell):
+--   from modelagem import models; models.Votacao.preenche_resultados_normalizados()
+-- (isto também é feito para a casa ao fim de cada importação)
+ALTER TABLE modelagem_votacao ADD COLUMN resultado_normalizado smallint NOT NULL DEFAULT 0;
+
+-- Cria o índice das datas das votações (Votacao.data) em bancos criados antes dele
+CREATE INDEX modelagem_votacao_data ON modelagem_votacao (data);
+
+-- Cria, em bancos criados antes deles, os índices dos campos usados nas buscas dos importadores
+-- (Parlamentar.nome, Parlamentar.id_parlamentar, Proposicao.id_prop, Votacao.id_vot)
+-- e o índice composto do voto de uma legislatura em uma votação (modelagem/sql/voto.sql)
+CREATE INDEX modelagem_parlamentar_nome ON modelagem_parlamentar (nome);
+CREATE INDEX modelagem_parlamentar_id_parlamentar ON modelagem_parlamentar (id_parlamentar);
+CREATE INDEX modelagem_proposicao_id_prop ON modelagem_proposicao (id_prop);
+CREATE INDEX modelagem_votacao_id_vot ON modelagem_votacao (id_vot);
+CREATE INDEX modelagem_voto_votacao_legislatura ON modelagem_voto (votacao_id, legislatura_id);
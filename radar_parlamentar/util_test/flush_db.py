@@ -1,5 +1,6 @@
 from django.db import (connections,DEFAULT_DB_ALIAS)
 from django.core.management import call_command
+from django.core.cache import cache
 
 def flush_db(cls):
     if getattr(cls,'multi_db',False):
@@ -8,3 +9,4 @@ def flush_db(cls):
         databases = [DEFAULT_DB_ALIAS]
     for db_name in databases:
         call_command('flush',verbosity=0, interactive=False,database=db_name)
+    cache.clear()